@@ -7,7 +7,9 @@ backlog = 2048
 
 # Worker processes
 workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
-worker_class = 'sync'
+# Sync workers for the site (myproject.wsgi). The `events` process serves
+# the payment status streams with `-k uvicorn.workers.UvicornWorker`
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
 worker_connections = 1000
 timeout = 120
 keepalive = 2
@@ -35,4 +37,10 @@ tmp_upload_dir = None
 
 # SSL (not needed for Railway)
 keyfile = None
-certfile = None
\ No newline at end of file
+certfile = None
+
+
+def post_worker_init(worker):
+    """Warm per-worker in-memory indexes before the first request arrives"""
+    from shop.suggest import warm_index
+    warm_index()
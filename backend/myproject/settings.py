@@ -50,6 +50,13 @@ ALLOWED_HOSTS.extend([
     'testserver'  # For testing
 ])
 
+# Hosts the pre-serialized catalog snapshots (shop.catalog_snapshot) are
+# built for; requests for any other host are served by the views. Set
+# explicitly because ALLOWED_HOSTS is '*' in production
+CATALOG_SNAPSHOT_HOSTS = [
+    host.strip() for host in os.getenv('CATALOG_SNAPSHOT_HOSTS', '').split(',') if host.strip()
+] or [host for host in ALLOWED_HOSTS if '*' not in host]
+
 # Allow all hosts in production (Railway will handle the routing)
 if not DEBUG:
     ALLOWED_HOSTS = ['*']
@@ -84,7 +91,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise that doesn't force async views into threads under ASGI
+    'myproject.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -154,7 +162,11 @@ elif DATABASE_URL:
         # Add production database settings for Railway deployment
         if not DEBUG or os.getenv('RAILWAY_ENVIRONMENT'):
             DATABASES['default'].update({
-                'CONN_MAX_AGE': 600,  # Connection pooling
+                # Persistent connections for the WSGI workers. The ASGI events
+                # process sets DB_CONN_MAX_AGE=0: there each request's database
+                # work runs in a new thread, so kept connections would leak
+                'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '600')),
+                'CONN_HEALTH_CHECKS': True,
                 'OPTIONS': {
                     'sslmode': 'require',  # Require SSL for production
                 },
@@ -182,6 +194,48 @@ else:
     print(f"Development: Using SQLite database at: {DATABASES['default']['NAME']}")
 
 
+# Cache
+# shop.cache namespaces the keys. Versioned namespaces (catalog, stock,
+# promo codes) are invalidated by bumping a version key, which only reaches
+# every worker and replica through a shared cache: set REDIS_URL whenever
+# more than one process serves requests. Without it each process keeps its
+# own in-memory cache (no round trips), and another worker may serve a
+# cached catalog response until it expires. DATABASE_CACHE=True uses a
+# table in the main database instead (shared, but every read is a query;
+# created after migrate, see shop.signals).
+
+REDIS_URL = os.getenv('REDIS_URL')
+DATABASE_CACHE = os.getenv('DATABASE_CACHE', 'False').lower() == 'true'
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'entstore',
+            'TIMEOUT': 300,
+        }
+    }
+elif DATABASE_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'entstore_cache',
+            'TIMEOUT': 300,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'entstore',
+            'TIMEOUT': 300,
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -293,6 +347,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_RENDERER_CLASSES': [
+        'shop.renderers.ORJSONRenderer',
         'rest_framework.renderers.JSONRenderer',
     ],
     'DEFAULT_PARSER_CLASSES': [
@@ -348,6 +403,7 @@ CORS_ALLOW_HEADERS = [
     'x-requested-with',
     'x-forwarded-for',
     'x-forwarded-proto',
+    'idempotency-key',
 ]
 CORS_ALLOW_METHODS = [
     'DELETE',
@@ -362,6 +418,7 @@ CORS_ALLOW_METHODS = [
 CORS_EXPOSE_HEADERS = [
     'content-type',
     'x-csrftoken',
+    'idempotent-replayed',
 ]
 
 # CSRF Configuration
@@ -467,6 +524,12 @@ SERVER_EMAIL = DEFAULT_FROM_EMAIL
 # Reply-to email (your business email)
 REPLY_TO_EMAIL = 'Enontinoclothing@gmail.com'
 
+# Queue emails in the EmailOutbox table for the run_email_worker process
+# instead of sending them over SMTP during the request. Off by default: the
+# deployed start commands only run the web process, so only turn it on
+# where the worker (Procfile `worker:`) runs too
+EMAIL_OUTBOX_ENABLED = os.getenv('EMAIL_OUTBOX_ENABLED', 'False').lower() == 'true'
+
 # Logging configuration
 LOGGING = {
     'version': 1,
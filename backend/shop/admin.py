@@ -1,10 +1,12 @@
 from django.contrib import admin
 from django.utils.html import format_html
+from django.utils import timezone
 from django import forms
 from .models import (
     Category, Product, ProductTag, ProductTagAssignment, Order, OrderItem,
     ProductImage, ProductSize, ProductColor, ProductVariant, PromoCode,
-    ProductReview, ReviewHelpfulVote, ReviewImage
+    ProductReview, ReviewHelpfulVote, ReviewImage, StockReservation, EmailOutbox,
+    MomoTransaction, ExchangeRate
 )
 
 
@@ -125,7 +127,7 @@ class ProductAdmin(admin.ModelAdmin):
     list_display = ['title', 'category', 'price_display', 'image_source', 'stock_quantity', 'is_active', 'is_featured', 'created_at']
     list_filter = ['category', 'is_active', 'is_featured', 'created_at', 'tag_assignments__tag']
     search_fields = ['title', 'id', 'description']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['created_at', 'updated_at', 'average_rating', 'review_count']
     prepopulated_fields = {'slug': ('title',)}
     inlines = [ProductTagAssignmentInline, ProductImageInline, ProductVariantInline]
     
@@ -149,6 +151,10 @@ class ProductAdmin(admin.ModelAdmin):
         ('Inventory & Settings', {
             'fields': ('stock_quantity', 'is_active', 'is_featured')
         }),
+        ('Reviews', {
+            'fields': ('average_rating', 'review_count'),
+            'classes': ('collapse',)
+        }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
@@ -369,21 +375,19 @@ class OrderAdmin(admin.ModelAdmin):
     
     def send_shipping_confirmation(self, request, queryset):
         """Send shipping confirmation emails for selected orders."""
-        from .email_service import send_shipping_confirmation_email
-        from django.utils import timezone
+        from .email_service import send_shipping_confirmation_emails
         
-        sent = 0
-        for order in queryset:
-            if order.status in ['shipped', 'delivered']:
-                tracking_number = f"ENT{order.id}{order.updated_at.strftime('%Y%m%d') if order.updated_at else timezone.now().strftime('%Y%m%d')}"
-                success = send_shipping_confirmation_email(
-                    order=order,
-                    tracking_number=tracking_number,
-                    carrier="Standard Shipping",
-                    estimated_days=3
-                )
-                if success:
-                    sent += 1
+        shipments = []
+        for order in queryset.filter(status__in=['shipped', 'delivered']).prefetch_related('items__product'):
+            tracking_number = f"ENT{order.id}{order.updated_at.strftime('%Y%m%d') if order.updated_at else timezone.now().strftime('%Y%m%d')}"
+            shipments.append((order, tracking_number))
+        
+        # Rendered in one pass and queued together
+        sent = send_shipping_confirmation_emails(
+            shipments,
+            carrier="Standard Shipping",
+            estimated_days=3
+        )
         
         self.message_user(
             request,
@@ -530,6 +534,54 @@ class ProductVariantAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('product', 'size', 'color')
 
 
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['reference', 'product', 'variant', 'quantity', 'expires_at', 'created_at']
+    list_filter = ['expires_at']
+    search_fields = ['reference', 'product__title']
+    readonly_fields = ['created_at']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product', 'variant', 'variant__size', 'variant__color')
+
+
+@admin.register(MomoTransaction)
+class MomoTransactionAdmin(admin.ModelAdmin):
+    list_display = ['reference', 'phone', 'usd_amount', 'ghs_amount', 'status', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['reference', 'phone']
+    readonly_fields = ['conversion_info', 'created_at', 'updated_at']
+    
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'status' in form.changed_data and obj.status == 'failed':
+            from .reservations import release_reservations
+            release_reservations(obj.reference)
+        # Status polls read from the cache
+        from .momo import refresh_cached_transaction
+        refresh_cached_transaction(obj.reference)
+
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ['base', 'quote', 'rate', 'source', 'fetched_at']
+    readonly_fields = ['fetched_at']
+    
+    def save_model(self, request, obj, form, change):
+        obj.source = 'manual'
+        obj.fetched_at = timezone.now()
+        super().save_model(request, obj, form, change)
+        # Conversions read the rate through the cache
+        from django.db import transaction
+        from .cache import EXCHANGE_RATES
+        from .catalog_cache import bump_catalog_version
+        from .currency_service import CurrencyConverter
+        from .price_book import rebuild_price_book
+        EXCHANGE_RATES.delete(CurrencyConverter.CACHE_KEY)
+        rebuild_price_book([obj.quote])
+        transaction.on_commit(bump_catalog_version)
+
+
 @admin.register(PromoCode)
 class PromoCodeAdmin(admin.ModelAdmin):
     list_display = ['code', 'description', 'discount_type', 'discount_value', 'is_active', 'usage_count', 'valid_from', 'valid_until']
@@ -606,12 +658,17 @@ class ProductReviewAdmin(admin.ModelAdmin):
     actions = ['approve_reviews', 'disapprove_reviews', 'feature_reviews']
     
     def approve_reviews(self, request, queryset):
+        product_ids = set(queryset.values_list('product_id', flat=True))
         updated = queryset.update(is_approved=True)
+        # queryset.update() skips the review signals, so rebuild the aggregates
+        Product.recalculate_review_stats(product_ids)
         self.message_user(request, f'{updated} review(s) approved.')
     approve_reviews.short_description = "Approve selected reviews"
     
     def disapprove_reviews(self, request, queryset):
+        product_ids = set(queryset.values_list('product_id', flat=True))
         updated = queryset.update(is_approved=False)
+        Product.recalculate_review_stats(product_ids)
         self.message_user(request, f'{updated} review(s) disapproved.')
     disapprove_reviews.short_description = "Disapprove selected reviews"
     
@@ -640,4 +697,24 @@ class ReviewImageAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at']
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('review', 'review__product')
\ No newline at end of file
+        return super().get_queryset(request).select_related('review', 'review__product')
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['subject', 'to']
+    readonly_fields = ['attempts', 'last_error', 'created_at', 'sent_at']
+    actions = ['retry_emails']
+    
+    def recipients(self, obj):
+        return ', '.join(obj.to)
+    recipients.short_description = "To"
+    
+    def retry_emails(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(
+            status='pending', attempts=0, next_attempt_at=timezone.now()
+        )
+        self.message_user(request, f'{updated} email(s) queued for another attempt.')
+    retry_emails.short_description = "Retry selected emails"
@@ -0,0 +1,156 @@
+"""
+Namespaced access to the shared cache (settings.CACHES).
+
+Every cached thing in the shop belongs to one of the namespaces below,
+which sets its key prefix and default timeout:
+
+    from .cache import MOMO
+    MOMO.set(f'txn:{reference}', state, timeout=2)
+    MOMO.get(f'txn:{reference}')
+
+A versioned namespace folds a version number into its keys. invalidate()
+bumps it, which orphans every entry in the namespace at once (the catalog
+does this on every product change): no key tracking or pattern deletes.
+
+Each namespace counts its hits and misses, per process; stats() reports
+them.
+"""
+
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+_MISSING = object()
+
+_namespaces = {}
+
+
+class Namespace:
+    """A key prefix and default timeout within the shared cache"""
+
+    def __init__(self, name, timeout=300, versioned=False):
+        self.name = name
+        self.timeout = timeout
+        self.versioned = versioned
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        _namespaces[name] = self
+
+    def __repr__(self):
+        return f'<Namespace {self.name}>'
+
+    # Versions
+
+    @property
+    def _version_key(self):
+        return f'{self.name}:version'
+
+    def version(self):
+        """Current version of a versioned namespace, initialising it if needed"""
+        version = cache.get(self._version_key)
+        if version is None:
+            # Seed from the clock so a flushed cache never reuses old versions
+            cache.add(self._version_key, int(time.time() * 1000), None)
+            version = cache.get(self._version_key)
+        return version
+
+    async def aversion(self):
+        """version() for async code"""
+        version = await cache.aget(self._version_key)
+        if version is None:
+            await cache.aadd(self._version_key, int(time.time() * 1000), None)
+            version = await cache.aget(self._version_key)
+        return version
+
+    def invalidate(self):
+        """Orphan every entry of a versioned namespace; returns the new version"""
+        if not self.versioned:
+            raise ValueError(f"{self.name!r} is not a versioned namespace")
+        try:
+            return cache.incr(self._version_key)
+        except ValueError:
+            version = int(time.time() * 1000)
+            cache.set(self._version_key, version, None)
+            return version
+
+    def make_key(self, key, version=None):
+        """
+        Full cache key for `key`. Versioned namespaces look the version up
+        unless it's passed in (pass it when making several keys at once).
+        """
+        if not self.versioned:
+            return f'{self.name}:{key}'
+        return f'{self.name}:{self.version() if version is None else version}:{key}'
+
+    # Reads and writes
+
+    def _record(self, value):
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def _timeout(self, timeout):
+        return self.timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def get(self, key, default=None, version=None):
+        value = cache.get(self.make_key(key, version), _MISSING)
+        self._record(value)
+        return default if value is _MISSING else value
+
+    async def aget(self, key, default=None):
+        version = None
+        if self.versioned:
+            version = await self.aversion()
+        value = await cache.aget(self.make_key(key, version), _MISSING)
+        self._record(value)
+        return default if value is _MISSING else value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        cache.set(self.make_key(key, version), value, self._timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        """Set `key` only if it's missing; True if it was set"""
+        return cache.add(self.make_key(key, version), value, self._timeout(timeout))
+
+    def delete(self, key, version=None):
+        cache.delete(self.make_key(key, version))
+
+    def get_or_set(self, key, compute, timeout=DEFAULT_TIMEOUT, version=None):
+        """Cached value of `key`, or compute() stored under it"""
+        value = self.get(key, _MISSING, version)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value, timeout, version)
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+def stats():
+    """{namespace: {'hits', 'misses', 'hit_rate'}} for this process"""
+    return {name: namespace.stats() for name, namespace in _namespaces.items()}
+
+
+# Catalog responses and facet counts; bumped on every catalog change
+CATALOG = Namespace('catalog', timeout=300, versioned=True)
+# Only its version is used: bumped when stock levels change (orders, holds),
+# folded into the keys of catalog entries that show stock
+STOCK = Namespace('stock', versioned=True)
+# Stored exchange rates (shop.currency_service)
+EXCHANGE_RATES = Namespace('fx', timeout=60)
+# MoMo payments (shop.momo)
+MOMO = Namespace('momo', timeout=3600)
+# Stripe checkout session statuses, published by the webhook
+STRIPE_SESSIONS = Namespace('stripe', timeout=3600)
+# Promo code lookups; bumped when a promo code changes
+PROMO_CODES = Namespace('promo', timeout=300, versioned=True)
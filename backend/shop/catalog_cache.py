@@ -0,0 +1,188 @@
+"""
+Versioned response cache for read-only catalog endpoints.
+
+Responses are cached in the versioned CATALOG namespace (shop.cache).
+Signal handlers in shop.signals bump its version whenever a catalog model
+changes, which orphans all previously cached responses at once - no key
+tracking or pattern deletes needed. Stock changes (every order) bump the
+separate STOCK version instead, which only orphans the responses that
+show stock: categories and the suggest index survive them. Responses carry a strong ETag and
+conditional GETs with a matching If-None-Match get a 304.
+"""
+
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import cc_delim_re, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+import logging
+
+from .cache import CATALOG, STOCK
+from .price_book import resolve_currency
+
+logger = logging.getLogger(__name__)
+
+# Entries also expire on their own, as a safety net
+CATALOG_CACHE_TIMEOUT = CATALOG.timeout
+
+# Query parameters that never change the response (frontend cache-busters)
+IGNORED_QUERY_PARAMS = {'_t'}
+
+# Longest a VersionCheck goes without re-reading the version
+VERSION_CHECK_INTERVAL = 1.0
+
+_version_checks = []
+
+
+class VersionCheck:
+    """
+    A version read from the cache at most once every `interval` seconds per
+    process, for in-memory data (catalog snapshots, the suggest index) that
+    must not cost a cache round trip per request. Bumps made in this
+    process reset every check, so only other workers' changes take up to
+    `interval` to be noticed.
+    """
+
+    def __init__(self, read, interval=VERSION_CHECK_INTERVAL):
+        self.read = read
+        self.interval = interval
+        self._value = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        _version_checks.append(self)
+
+    def get(self):
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < self.interval:
+                return self._value
+        value = self.read()
+        with self._lock:
+            self._value, self._checked_at = value, time.monotonic()
+        return value
+
+    def reset(self):
+        with self._lock:
+            self._checked_at = None
+
+
+def reset_version_checks():
+    for check in _version_checks:
+        check.reset()
+
+
+def get_catalog_version():
+    """Return the current catalog version, initialising it if needed"""
+    return CATALOG.version()
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog response"""
+    version = CATALOG.invalidate()
+    reset_version_checks()
+    logger.debug(f"Catalog version bumped to {version}")
+
+    from .catalog_snapshot import schedule_rebuild
+    schedule_rebuild()
+    return version
+
+
+def get_stock_version():
+    return STOCK.version()
+
+
+def bump_stock_version():
+    """Invalidate cached catalog responses that show stock levels"""
+    version = STOCK.invalidate()
+    reset_version_checks()
+    logger.debug(f"Stock version bumped to {version}")
+
+    from .catalog_snapshot import schedule_rebuild
+    schedule_rebuild()
+    return version
+
+
+def get_listing_version():
+    """Version for cached data that depends on both the catalog and stock"""
+    return f"{get_catalog_version()}.{get_stock_version()}"
+
+
+def catalog_cache_key(request):
+    """Key (within CATALOG) for a request: host + path + relevant query + currency"""
+    query = sorted(
+        (key, value)
+        for key, values in request.GET.lists()
+        if key not in IGNORED_QUERY_PARAMS
+        for value in values
+    )
+    # The currency can also come from Accept-Language
+    raw = f"{request.get_host()}|{request.path}|{query}|{resolve_currency(request)}"
+    return f"response:{hashlib.sha256(raw.encode()).hexdigest()}"
+
+
+def make_etag(content):
+    """Strong ETag derived from the response body"""
+    return quote_etag(hashlib.sha256(content).hexdigest()[:32])
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags
+
+
+def _finalize(request, content, content_type, etag, vary=()):
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type=content_type)
+    response['ETag'] = etag
+    # The view's own Vary (e.g. DRF's Accept), plus the currency negotiation
+    patch_vary_headers(response, [*vary, 'Accept-Language'])
+    # Let clients keep the body but revalidate it on every use
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def catalog_cached(view_func=None, *, stock=True):
+    """
+    Cache successful GET responses of a catalog view under the current
+    catalog version, and stock version unless `stock=False` (the response
+    shows no stock levels). Works on function views and, via
+    method_decorator, on the dispatch() of class-based views; use
+    catalog_cached(stock=False) for the variant.
+    """
+    if view_func is None:
+        return lambda view_func: catalog_cached(view_func, stock=stock)
+
+    @wraps(view_func)
+    def wrapped(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view_func(request, *args, **kwargs)
+
+        key = catalog_cache_key(request)
+        version = get_listing_version() if stock else get_catalog_version()
+        entry = CATALOG.get(key, version=version)
+        if entry is not None:
+            return _finalize(request, entry['content'], entry['content_type'], entry['etag'], entry.get('vary', ()))
+
+        response = view_func(request, *args, **kwargs)
+        if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+            response.render()
+        if response.status_code != 200 or getattr(response, 'streaming', False):
+            return response
+
+        entry = {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'etag': make_etag(response.content),
+            'vary': cc_delim_re.split(response['Vary']) if response.has_header('Vary') else [],
+        }
+        CATALOG.set(key, entry, version=version)
+        return _finalize(request, entry['content'], entry['content_type'], entry['etag'], entry['vary'])
+
+    return wrapped
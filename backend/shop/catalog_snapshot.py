@@ -0,0 +1,243 @@
+"""
+Pre-serialized catalog snapshots.
+
+The default (unfiltered) products list, the category list and the featured
+products are materialized into JSON byte blobs - plain and pre-gzipped -
+held in worker memory. Requests for those routes are answered straight from
+the blobs with a bare HttpResponse: no queries, no serializers, no renderer.
+
+Snapshots are built per host (absolute media URLs depend on it) by running
+the real views once, so the bytes are identical to a normal response. Only
+the hosts in settings.CATALOG_SNAPSHOT_HOSTS get one, so arbitrary Host
+headers can't grow worker memory. They are rebuilt in a background thread
+after catalog and stock changes, and are only served while their catalog
+and stock versions are current (checked at most once a second, so serving
+one costs no cache round trip either).
+"""
+
+import gzip
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils.cache import cc_delim_re, patch_vary_headers
+
+from .catalog_cache import (
+    CATALOG_CACHE_TIMEOUT, IGNORED_QUERY_PARAMS, VersionCheck, etag_matches, get_listing_version, make_etag
+)
+from .price_book import BASE_CURRENCY, resolve_currency
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Snapshots older than this are rebuilt even without a version bump, in
+# case a bump was lost (e.g. the cache was flushed)
+SNAPSHOT_MAX_AGE = CATALOG_CACHE_TIMEOUT
+
+# Debounce for rebuilds triggered by catalog changes (admin saves come in bursts)
+REBUILD_DELAY = 1.0
+
+# Request headers needed to reproduce absolute URLs when building off-request
+_FORWARDED_META = (
+    'HTTP_HOST', 'SERVER_NAME', 'SERVER_PORT', 'HTTP_X_FORWARDED_HOST',
+    'HTTP_X_FORWARDED_PORT', 'HTTP_X_FORWARDED_PROTO', 'wsgi.url_scheme',
+)
+
+_routes = {}      # name -> (view, path)
+_templates = {}   # host -> META subset of a request seen for that host
+_snapshots = {}   # host -> CatalogSnapshot
+_building = set()
+_lock = threading.Lock()
+_rebuild_timer = None
+
+# Serving a snapshot reads no cache: the version is re-checked at most
+# once a second per worker
+_listing_version = VersionCheck(get_listing_version)
+
+
+def accepts_gzip(request):
+    """
+    Whether Accept-Encoding allows gzip: listed (or covered by `*`) with a
+    non-zero q-value. `gzip;q=0` refuses it.
+    """
+    qualities = {}
+    for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, *params = [piece.strip() for piece in part.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    quality = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0)))
+    return quality > 0
+
+
+class SnapshotEntry:
+    """One route's pre-encoded response body"""
+
+    __slots__ = ('content', 'gzip_content', 'content_type', 'etag', 'gzip_etag', 'vary')
+
+    def __init__(self, content, content_type, vary=()):
+        self.content = content
+        self.gzip_content = gzip.compress(content, compresslevel=6)
+        self.content_type = content_type
+        self.etag = make_etag(content)
+        # A different representation needs a different strong validator
+        self.gzip_etag = self.etag[:-1] + '-gz"'
+        self.vary = list(vary)
+
+    def to_response(self, request):
+        use_gzip = accepts_gzip(request)
+        etag = self.gzip_etag if use_gzip else self.etag
+
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        elif use_gzip:
+            response = HttpResponse(self.gzip_content, content_type=self.content_type)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(self.content, content_type=self.content_type)
+
+        response['ETag'] = etag
+        patch_vary_headers(response, [*self.vary, 'Accept-Encoding', 'Accept-Language'])
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
+class CatalogSnapshot:
+    """All snapshot entries for one host at one catalog/stock version"""
+
+    def __init__(self, version, entries):
+        self.version = version
+        self.entries = entries
+        self.built_at = time.monotonic()
+
+    def is_current(self, version):
+        return self.version == version and time.monotonic() - self.built_at < SNAPSHOT_MAX_AGE
+
+
+class _SnapshotRequest(HttpRequest):
+    """Minimal GET request replaying the host/scheme of a real request"""
+
+    def __init__(self, meta, path):
+        super().__init__()
+        self.method = 'GET'
+        self.path = self.path_info = path
+        self.META = dict(meta)
+
+    def _get_scheme(self):
+        return self.META.get('wsgi.url_scheme', 'http')
+
+
+def _is_bare(request):
+    """True when the request has no query parameters that affect the payload, and wants USD prices"""
+    return all(key in IGNORED_QUERY_PARAMS for key in request.GET) and resolve_currency(request) == BASE_CURRENCY
+
+
+def build_snapshot(host):
+    """Render every registered route for a host and store the result"""
+    meta = _templates.get(host)
+    if meta is None:
+        return None
+
+    version = get_listing_version()
+    entries = {}
+    for name, (view, path) in list(_routes.items()):
+        if path is None:
+            continue
+        try:
+            response = view(_SnapshotRequest(meta, path))
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                response.render()
+            if response.status_code == 200:
+                vary = cc_delim_re.split(response['Vary']) if response.has_header('Vary') else ()
+                entries[name] = SnapshotEntry(response.content, response['Content-Type'], vary)
+        except Exception as e:
+            logger.error(f"Catalog snapshot build failed for {name} on {host}: {e}")
+
+    snapshot = CatalogSnapshot(version, entries)
+    with _lock:
+        _snapshots[host] = snapshot
+    logger.info(f"Catalog snapshot built for {host} (version {version}, {len(entries)} routes)")
+    return snapshot
+
+
+def _build_in_background(host):
+    with _lock:
+        if host in _building:
+            return
+        _building.add(host)
+
+    def run():
+        try:
+            build_snapshot(host)
+        finally:
+            close_old_connections()
+            with _lock:
+                _building.discard(host)
+
+    threading.Thread(target=run, name=f'catalog-snapshot-{host}', daemon=True).start()
+
+
+def schedule_rebuild():
+    """Rebuild the snapshots of all known hosts shortly after a catalog change"""
+    global _rebuild_timer
+    if not _templates:
+        return
+
+    def rebuild_all():
+        with _lock:
+            hosts = list(_templates)
+        for host in hosts:
+            _build_in_background(host)
+
+    with _lock:
+        if _rebuild_timer is not None:
+            _rebuild_timer.cancel()
+        _rebuild_timer = threading.Timer(REBUILD_DELAY, rebuild_all)
+        _rebuild_timer.daemon = True
+        _rebuild_timer.start()
+
+
+def snapshot_view(name, view):
+    """
+    Wrap a catalog view so bare GET requests are answered from the snapshot.
+    Anything with filters, or arriving while the snapshot is stale, falls
+    through to the wrapped view and kicks off a background rebuild.
+    """
+    _routes[name] = (view, None)
+
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if request.method != 'GET' or not _is_bare(request):
+            return view(request, *args, **kwargs)
+
+        host = request.get_host()
+        if host not in settings.CATALOG_SNAPSHOT_HOSTS:
+            return view(request, *args, **kwargs)
+
+        snapshot = _snapshots.get(host)
+        if snapshot is not None and snapshot.is_current(_listing_version.get()):
+            entry = snapshot.entries.get(name)
+            if entry is not None:
+                return entry.to_response(request)
+
+        if _routes[name][1] is None:
+            _routes[name] = (view, request.path)
+        with _lock:
+            if host not in _templates:
+                _templates[host] = {key: request.META[key] for key in _FORWARDED_META if key in request.META}
+        _build_in_background(host)
+
+        return view(request, *args, **kwargs)
+
+    return wrapped
@@ -1,58 +1,193 @@
+"""
+USD to GHS conversion for MoMo payments.
+
+Rates are kept in the ExchangeRate table and read from there (through a
+short-lived cache), so a conversion never waits on a rate provider:
+
+- refresh_rate() asks every provider at once and stores the first valid
+  answer, with the rates for the price book currencies (shop.price_book),
+  whose prices it then recomputes. It runs on a schedule (manage.py
+  refresh_exchange_rates) and in the background when a request finds the
+  stored rate stale.
+- A stale rate is still served while the refresh runs. Only with no rate
+  stored at all (a fresh database) is FALLBACK_USD_TO_GHS used.
+"""
+
 import requests
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from datetime import timedelta
 from decimal import Decimal
-from django.core.cache import cache
 from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
 import logging
 
+from .cache import EXCHANGE_RATES
+from .catalog_cache import bump_catalog_version
+from .models import ExchangeRate
+from .price_book import CURRENCIES, rebuild_price_book
+
 logger = logging.getLogger(__name__)
 
 class CurrencyConverter:
     """Service for converting USD to GHS for MoMo payments"""
     
-    # Fallback exchange rate if API fails (updated periodically)
+    # Fallback exchange rate if no rate has been fetched yet
     FALLBACK_USD_TO_GHS = Decimal('12.50')  # Approximate rate as of 2024
     
-    # Cache key for exchange rates
+    # Cache key (in EXCHANGE_RATES) for the stored rate; short-lived, so a
+    # rate changed in the database shows up soon
     CACHE_KEY = 'usd_to_ghs_rate'
-    CACHE_DURATION = 3600  # 1 hour
+    CACHE_DURATION = 60
+    
+    # A rate older than this is refreshed in the background
+    REFRESH_INTERVAL = 3600  # 1 hour
+    # Wait at least this long before retrying after every provider failed
+    RETRY_INTERVAL = 60
+    # Longest a refresh waits for the providers
+    PROVIDER_TIMEOUT = 10
+    
+    PROVIDERS = ('exchangerate-api', 'fixer', 'currencyapi')
+    # Quotes fetched on each refresh; an answer without GHS isn't valid
+    QUOTES = ('GHS', *(code for code in CURRENCIES if code != 'GHS'))
+    
+    _refresh_lock = threading.Lock()
+    _last_attempt = None
+    
+    @classmethod
+    def get_rate_state(cls):
+        """
+        {'rate': Decimal, 'source': str, 'fetched_at': datetime or None} for
+        the stored USD to GHS rate. Never calls a provider: a stale or
+        missing rate starts a background refresh and is served meanwhile.
+        """
+        state = EXCHANGE_RATES.get(cls.CACHE_KEY)
+        if state is None:
+            stored = ExchangeRate.objects.filter(base='USD', quote='GHS').values('rate', 'source', 'fetched_at').first()
+            state = stored or {'rate': cls.FALLBACK_USD_TO_GHS, 'source': 'fallback', 'fetched_at': None}
+            EXCHANGE_RATES.set(cls.CACHE_KEY, state, cls.CACHE_DURATION)
+        
+        if cls.is_stale(state):
+            cls.refresh_in_background()
+        return state
+    
+    @classmethod
+    def is_stale(cls, state):
+        return state['fetched_at'] is None or (
+            timezone.now() - state['fetched_at'] > timedelta(seconds=cls.REFRESH_INTERVAL)
+        )
     
     @classmethod
     def get_usd_to_ghs_rate(cls):
         """Get current USD to GHS exchange rate"""
+        return cls.get_rate_state()['rate']
+    
+    @classmethod
+    def refresh_in_background(cls):
+        """
+        Start refresh_rate() in a thread, unless one is running or it failed
+        just now. The cache entry keeps other workers from starting their own.
+        """
+        if cls._last_attempt is not None and time.monotonic() - cls._last_attempt < cls.RETRY_INTERVAL:
+            return
+        if not cls._refresh_lock.acquire(blocking=False):
+            return
+        cls._last_attempt = time.monotonic()
+        if not EXCHANGE_RATES.add('refreshing', True, cls.RETRY_INTERVAL):
+            cls._refresh_lock.release()
+            return
         
-        # Try to get from cache first
-        cached_rate = cache.get(cls.CACHE_KEY)
-        if cached_rate:
-            logger.info(f"Using cached USD to GHS rate: {cached_rate}")
-            return Decimal(str(cached_rate))
+        def run():
+            try:
+                cls.refresh_rate()
+            except Exception as e:
+                logger.error(f"Exchange rate refresh failed: {e}")
+            finally:
+                connections.close_all()
+                cls._refresh_lock.release()
+        
+        threading.Thread(target=run, name='exchange-rate-refresh', daemon=True).start()
+    
+    @classmethod
+    def refresh_rate(cls):
+        """
+        Fetch the rates from all providers concurrently, store the first
+        valid answer and reprice the price book. Returns the stored USD to
+        GHS ExchangeRate, or None if no provider answered within
+        PROVIDER_TIMEOUT (the stored rates are kept).
+        """
+        fetchers = {
+            'exchangerate-api': cls._fetch_from_exchangerate_api,
+            'fixer': cls._fetch_from_fixer_api,
+            'currencyapi': cls._fetch_from_currencyapi,
+        }
+        executor = ThreadPoolExecutor(max_workers=len(cls.PROVIDERS), thread_name_prefix='exchange-rate')
+        futures = {executor.submit(fetchers[name]): name for name in cls.PROVIDERS}
+        rates = source = None
+        try:
+            for future in as_completed(futures, timeout=cls.PROVIDER_TIMEOUT):
+                answer = future.result()
+                if answer and 'GHS' in answer:
+                    rates, source = answer, futures[future]
+                    break
+        except FuturesTimeout:
+            pass
+        finally:
+            # Don't wait for the slower providers
+            executor.shutdown(wait=False, cancel_futures=True)
         
-        # Try multiple exchange rate APIs
-        rate = cls._fetch_from_exchangerate_api() or \
-               cls._fetch_from_fixer_api() or \
-               cls._fetch_from_currencyapi() or \
-               cls.FALLBACK_USD_TO_GHS
+        if rates is None:
+            logger.warning("No exchange rate provider answered; keeping the stored rates")
+            return None
         
-        # Cache the rate
-        cache.set(cls.CACHE_KEY, float(rate), cls.CACHE_DURATION)
-        logger.info(f"Fetched and cached USD to GHS rate: {rate}")
+        fetched_at = timezone.now()
+        with transaction.atomic():
+            stored = {
+                quote: ExchangeRate.objects.update_or_create(
+                    base='USD', quote=quote,
+                    defaults={'rate': rate, 'source': source, 'fetched_at': fetched_at},
+                )[0]
+                for quote, rate in rates.items()
+            }
+            rebuild_price_book(list(rates))
+            # Localized prices are part of cached catalog responses
+            transaction.on_commit(bump_catalog_version)
         
-        return rate
+        exchange_rate = stored['GHS']
+        EXCHANGE_RATES.set(cls.CACHE_KEY, {
+            'rate': exchange_rate.rate,
+            'source': exchange_rate.source,
+            'fetched_at': exchange_rate.fetched_at,
+        }, cls.CACHE_DURATION)
+        logger.info(f"Stored USD exchange rates from {source}: {', '.join(f'{q} {r}' for q, r in rates.items())}")
+        return exchange_rate
+    
+    @classmethod
+    def _quotes(cls, provider_rates):
+        """{quote: Decimal} for the QUOTES a provider answered"""
+        return {
+            quote: Decimal(str(provider_rates[quote]))
+            for quote in cls.QUOTES
+            if provider_rates.get(quote)
+        }
     
     @classmethod
     def _fetch_from_exchangerate_api(cls):
-        """Fetch rate from exchangerate-api.com (free tier)"""
+        """Fetch rates from exchangerate-api.com (free tier)"""
         try:
             url = "https://api.exchangerate-api.com/v4/latest/USD"
             response = requests.get(url, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
-                ghs_rate = data.get('rates', {}).get('GHS')
+                rates = cls._quotes(data.get('rates', {}))
                 
-                if ghs_rate:
-                    logger.info(f"ExchangeRate-API USD to GHS: {ghs_rate}")
-                    return Decimal(str(ghs_rate))
+                if rates:
+                    logger.info(f"ExchangeRate-API USD to GHS: {rates.get('GHS')}")
+                    return rates
                     
         except Exception as e:
             logger.warning(f"ExchangeRate-API failed: {e}")
@@ -61,22 +196,22 @@ class CurrencyConverter:
     
     @classmethod
     def _fetch_from_fixer_api(cls):
-        """Fetch rate from fixer.io (requires API key)"""
+        """Fetch rates from fixer.io (requires API key)"""
         api_key = getattr(settings, 'FIXER_API_KEY', None)
         if not api_key:
             return None
             
         try:
-            url = f"http://data.fixer.io/api/latest?access_key={api_key}&base=USD&symbols=GHS"
+            url = f"http://data.fixer.io/api/latest?access_key={api_key}&base=USD&symbols={','.join(cls.QUOTES)}"
             response = requests.get(url, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
                 if data.get('success'):
-                    ghs_rate = data.get('rates', {}).get('GHS')
-                    if ghs_rate:
-                        logger.info(f"Fixer.io USD to GHS: {ghs_rate}")
-                        return Decimal(str(ghs_rate))
+                    rates = cls._quotes(data.get('rates', {}))
+                    if rates:
+                        logger.info(f"Fixer.io USD to GHS: {rates.get('GHS')}")
+                        return rates
                         
         except Exception as e:
             logger.warning(f"Fixer.io API failed: {e}")
@@ -85,24 +220,24 @@ class CurrencyConverter:
     
     @classmethod
     def _fetch_from_currencyapi(cls):
-        """Fetch rate from currencyapi.com (free tier)"""
+        """Fetch rates from currencyapi.com (free tier)"""
         api_key = getattr(settings, 'CURRENCY_API_KEY', None)
         if not api_key:
             return None
             
         try:
-            url = f"https://api.currencyapi.com/v3/latest?apikey={api_key}&base_currency=USD&currencies=GHS"
+            url = f"https://api.currencyapi.com/v3/latest?apikey={api_key}&base_currency=USD&currencies={','.join(cls.QUOTES)}"
             response = requests.get(url, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
-                ghs_data = data.get('data', {}).get('GHS')
+                rates = cls._quotes({
+                    code: value.get('value') for code, value in data.get('data', {}).items() if isinstance(value, dict)
+                })
                 
-                if ghs_data:
-                    ghs_rate = ghs_data.get('value')
-                    if ghs_rate:
-                        logger.info(f"CurrencyAPI USD to GHS: {ghs_rate}")
-                        return Decimal(str(ghs_rate))
+                if rates:
+                    logger.info(f"CurrencyAPI USD to GHS: {rates.get('GHS')}")
+                    return rates
                         
         except Exception as e:
             logger.warning(f"CurrencyAPI failed: {e}")
@@ -128,7 +263,8 @@ class CurrencyConverter:
         """
         
         # Get current exchange rate
-        rate = cls.get_usd_to_ghs_rate()
+        state = cls.get_rate_state()
+        rate = state['rate']
         
         # Convert to Decimal for precise calculation
         usd_dollars = Decimal(str(usd_amount_dollars))
@@ -140,10 +276,7 @@ class CurrencyConverter:
         ghs_pesewas = int(ghs_amount * 100)
         
         # Determine rate source
-        cached_rate = cache.get(cls.CACHE_KEY)
-        rate_source = "cached" if cached_rate else "live_api"
-        if rate == cls.FALLBACK_USD_TO_GHS:
-            rate_source = "fallback"
+        rate_source = "fallback" if state['source'] == 'fallback' else "cached"
         
         return {
             'ghs_amount_pesewas': ghs_pesewas,
@@ -157,15 +290,18 @@ class CurrencyConverter:
     @classmethod
     def get_rate_info(cls):
         """Get current rate information for display"""
-        rate = cls.get_usd_to_ghs_rate()
-        cached_rate = cache.get(cls.CACHE_KEY)
+        state = cls.get_rate_state()
+        rate = state['rate']
         
         return {
             'rate': float(rate),
             'display': f"1 USD = {rate:.4f} GHS",
-            'is_cached': bool(cached_rate),
-            'is_fallback': rate == cls.FALLBACK_USD_TO_GHS,
-            'cache_duration': cls.CACHE_DURATION
+            'is_cached': state['source'] != 'fallback',
+            'is_fallback': state['source'] == 'fallback',
+            'is_stale': cls.is_stale(state),
+            'source': state['source'],
+            'updated_at': state['fetched_at'].isoformat() if state['fetched_at'] else None,
+            'cache_duration': cls.REFRESH_INTERVAL
         }
 
 
@@ -180,4 +316,8 @@ def get_current_exchange_rate():
 
 def get_rate_display():
     """Get formatted exchange rate for display"""
-    return CurrencyConverter.get_rate_info()
\ No newline at end of file
+    return CurrencyConverter.get_rate_info()
+
+def refresh_exchange_rate():
+    """Fetch and store the current exchange rates (see CurrencyConverter.refresh_rate)"""
+    return CurrencyConverter.refresh_rate()
\ No newline at end of file
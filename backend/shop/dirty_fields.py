@@ -0,0 +1,82 @@
+"""
+Field-level change tracking for models.
+
+A model that mixes in DirtyFieldsMixin and lists `tracked_fields`
+remembers the values those fields had when the instance was loaded (or
+last saved), so code can ask what changed without re-fetching the row:
+
+    order = Order.objects.get(pk=...)
+    order.status = 'shipped'
+    order.has_changed('status')     # True
+    order.previous('status')        # 'processing'
+
+During save() the snapshot moves to `saved_changes` ({field: old value}
+for the fields this save wrote), which is what post_save receivers should
+look at. Saves made from inside a receiver then only see their own
+changes. Foreign keys are compared by id, so no related rows are loaded.
+"""
+
+_UNSET = object()
+
+
+class DirtyFieldsMixin:
+    # Names of the fields to track; foreign keys by field name ('category')
+    tracked_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Also runs for rows loaded by from_db(); deferred fields aren't in
+        # __dict__ and aren't tracked until they're loaded
+        self._snapshot = self._current_values()
+        self.saved_changes = {}
+
+    @classmethod
+    def _tracked_attnames(cls):
+        return [(name, cls._meta.get_field(name).attname) for name in cls.tracked_fields]
+
+    @classmethod
+    def _tracked_names(cls, fields):
+        """Tracked field names among `fields` (names or attnames); None means all"""
+        if fields is None:
+            return None
+        return {name for name, attname in cls._tracked_attnames() if name in fields or attname in fields}
+
+    def _current_values(self, names=None):
+        return {
+            name: self.__dict__[attname]
+            for name, attname in self._tracked_attnames()
+            if attname in self.__dict__ and (names is None or name in names)
+        }
+
+    def previous(self, name):
+        """The value `name` had when loaded or last saved"""
+        return self._snapshot.get(name)
+
+    def has_changed(self, name):
+        if name not in self.tracked_fields:
+            raise ValueError(f"{name!r} is not a tracked field of {type(self).__name__}")
+        current = self._current_values([name]).get(name, _UNSET)
+        return current is not _UNSET and self._snapshot.get(name, _UNSET) != current
+
+    def get_changed_fields(self):
+        """{field: previous value} for tracked fields changed since loaded or last saved"""
+        return {name: self._snapshot.get(name) for name in self.tracked_fields if self.has_changed(name)}
+
+    def save(self, *args, **kwargs):
+        written = self._tracked_names(kwargs.get('update_fields'))
+        previous = (self._snapshot, self.saved_changes)
+
+        changes = self.get_changed_fields()
+        if written is not None:
+            changes = {name: value for name, value in changes.items() if name in written}
+        self.saved_changes = changes
+        self._snapshot = {**self._snapshot, **self._current_values(written)}
+        try:
+            super().save(*args, **kwargs)
+        except Exception:
+            self._snapshot, self.saved_changes = previous
+            raise
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot.update(self._current_values(self._tracked_names(fields)))
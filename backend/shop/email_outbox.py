@@ -0,0 +1,149 @@
+"""
+Transactional email outbox.
+
+Emails aren't sent during the request. queue_email() writes an EmailOutbox
+row in the caller's transaction, so an email exists if and only if the
+order (or status change) it describes committed, and checkout latency no
+longer depends on the SMTP server. The run_email_worker command drains the
+outbox with send_due_emails(): due rows are claimed in batches and sent
+over one open SMTP connection, outside any transaction. A failed send is
+retried with exponential backoff; after MAX_ATTEMPTS the row is
+dead-lettered (status 'dead') for a human to look at in the admin.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+
+# Retry after 30s, 1m, 2m, 4m, ... capped at an hour
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=1)
+
+# A claimed email not marked sent or failed within this long (the worker
+# died mid-batch) becomes due again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def _outbox_entry(message):
+    html_body = ''
+    for content, mimetype in getattr(message, 'alternatives', []):
+        if mimetype == 'text/html':
+            html_body = content
+    return EmailOutbox(
+        subject=message.subject,
+        body=message.body,
+        html_body=html_body,
+        from_email=message.from_email,
+        to=list(message.to),
+        reply_to=list(message.reply_to),
+    )
+
+
+def queue_email(message):
+    """Store an EmailMultiAlternatives (or EmailMessage) for the worker to send"""
+    entry = _outbox_entry(message)
+    entry.save()
+    return entry
+
+
+def queue_emails(messages):
+    """queue_email() for many messages, in one INSERT"""
+    return EmailOutbox.objects.bulk_create([_outbox_entry(message) for message in messages])
+
+
+def build_message(entry, connection=None):
+    message = EmailMultiAlternatives(
+        subject=entry.subject,
+        body=entry.body,
+        from_email=entry.from_email,
+        to=entry.to,
+        reply_to=entry.reply_to,
+        connection=connection,
+    )
+    if entry.html_body:
+        message.attach_alternative(entry.html_body, "text/html")
+    return message
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def claim_due_emails(batch_size=BATCH_SIZE, now=None):
+    """
+    Claim up to `batch_size` due emails for sending, in one short
+    transaction: they're marked 'sending' with a lease of CLAIM_TIMEOUT,
+    after which another worker may claim them again (the worker died).
+    Rows are locked with SELECT ... FOR UPDATE SKIP LOCKED, so several
+    workers never claim the same email.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        entries = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status__in=['pending', 'sending'], next_attempt_at__lte=now)[:batch_size]
+        )
+        if entries:
+            EmailOutbox.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+                status='sending', next_attempt_at=now + CLAIM_TIMEOUT,
+            )
+    return entries
+
+
+def send_due_emails(connection=None, batch_size=BATCH_SIZE, now=None):
+    """
+    Send up to `batch_size` due emails over `connection`, which is opened
+    if needed and left open so the next batch can reuse it. Returns
+    (sent, failed).
+
+    No transaction is held while talking to the mail server: the batch is
+    claimed first, and each email is marked sent (or failed) on its own
+    right after its send.
+    """
+    now = now or timezone.now()
+    connection = connection or get_connection()
+    sent = failed = 0
+
+    entries = claim_due_emails(batch_size, now)
+    for index, entry in enumerate(entries):
+        try:
+            # No-op while the connection is open
+            connection.open()
+        except Exception as e:
+            # Server unreachable: hand the rest back for the next batch
+            logger.warning(f"Can't connect to the mail server: {e}")
+            EmailOutbox.objects.filter(pk__in=[e.pk for e in entries[index:]]).update(
+                status='pending', next_attempt_at=now,
+            )
+            break
+        try:
+            build_message(entry, connection).send()
+        except Exception as e:
+            failed += 1
+            attempts = entry.attempts + 1
+            if attempts >= MAX_ATTEMPTS:
+                changes = {'status': 'dead'}
+                logger.error(f"Giving up on email {entry.pk} ({entry.subject}) after {attempts} attempts: {e}")
+            else:
+                changes = {'status': 'pending', 'next_attempt_at': now + retry_delay(attempts)}
+                logger.warning(f"Email {entry.pk} failed (attempt {attempts}), retrying at {changes['next_attempt_at']}: {e}")
+            EmailOutbox.objects.filter(pk=entry.pk).update(attempts=attempts, last_error=str(e), **changes)
+            # The server may have dropped us; reconnect for the next one
+            connection.close()
+        else:
+            sent += 1
+            EmailOutbox.objects.filter(pk=entry.pk).update(
+                attempts=entry.attempts + 1, status='sent', sent_at=timezone.now(), last_error='',
+            )
+
+    return sent, failed
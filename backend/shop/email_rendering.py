@@ -0,0 +1,156 @@
+"""
+Rendering pipeline for the email templates in templates/emails/.
+
+Each template is compiled once per process with its <style> rules already
+inlined into the markup (many mail clients ignore <style> blocks), along
+with a plain-text twin derived from the same source, and both are kept in
+a warm cache. Rendering a message then only runs two compiled templates.
+
+render_email() renders one message; render_many() renders a list of
+contexts against the same template in one pass, for bulk sends.
+"""
+
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+
+from django.template import Context, engines
+from django.template.loader import get_template
+
+_STYLE_BLOCK = re.compile(r'<style[^>]*>(.*?)</style>', re.S | re.I)
+_CSS_RULE = re.compile(r'([^{}]+)\{([^{}]*)\}')
+_SIMPLE_SELECTOR = re.compile(r'^([a-z][a-z0-9]*)?(?:\.([\w-]+))?$', re.I)
+_START_TAG = re.compile(r'<([a-z][a-z0-9]*)(\s[^<>]*?)?(/?)>', re.I)
+_CLASS_ATTR = re.compile(r'\sclass="([^"]*)"', re.I)
+_STYLE_ATTR = re.compile(r'\sstyle="([^"]*)"', re.I)
+# Conditional blocks first, so classes they add aren't taken as static
+_TEMPLATE_SYNTAX = re.compile(r'\{%\s*if\b.*?\{%\s*endif\s*%\}|\{%.*?%\}|\{\{.*?\}\}', re.S)
+
+
+def _parse_css(css):
+    """[(tag or None, class or None, declarations)] for the simple selectors in `css`"""
+    rules = []
+    for selectors, declarations in _CSS_RULE.findall(css):
+        declarations = '; '.join(d.strip() for d in declarations.split(';') if d.strip())
+        for selector in selectors.split(','):
+            match = _SIMPLE_SELECTOR.match(selector.strip())
+            if match and any(match.groups()):
+                rules.append((match.group(1), match.group(2), declarations))
+    return rules
+
+
+def inline_css(source):
+    """
+    Copy the <style> rules of template `source` onto the matching tags in
+    its <body> as style attributes. Only `tag`, `.class` and `tag.class`
+    selectors are inlined; classes set by template logic can't be resolved
+    here, so the <style> block is kept for clients that support it.
+    """
+    rules = _parse_css(' '.join(_STYLE_BLOCK.findall(source)))
+    if not rules:
+        return source
+
+    def apply(match):
+        tag, attrs, self_closing = match.group(1).lower(), match.group(2) or '', match.group(3)
+        class_attr = _CLASS_ATTR.search(attrs)
+        classes = set(_TEMPLATE_SYNTAX.sub(' ', class_attr.group(1)).split()) if class_attr else set()
+        # Tag rules first, then class rules (higher specificity), in stylesheet order
+        matched = [d for t, c, d in rules if t == tag and c is None]
+        matched += [d for t, c, d in rules if c in classes and t in (None, tag)]
+        if not matched:
+            return match.group(0)
+        existing = _STYLE_ATTR.search(attrs)
+        if existing:
+            matched.append(existing.group(1))
+            attrs = _STYLE_ATTR.sub('', attrs)
+        return f'<{match.group(1)}{attrs} style="{"; ".join(matched)}"{self_closing}>'
+
+    head, body_tag, body = source.partition('<body')
+    if not body_tag:
+        return source
+    return head + _START_TAG.sub(apply, body_tag + body)
+
+
+class _TextExtractor(HTMLParser):
+    BLOCK_TAGS = {'p', 'div', 'br', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table'}
+    SKIP_TAGS = {'head', 'style', 'script', 'title'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+        self.href = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self.skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag == 'a':
+            self.href = dict(attrs).get('href')
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag == 'a' and self.href:
+            self.parts.append(f' ({self.href})')
+            self.href = None
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+
+def html_to_text(html):
+    """Plain-text version of HTML: one line per block, links as 'text (url)'"""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return _tidy_text(''.join(parser.parts))
+
+
+def _tidy_text(text):
+    lines = [' '.join(line.split()) for line in text.splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+
+@lru_cache(maxsize=None)
+def get_email_templates(template_name):
+    """
+    (html, text) compiled templates for `template_name`, cached for the
+    life of the process. The HTML one has its CSS inlined; the text one is
+    derived from the template source (template tags pass through as text),
+    so neither needs any HTML processing per message.
+    """
+    engine = engines['django']
+    source = get_template(template_name).template.source
+    html = engine.from_string(inline_css(source)).template
+    text = engine.from_string(html_to_text(source)).template
+    return html, text
+
+
+def clear_template_cache():
+    get_email_templates.cache_clear()
+
+
+def render_email(template_name, context):
+    """(html, text) for one message"""
+    return render_many(template_name, [context])[0]
+
+
+def render_many(template_name, contexts, shared_context=None):
+    """
+    (html, text) for each of `contexts`, rendered with the same compiled
+    templates and one Context per format. `shared_context` holds the
+    values common to every message and is set up once.
+    """
+    html_template, text_template = get_email_templates(template_name)
+    html_context = Context(shared_context or {})
+    text_context = Context(shared_context or {}, autoescape=False)
+    rendered = []
+    for values in contexts:
+        with html_context.push(values), text_context.push(values):
+            rendered.append((html_template.render(html_context), _tidy_text(text_template.render(text_context))))
+    return rendered
@@ -2,12 +2,14 @@
 Email service for handling all email communications in the shop.
 """
 
-from django.core.mail import send_mail, EmailMultiAlternatives
-from django.template.loader import render_to_string
+from django.core.mail import send_mail, EmailMultiAlternatives, get_connection
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 import logging
 
+from .email_rendering import render_email, render_many
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,15 +17,47 @@ class EmailService:
     """Service class for handling email operations."""
     
     @staticmethod
-    def get_email_context(order=None, **kwargs):
-        """Get common context variables for email templates."""
-        context = {
+    def deliver(email):
+        """
+        Queue the email in the outbox (sent by run_email_worker), or send it
+        right away when EMAIL_OUTBOX_ENABLED is off. Queued emails are part
+        of the caller's transaction; the insert runs in a savepoint so a
+        failed one doesn't break that transaction.
+        """
+        if getattr(settings, 'EMAIL_OUTBOX_ENABLED', False):
+            from .email_outbox import queue_email
+            with transaction.atomic():
+                queue_email(email)
+        else:
+            email.send()
+    
+    @staticmethod
+    def deliver_many(emails):
+        """deliver() for a batch: one bulk insert, or one SMTP connection"""
+        if not emails:
+            return
+        if getattr(settings, 'EMAIL_OUTBOX_ENABLED', False):
+            from .email_outbox import queue_emails
+            with transaction.atomic():
+                queue_emails(emails)
+        else:
+            get_connection().send_messages(emails)
+    
+    @staticmethod
+    def get_shared_context():
+        """Store-wide context variables, the same for every email."""
+        return {
             'store_name': 'ENTstore',
             'store_url': 'https://entstore.com',  # Update with your actual domain
             'store_logo_url': 'https://entstore.com/static/images/logo.png',  # Update with your logo URL
             'support_email': settings.ADMIN_EMAIL,
             'current_year': timezone.now().year,
         }
+    
+    @staticmethod
+    def get_email_context(order=None, shared=True, **kwargs):
+        """Get common context variables for email templates."""
+        context = EmailService.get_shared_context() if shared else {}
         
         if order:
             # Handle both total_amount (mock orders) and total (real orders)
@@ -64,7 +98,7 @@ class EmailService:
             
             # Render email templates
             try:
-                html_content = render_to_string('emails/order_confirmation.html', context)
+                html_content, text_content = render_email('emails/order_confirmation.html', context)
             except Exception as template_error:
                 logger.warning(f"Email template error: {template_error}, using fallback")
                 # Calculate total for fallback
@@ -81,11 +115,12 @@ class EmailService:
                 <p>Customer: {order.customer_name}</p>
                 <p>Total: ${total:.2f}</p>
                 """
+                text_content = f'Thank you for your order #{order.id}. Your order has been confirmed and is being processed.'
             
             # Create email
             email = EmailMultiAlternatives(
                 subject=f'Order Confirmation - {order.id}',
-                body=f'Thank you for your order #{order.id}. Your order has been confirmed and is being processed.',
+                body=text_content,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 to=[order.customer_email],
                 reply_to=[getattr(settings, 'REPLY_TO_EMAIL', settings.ADMIN_EMAIL)],
@@ -93,8 +128,8 @@ class EmailService:
             email.attach_alternative(html_content, "text/html")
             
             # Send email
-            logger.info(f"Attempting to send email for order {order.id} using SMTP...")
-            email.send()
+            logger.info(f"Attempting to send email for order {order.id}...")
+            EmailService.deliver(email)
             logger.info(f"✅ Order confirmation email sent successfully for order {order.id}")
             return True
             
@@ -126,12 +161,12 @@ class EmailService:
             )
             
             # Render email template
-            html_content = render_to_string('emails/admin_new_order.html', context)
+            html_content, text_content = render_email('emails/admin_new_order.html', context)
             
             # Create email
             email = EmailMultiAlternatives(
                 subject=f'🛒 New Order #{order.id} - ${total:.2f}',
-                body=f'A new order #{order.id} has been placed by {order.customer_name} for ${total:.2f}.',
+                body=text_content,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 to=[settings.ADMIN_EMAIL],
                 reply_to=[getattr(settings, 'REPLY_TO_EMAIL', settings.ADMIN_EMAIL)],
@@ -139,7 +174,7 @@ class EmailService:
             email.attach_alternative(html_content, "text/html")
             
             # Send email
-            email.send()
+            EmailService.deliver(email)
             logger.info(f"Admin notification email sent for order {order.id}")
             return True
             
@@ -147,64 +182,74 @@ class EmailService:
             logger.error(f"Failed to send admin notification email for order {order.id}: {str(e)}")
             return False
     
+    @staticmethod
+    def _shipping_context(order, tracking_number=None, tracking_url=None, carrier=None, estimated_days=3, delivery_instructions=None, shared=True):
+        """Template context for a shipping confirmation."""
+        # Generate tracking URL if not provided but tracking number exists
+        if tracking_number and not tracking_url:
+            tracking_url = EmailService._generate_tracking_url(tracking_number, carrier)
+        
+        # Get order items for the email
+        order_items = []
+        if hasattr(order, 'items'):
+            for item in order.items.all():
+                order_items.append({
+                    'name': item.product.title,
+                    'quantity': item.quantity,
+                    'price': f"${item.unit_price / 100:.2f}",
+                    'total': f"${item.total_price / 100:.2f}"
+                })
+        
+        # Prepare shipping address
+        shipping_address = None
+        if hasattr(order, 'shipping_address') and order.shipping_address:
+            shipping_address = {
+                'name': order.customer_name,
+                'address_line_1': order.shipping_address,
+                'city': order.shipping_city,
+                'country': order.shipping_country,
+                'postal_code': order.shipping_postal_code,
+            }
+        
+        return EmailService.get_email_context(
+            order=order,
+            shared=shared,
+            tracking_number=tracking_number,
+            tracking_url=tracking_url,
+            shipping_carrier=carrier or "Standard Shipping",
+            shipped_date=timezone.now(),
+            estimated_delivery_date=timezone.now() + timezone.timedelta(days=estimated_days),
+            delivery_instructions=delivery_instructions or "Package will be left at your door if no one is available to receive it.",
+            order_items=order_items,
+            shipping_address=shipping_address,
+            support_phone="1-800-ENTSTORE"  # Add support phone
+        )
+    
+    @staticmethod
+    def _shipping_email(order, html_content, text_content):
+        email = EmailMultiAlternatives(
+            subject=f'📦 Your Order #{order.id} Has Shipped!',
+            body=text_content,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[order.customer_email],
+            reply_to=[getattr(settings, 'REPLY_TO_EMAIL', settings.ADMIN_EMAIL)],
+        )
+        email.attach_alternative(html_content, "text/html")
+        return email
+    
     @staticmethod
     def send_shipping_confirmation(order, tracking_number=None, tracking_url=None, carrier=None, estimated_days=3, delivery_instructions=None):
         """Send shipping confirmation email to customer."""
         try:
-            # Generate tracking URL if not provided but tracking number exists
-            if tracking_number and not tracking_url:
-                tracking_url = EmailService._generate_tracking_url(tracking_number, carrier)
-            
-            # Get order items for the email
-            order_items = []
-            if hasattr(order, 'items'):
-                for item in order.items.all():
-                    order_items.append({
-                        'name': item.product.title,
-                        'quantity': item.quantity,
-                        'price': f"${item.unit_price / 100:.2f}",
-                        'total': f"${item.total_price / 100:.2f}"
-                    })
-            
-            # Prepare shipping address
-            shipping_address = None
-            if hasattr(order, 'shipping_address') and order.shipping_address:
-                shipping_address = {
-                    'name': order.customer_name,
-                    'address_line_1': order.shipping_address,
-                    'city': order.shipping_city,
-                    'country': order.shipping_country,
-                    'postal_code': order.shipping_postal_code,
-                }
-            
-            context = EmailService.get_email_context(
-                order=order,
-                tracking_number=tracking_number,
-                tracking_url=tracking_url,
-                shipping_carrier=carrier or "Standard Shipping",
-                shipped_date=timezone.now(),
-                estimated_delivery_date=timezone.now() + timezone.timedelta(days=estimated_days),
-                delivery_instructions=delivery_instructions or "Package will be left at your door if no one is available to receive it.",
-                order_items=order_items,
-                shipping_address=shipping_address,
-                support_phone="1-800-ENTSTORE"  # Add support phone
+            context = EmailService._shipping_context(
+                order, tracking_number, tracking_url, carrier, estimated_days, delivery_instructions
             )
             
             # Render email template
-            html_content = render_to_string('emails/shipping_confirmation.html', context)
-            
-            # Create email
-            email = EmailMultiAlternatives(
-                subject=f'📦 Your Order #{order.id} Has Shipped!',
-                body=f'Great news! Your order #{order.id} has been shipped and is on its way to you. {f"Track it here: {tracking_url}" if tracking_url else ""}',
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                to=[order.customer_email],
-                reply_to=[getattr(settings, 'REPLY_TO_EMAIL', settings.ADMIN_EMAIL)],
-            )
-            email.attach_alternative(html_content, "text/html")
+            html_content, text_content = render_email('emails/shipping_confirmation.html', context)
             
             # Send email
-            email.send()
+            EmailService.deliver(EmailService._shipping_email(order, html_content, text_content))
             logger.info(f"Shipping confirmation email sent for order {order.id} with tracking: {tracking_number}")
             return True
             
@@ -212,6 +257,36 @@ class EmailService:
             logger.error(f"Failed to send shipping confirmation email for order {order.id}: {str(e)}")
             return False
     
+    @staticmethod
+    def send_shipping_confirmations(shipments, carrier=None, estimated_days=3, delivery_instructions=None):
+        """
+        Shipping confirmations for many orders at once. `shipments` is a
+        list of (order, tracking_number) pairs; prefetch the orders'
+        items__product. All emails are rendered in one pass and delivered
+        together. Returns how many were sent.
+        """
+        try:
+            contexts = [
+                EmailService._shipping_context(
+                    order, tracking_number, None, carrier, estimated_days, delivery_instructions, shared=False
+                )
+                for order, tracking_number in shipments
+            ]
+            rendered = render_many(
+                'emails/shipping_confirmation.html', contexts, shared_context=EmailService.get_shared_context()
+            )
+            emails = [
+                EmailService._shipping_email(order, html_content, text_content)
+                for (order, _), (html_content, text_content) in zip(shipments, rendered)
+            ]
+            EmailService.deliver_many(emails)
+            logger.info(f"Shipping confirmation emails sent for {len(emails)} order(s)")
+            return len(emails)
+            
+        except Exception as e:
+            logger.error(f"Failed to send shipping confirmation emails: {str(e)}")
+            return 0
+    
     @staticmethod
     def _generate_tracking_url(tracking_number, carrier=None):
         """Generate tracking URL based on carrier."""
@@ -252,19 +327,19 @@ class EmailService:
             )
             
             # Render email template
-            html_content = render_to_string('emails/order_status_update.html', context)
+            html_content, text_content = render_email('emails/order_status_update.html', context)
             
             # Create email
             email = EmailMultiAlternatives(
                 subject=f'Order Update - #{order.id} Status: {new_status}',
-                body=f'Your order #{order.id} status has been updated to: {new_status}',
+                body=text_content,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 to=[order.customer_email],
             )
             email.attach_alternative(html_content, "text/html")
             
             # Send email
-            email.send()
+            EmailService.deliver(email)
             logger.info(f"Status update email sent for order {order.id} - Status: {new_status}")
             return True
             
@@ -306,6 +381,11 @@ def send_shipping_confirmation_email(order, tracking_number=None, tracking_url=N
     return EmailService.send_shipping_confirmation(order, tracking_number, tracking_url, carrier, estimated_days, delivery_instructions)
 
 
+def send_shipping_confirmation_emails(shipments, carrier=None, estimated_days=3, delivery_instructions=None):
+    """Convenience function to send shipping confirmation emails in bulk."""
+    return EmailService.send_shipping_confirmations(shipments, carrier, estimated_days, delivery_instructions)
+
+
 def send_status_update_email(order, new_status, update_message=None, tracking_number=None, tracking_url=None):
     """Convenience function to send status update email."""
     return EmailService.send_status_update(order, new_status, update_message, tracking_number, tracking_url)
@@ -0,0 +1,240 @@
+"""
+Faceted filtering for the product list.
+
+ProductFilter parses the shared filter parameters (category, size, color,
+price, rating, availability, search) and applies them to a product queryset.
+facet_counts() returns per-value counts for every facet in one aggregate
+query. Each facet is counted against all *other* active filters
+(disjunctive faceting), so picking "M" still shows how many products come in
+"L". Results are cached per normalized filter set and catalog version.
+"""
+
+import hashlib
+import json
+from decimal import Decimal
+
+from django.db.models import Count, F, Q
+
+from .cache import CATALOG
+from .catalog_cache import get_listing_version
+from .models import Category, Product, ProductColor, ProductSize, ProductVariant
+from .search import get_search_backend
+
+# (value, label, min inclusive, max exclusive)
+PRICE_BUCKETS = [
+    ('0-25', 'Under $25', None, 25),
+    ('25-50', '$25 - $50', 25, 50),
+    ('50-100', '$50 - $100', 50, 100),
+    ('100-200', '$100 - $200', 100, 200),
+    ('200+', '$200 & above', 200, None),
+]
+
+RATING_BUCKETS = [4, 3, 2, 1]
+
+AVAILABILITY_CHOICES = [
+    ('in_stock', 'In stock'),
+    ('out_of_stock', 'Out of stock'),
+]
+
+
+def _multi(params, name):
+    """Values of a parameter given as ?x=a&x=b and/or ?x=a,b"""
+    values = []
+    for raw in params.getlist(name):
+        values.extend(value.strip() for value in raw.split(',') if value.strip())
+    return sorted(set(values))
+
+
+def _has_variant(**lookups):
+    """Products with an available variant matching the lookups (uncorrelated subquery)"""
+    return Q(pk__in=ProductVariant.objects.filter(is_available=True, **lookups).values('product_id'))
+
+
+def _price_q(value):
+    for bucket, _, low, high in PRICE_BUCKETS:
+        if bucket == value:
+            q = Q()
+            if low is not None:
+                q &= Q(price__gte=low)
+            if high is not None:
+                q &= Q(price__lt=high)
+            return q
+    return None
+
+
+def _rating_q(stars):
+    return Q(review_count__gt=0, average_rating__gte=stars)
+
+
+# Unheld stock of the product itself, or of any variant (with_variant_stock() annotations)
+IN_STOCK_Q = Q(stock_quantity__gt=F('held_quantity')) | Q(has_variant_stock=True)
+
+
+class ProductFilter:
+    """Filter parameters shared by the product list and facet endpoints"""
+
+    def __init__(self, params):
+        self.search = params.get('search', '').strip()
+        self.category = _multi(params, 'category')
+        self.size = _multi(params, 'size')
+        self.color = _multi(params, 'color')
+        self.price = [value for value in _multi(params, 'price') if _price_q(value) is not None]
+        self.min_price = self._decimal(params.get('min_price'))
+        self.max_price = self._decimal(params.get('max_price'))
+
+        try:
+            rating = int(params.get('rating', 0))
+        except ValueError:
+            rating = 0
+        self.rating = rating if rating in RATING_BUCKETS else None
+
+        self.availability = [value for value in _multi(params, 'availability') if value in dict(AVAILABILITY_CHOICES)]
+        # Older clients send in_stock=true
+        if params.get('in_stock', '').lower() == 'true' and 'in_stock' not in self.availability:
+            self.availability.append('in_stock')
+
+    @staticmethod
+    def _decimal(value):
+        try:
+            return Decimal(value) if value not in (None, '') else None
+        except ArithmeticError:
+            return None
+
+    def base_q(self):
+        """Conditions that are not facets (always applied)"""
+        q = Q()
+        if self.min_price is not None:
+            q &= Q(price__gte=self.min_price)
+        if self.max_price is not None:
+            q &= Q(price__lte=self.max_price)
+        return q
+
+    def facet_qs(self):
+        """Condition for each facet with an active selection"""
+        conditions = {}
+        if self.category:
+            conditions['category'] = Q(category_id__in=self.category)
+        if self.size:
+            conditions['size'] = _has_variant(size__name__in=self.size)
+        if self.color:
+            conditions['color'] = _has_variant(color__name__in=self.color)
+        if self.price:
+            q = Q()
+            for value in self.price:
+                q |= _price_q(value)
+            conditions['price'] = q
+        if self.rating:
+            conditions['rating'] = _rating_q(self.rating)
+        if len(self.availability) == 1:
+            conditions['availability'] = IN_STOCK_Q if self.availability[0] == 'in_stock' else ~IN_STOCK_Q
+        return conditions
+
+    def apply_search(self, queryset):
+        if self.search:
+            queryset = get_search_backend().filter(queryset, self.search)
+        return queryset
+
+    def apply(self, queryset):
+        queryset = self.apply_search(queryset).filter(self.base_q())
+        for q in self.facet_qs().values():
+            queryset = queryset.filter(q)
+        return queryset
+
+    def signature(self):
+        state = {
+            'search': self.search, 'category': self.category, 'size': self.size, 'color': self.color,
+            'price': self.price, 'min_price': str(self.min_price), 'max_price': str(self.max_price),
+            'rating': self.rating, 'availability': sorted(self.availability),
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+    def selected(self):
+        return {
+            'category': self.category, 'size': self.size, 'color': self.color, 'price': self.price,
+            'rating': self.rating, 'availability': self.availability, 'search': self.search or None,
+        }
+
+
+def facet_counts(product_filter, queryset=None):
+    """
+    Counts for every facet value, cached per filter signature. `queryset`
+    defaults to all active products and must carry the with_variant_stock()
+    annotations.
+    """
+    if queryset is None:
+        queryset = Product.objects.filter(is_active=True).with_variant_stock()
+    # The availability facet counts stock
+    return CATALOG.get_or_set(
+        f"facets:{product_filter.signature()}", lambda: _compute_facets(product_filter, queryset),
+        version=get_listing_version(),
+    )
+
+
+def _compute_facets(product_filter, queryset):
+    categories = list(Category.objects.values_list('key', 'label'))
+    sizes = list(ProductSize.objects.values_list('id', 'name', 'display_name'))
+    colors = list(ProductColor.objects.values_list('id', 'name', 'hex_code'))
+
+    selections = product_filter.facet_qs()
+
+    def others(facet):
+        """All active selections except the facet's own"""
+        q = Q()
+        for name, condition in selections.items():
+            if name != facet:
+                q &= condition
+        return q
+
+    # Size/colour values are counted through one join to available variants;
+    # the join fans rows out, hence distinct counts throughout
+    available_variant = Q(variants__is_available=True)
+    values = {'total': Count('pk', distinct=True, filter=others(None))}
+    for key, _ in categories:
+        values[f'category:{key}'] = Count('pk', distinct=True, filter=others('category') & Q(category_id=key))
+    for size_id, _, _ in sizes:
+        values[f'size:{size_id}'] = Count(
+            'pk', distinct=True, filter=others('size') & available_variant & Q(variants__size_id=size_id)
+        )
+    for color_id, _, _ in colors:
+        values[f'color:{color_id}'] = Count(
+            'pk', distinct=True, filter=others('color') & available_variant & Q(variants__color_id=color_id)
+        )
+    for bucket, _, _, _ in PRICE_BUCKETS:
+        values[f'price:{bucket}'] = Count('pk', distinct=True, filter=others('price') & _price_q(bucket))
+    for stars in RATING_BUCKETS:
+        values[f'rating:{stars}'] = Count('pk', distinct=True, filter=others('rating') & _rating_q(stars))
+    values['availability:in_stock'] = Count('pk', distinct=True, filter=others('availability') & IN_STOCK_Q)
+    values['availability:out_of_stock'] = Count('pk', distinct=True, filter=others('availability') & ~IN_STOCK_Q)
+
+    queryset = product_filter.apply_search(queryset).filter(product_filter.base_q())
+    counts = queryset.aggregate(**values)
+
+    return {
+        'total': counts['total'],
+        'facets': {
+            'category': [
+                {'value': key, 'label': label, 'count': counts[f'category:{key}']}
+                for key, label in categories
+            ],
+            'size': [
+                {'value': name, 'label': display_name, 'count': counts[f'size:{size_id}']}
+                for size_id, name, display_name in sizes
+            ],
+            'color': [
+                {'value': name, 'label': name, 'hex_code': hex_code, 'count': counts[f'color:{color_id}']}
+                for color_id, name, hex_code in colors
+            ],
+            'price': [
+                {'value': bucket, 'label': label, 'count': counts[f'price:{bucket}']}
+                for bucket, label, _, _ in PRICE_BUCKETS
+            ],
+            'rating': [
+                {'value': stars, 'label': f'{stars} stars & up', 'count': counts[f'rating:{stars}']}
+                for stars in RATING_BUCKETS
+            ],
+            'availability': [
+                {'value': value, 'label': label, 'count': counts[f'availability:{value}']}
+                for value, label in AVAILABILITY_CHOICES
+            ],
+        },
+    }
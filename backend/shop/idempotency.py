@@ -0,0 +1,135 @@
+"""
+Idempotency-Key support for order and payment endpoints.
+
+A client that may retry (flaky mobile networks, double taps) sends the same
+Idempotency-Key header with every attempt. The first attempt claims a
+unique (scope, key) IdempotencyRecord in a short transaction, runs the view
+outside it (no row lock is held while the view talks to Stripe or MoMo),
+then stores its response on the record. Retries replay the stored response
+without running the view again; a duplicate that arrives while the first
+attempt is still running gets 409 and retries later. A claim left behind by
+a crashed worker can be taken over after IN_PROGRESS_TIMEOUT.
+
+Server errors (5xx) and exceptions raised by the view (including DRF
+validation errors) release the claim and aren't stored, so the key can be
+retried. Reusing a key with a different request body is rejected with 422.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+# Keys can be reused for a new request after this long
+IDEMPOTENCY_TTL = timedelta(hours=24)
+
+# An attempt still unfinished after this long is assumed dead
+IN_PROGRESS_TIMEOUT = timedelta(minutes=5)
+
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(scope, key, fingerprint):
+    """
+    Claim (scope, key) for this request. Returns (record, None) when the
+    view should run, or (None, response) to answer with instead.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        record, created = IdempotencyRecord.objects.get_or_create(
+            scope=scope, key=key, defaults={'request_hash': fingerprint}
+        )
+        if created:
+            return record, None
+
+        record = IdempotencyRecord.objects.select_for_update().get(pk=record.pk)
+        expired = record.created_at < now - IDEMPOTENCY_TTL
+        abandoned = record.status == 'in_progress' and record.created_at < now - IN_PROGRESS_TIMEOUT
+        if expired or (abandoned and record.request_hash == fingerprint):
+            # Treat as a new request under the same key
+            record.request_hash = fingerprint
+            record.status = 'in_progress'
+            record.status_code = None
+            record.response_body = None
+            record.created_at = now
+            record.save()
+            return record, None
+        if record.request_hash != fingerprint:
+            return None, Response(
+                {'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        if record.status == 'completed':
+            return None, _replay(record)
+        return None, Response(
+            {'error': f'A request with this {IDEMPOTENCY_HEADER} is still being processed'},
+            status=status.HTTP_409_CONFLICT, headers={'Retry-After': '1'}
+        )
+
+
+def idempotent(scope):
+    """
+    Make a DRF view (function view, or a method via method_decorator)
+    idempotent for requests carrying an Idempotency-Key header. Requests
+    without the header run as before.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+            if not key:
+                return view(request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            record, response = _claim(scope, key, request_fingerprint(request))
+            if response is not None:
+                return response
+
+            # Unless another attempt took the claim over in the meantime
+            claimed = IdempotencyRecord.objects.filter(pk=record.pk, status='in_progress', created_at=record.created_at)
+            try:
+                response = view(request, *args, **kwargs)
+            except Exception:
+                claimed.delete()
+                raise
+
+            if response.status_code >= 500:
+                # Don't pin the key to a server error; let the client retry
+                claimed.delete()
+            else:
+                claimed.update(status='completed', status_code=response.status_code, response_body=response.data)
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_records(now=None):
+    """Delete records past IDEMPOTENCY_TTL; returns how many were removed"""
+    cutoff = (now or timezone.now()) - IDEMPOTENCY_TTL
+    deleted, _ = IdempotencyRecord.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,261 @@
+"""
+Stock checks and decrements for checkout.
+
+Stock is taken with one conditional UPDATE per table for the whole cart:
+
+    UPDATE ... SET stock_quantity = stock_quantity - CASE id WHEN a THEN n ... END
+    WHERE (id = a AND stock_quantity >= n + <held>) OR (id = b AND ...)
+
+where <held> sums other checkouts' active reservations (shop.reservations).
+
+The check and the write happen in the same statement, so two checkouts
+racing for the last unit can't both succeed: the database serialises the
+row updates and the loser's row no longer matches. If fewer rows were
+updated than asked for, the statement is rolled back (savepoint). Callers
+run this inside the same transaction.atomic() block that creates the
+order, so a line that can't be fulfilled rolls back the whole order.
+"""
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Sum, Value, When
+from django.db.models.functions import Now
+
+from .models import Product, ProductVariant, StockReservation
+
+
+class InsufficientStock(Exception):
+    """Raised when one or more order lines can't be taken from stock"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(errors))
+
+
+class _Shortfall(Exception):
+    pass
+
+
+def _variant_pk(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class CartLookup:
+    """
+    Products and variants referenced by cart items, loaded with one query
+    each. Both carry the reservation annotations, so `available_quantity`
+    and `is_in_stock` don't query per item; holds made under `reference`
+    (the buyer's own checkout) don't count against them. `lock` takes row
+    locks (SELECT ... FOR UPDATE) until the surrounding transaction ends.
+    """
+
+    def __init__(self, items, reference=None, lock=False):
+        product_ids = {str(item.get('product_id')) for item in items if item.get('product_id')}
+        variant_ids = {_variant_pk(item.get('variant_id')) for item in items if item.get('variant_id')}
+        variant_ids.discard(None)
+
+        products = Product.objects.with_variant_stock(reference)
+        variants = ProductVariant.objects.with_holds(reference).select_related('size', 'color')
+        if lock:
+            products = products.select_for_update(of=('self',)).order_by('pk')
+            variants = variants.select_for_update(of=('self',)).order_by('pk')
+
+        self.products = products.in_bulk(product_ids) if product_ids else {}
+        self.variants = variants.in_bulk(variant_ids) if variant_ids else {}
+
+    def product(self, item):
+        return self.products.get(str(item.get('product_id')))
+
+    def variant(self, item):
+        return self.variants.get(_variant_pk(item.get('variant_id')))
+
+
+# Remaining stock at or below this gets a low-stock warning
+LOW_STOCK_THRESHOLD = 5
+
+
+def _quantity(value):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return None
+    return quantity if quantity > 0 else None
+
+
+def check_carts(carts):
+    """
+    Validate stock for many carts at once.
+
+    `carts` is a list of (items, payment_reference) pairs. Every product and
+    variant across all carts is loaded with one query each (plus one for
+    the carts' own holds, when references are given), so the cost doesn't
+    grow with the number of lines. Returns (errors, warnings) per cart, in
+    ValidateStockView's response shape.
+    """
+    product_ids, variant_ids, references = set(), set(), set()
+    for items, reference in carts:
+        for item in items:
+            if item.get('product_id'):
+                product_ids.add(str(item['product_id']))
+            if _variant_pk(item.get('variant_id')) is not None:
+                variant_ids.add(_variant_pk(item['variant_id']))
+        if reference:
+            references.add(reference)
+
+    products = {
+        row['id']: row
+        for row in Product.objects.filter(pk__in=product_ids).with_variant_stock().values(
+            'id', 'title', 'is_active', 'stock_quantity', 'held_quantity', 'has_variant_stock'
+        )
+    } if product_ids else {}
+    variants = {
+        row['id']: row
+        for row in ProductVariant.objects.filter(pk__in=variant_ids).with_holds().values(
+            'id', 'product_id', 'is_available', 'stock_quantity', 'held_quantity'
+        )
+    } if variant_ids else {}
+
+    # A cart's own holds count as available to it
+    own_holds = {}
+    if references:
+        rows = StockReservation.objects.filter(reference__in=references, expires_at__gt=Now()).values(
+            'reference', 'product_id', 'variant_id'
+        ).annotate(total=Sum('quantity'))
+        own_holds = {(row['reference'], row['product_id'], row['variant_id']): row['total'] for row in rows}
+
+    return [_check_cart(items, reference, products, variants, own_holds) for items, reference in carts]
+
+
+def _check_cart(items, reference, products, variants, own_holds):
+    errors = []
+    warnings = []
+
+    for item in items:
+        product = products.get(str(item.get('product_id')))
+        if product is None:
+            errors.append({'product_id': item.get('product_id'), 'error': 'Product not found'})
+            continue
+
+        line = {'product_id': product['id'], 'product_title': product['title']}
+        requested_quantity = _quantity(item.get('quantity', 1))
+        if requested_quantity is None:
+            errors.append({**line, 'error': 'Invalid quantity'})
+            continue
+
+        # Check if product is active
+        if not product['is_active']:
+            errors.append({**line, 'error': 'Product is no longer available'})
+            continue
+
+        variant_id = item.get('variant_id')
+        if variant_id:
+            line['variant_id'] = variant_id
+            variant = variants.get(_variant_pk(variant_id))
+            if variant is None or variant['product_id'] != product['id']:
+                errors.append({**line, 'error': 'Selected variant not found'})
+                continue
+            available = (
+                variant['stock_quantity'] - variant['held_quantity']
+                + own_holds.get((reference, product['id'], variant['id']), 0)
+            )
+            if not variant['is_available']:
+                errors.append({**line, 'error': 'Selected variant is not available'})
+            elif available <= 0:
+                errors.append({**line, 'error': 'Selected variant is out of stock'})
+            elif available < requested_quantity:
+                errors.append({
+                    **line,
+                    'error': f'Only {available} in stock, but {requested_quantity} requested',
+                    'available_quantity': available
+                })
+            elif available <= LOW_STOCK_THRESHOLD:
+                warnings.append({**line, 'warning': f'Low stock: only {available} remaining'})
+        else:
+            # Check main product stock
+            available = (
+                product['stock_quantity'] - product['held_quantity']
+                + own_holds.get((reference, product['id'], None), 0)
+            )
+            if available <= 0 and not product['has_variant_stock']:
+                errors.append({**line, 'error': 'Product is out of stock'})
+            elif available < requested_quantity:
+                errors.append({
+                    **line,
+                    'error': f'Only {available} in stock, but {requested_quantity} requested',
+                    'available_quantity': available
+                })
+            elif available <= LOW_STOCK_THRESHOLD:
+                warnings.append({**line, 'warning': f'Low stock: only {available} remaining'})
+
+    return errors, warnings
+
+
+def decrement_stock(lines):
+    """
+    Take stock for `lines`, an iterable of (product, variant or None, quantity).
+
+    Quantities for the same product/variant are combined first. Must be
+    called inside transaction.atomic(); raises InsufficientStock listing
+    every line that couldn't be fulfilled.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        raise RuntimeError('decrement_stock() must run inside transaction.atomic()')
+
+    # pk -> [label, quantity] per table
+    products, variants = {}, {}
+    for product, variant, quantity in lines:
+        if variant is not None:
+            entry = variants.setdefault(variant.pk, [f"{product.title} (selected variant)", 0])
+        else:
+            entry = products.setdefault(product.pk, [product.title, 0])
+        entry[1] += quantity
+
+    # Units other checkouts hold can't be taken (consume the buyer's own holds first)
+    errors = []
+    if products:
+        held = StockReservation.held(product=OuterRef('pk'), variant__isnull=True)
+        errors += _take(Product.objects.filter(is_active=True), products, held)
+    if variants:
+        held = StockReservation.held(variant=OuterRef('pk'))
+        errors += _take(ProductVariant.objects.filter(is_available=True), variants, held)
+    if errors:
+        raise InsufficientStock(errors)
+
+    # update() bypasses post_save, so invalidate cached stock levels here
+    from .catalog_cache import bump_stock_version
+    transaction.on_commit(bump_stock_version)
+
+
+def _take(rows, wanted, held):
+    """Decrement every row in `wanted` in one statement, or none of them; returns error messages"""
+    enough = Q()
+    for pk, (_, quantity) in wanted.items():
+        enough |= Q(pk=pk, stock_quantity__gte=held + quantity)
+    amount = Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, (_, quantity) in wanted.items()],
+        output_field=IntegerField(),
+    )
+
+    try:
+        with transaction.atomic():
+            if rows.filter(enough).update(stock_quantity=F('stock_quantity') - amount) == len(wanted):
+                return []
+            raise _Shortfall
+    except _Shortfall:
+        pass
+
+    # Report which lines fell short from the current (rolled back) stock
+    available = dict(
+        rows.filter(pk__in=wanted).annotate(available=F('stock_quantity') - held).values_list('pk', 'available')
+    )
+    errors = []
+    for pk, (label, quantity) in wanted.items():
+        stock = available.get(pk, 0)
+        if stock <= 0:
+            errors.append(f"{label} is out of stock")
+        elif stock < quantity:
+            errors.append(f"{label}: Only {stock} in stock, but {quantity} requested")
+    # Stock changed again between the two statements
+    return errors or ["Stock changed while placing the order, please try again"]
@@ -0,0 +1,112 @@
+"""
+Django management command to benchmark product search against a large
+seeded catalog. Compares the full-text backend with plain icontains matching.
+"""
+
+import random
+import statistics
+import string
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from shop.models import Category, Product
+from shop.search import get_search_backend, search_products
+
+BENCH_CATEGORY = 'search-benchmark'
+
+WORDS = [
+    'cotton', 'hoodie', 'black', 'white', 'vintage', 'oversized', 'slim', 'denim',
+    'jacket', 'summer', 'winter', 'classic', 'graphic', 'tee', 'cap', 'sneaker',
+    'leather', 'wool', 'linen', 'striped', 'sport', 'premium', 'casual', 'street',
+    'kente', 'print', 'relaxed', 'cropped', 'zip', 'fleece', 'embroidered', 'logo',
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Seed a large catalog and measure product search latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000, help='Number of products to seed')
+        parser.add_argument('--iterations', type=int, default=20, help='Runs per query')
+        parser.add_argument('--query', action='append', dest='queries', help='Query to run (can be repeated)')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded products afterwards')
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or ['hoodie', 'black cotton', 'vint', 'kente print jacket', 'nomatchword']
+        iterations = options['iterations']
+
+        self.seed(options['products'])
+        backend = get_search_backend()
+        # Same queryset the search endpoint ranks over
+        base = Product.objects.for_listing()
+
+        self.stdout.write(f"\n🔍 Backend: {type(backend).__name__}, {iterations} runs per query\n")
+        for query in queries:
+            fts = self.measure(lambda: search_products(base, query, limit=20), iterations)
+            total = search_products(base, query, limit=1)[1]
+            naive = self.measure(lambda: self.icontains(base, query), iterations)
+            self.stdout.write(
+                f"  {query!r:24} {total:>7} hits | "
+                f"full-text p50 {fts[0]:7.2f}ms p99 {fts[1]:7.2f}ms | "
+                f"icontains p50 {naive[0]:7.2f}ms p99 {naive[1]:7.2f}ms"
+            )
+
+        if not options['keep']:
+            self.stdout.write("\n🧹 Removing seeded products...")
+            Product.objects.filter(category_id=BENCH_CATEGORY).delete()
+            Category.objects.filter(key=BENCH_CATEGORY).delete()
+        self.stdout.write(self.style.SUCCESS("✅ Search benchmark complete"))
+
+    def seed(self, count):
+        category, _ = Category.objects.get_or_create(
+            key=BENCH_CATEGORY,
+            defaults={'label': 'Search Benchmark', 'description': 'Seeded by benchmark_search'}
+        )
+        existing = Product.objects.filter(category=category).count()
+        if existing >= count:
+            self.stdout.write(f"📦 Reusing {existing} seeded products")
+            return
+
+        self.stdout.write(f"📦 Seeding {count - existing} products...")
+        rng = random.Random(42)
+        # Long-tail filler vocabulary so descriptions aren't all the same few words
+        filler = [''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9))) for _ in range(5000)]
+        batch = []
+        for n in range(existing, count):
+            title = ' '.join(rng.sample(WORDS, 3)).title()
+            batch.append(Product(
+                id=f'bench-{n}',
+                slug=f'bench-{n}',
+                title=title,
+                description=' '.join(rng.choices(WORDS, k=3) + rng.choices(filler, k=22)),
+                price=rng.randint(500, 20000) / 100,
+                category=category,
+                stock_quantity=rng.randint(0, 50),
+            ))
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Product.objects.bulk_create(batch)
+
+    @staticmethod
+    def icontains(queryset, query):
+        matches = queryset.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        return list(matches[:20]), matches.count()
+
+    @staticmethod
+    def measure(func, iterations):
+        func()  # warm up
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples), percentile(samples, 99)
@@ -0,0 +1,101 @@
+"""
+Django management command to benchmark product list serialization.
+Compares ProductSerializer + JSONRenderer with the values() row fast path
++ ORJSONRenderer at several page sizes.
+"""
+
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from shop.models import Category, Product
+from shop.product_rows import build_rows, row_fields
+from shop.renderers import ORJSONRenderer, orjson
+from shop.serializers import ProductSerializer
+
+BENCH_CATEGORY = 'serialization-benchmark'
+
+
+class Command(BaseCommand):
+    help = 'Measure product list serialization: ModelSerializer vs values() rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, action='append', dest='sizes', help='Rows per run (can be repeated)')
+        parser.add_argument('--iterations', type=int, default=10, help='Runs per size')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded products afterwards')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes'] or [50, 500, 5000]
+        iterations = options['iterations']
+        self.seed(max(sizes))
+
+        request = RequestFactory().get('/api/shop/products/')
+        base = Product.objects.for_listing().filter(category_id=BENCH_CATEGORY).order_by('-created_at', '-id')
+        fields, columns = row_fields()
+
+        def serializer_path(n):
+            products = list(base[:n])
+            data = ProductSerializer(products, many=True, context={'request': request}).data
+            return JSONRenderer().render(data)
+
+        def rows_path(n):
+            rows = list(base.values(*columns)[:n])
+            return ORJSONRenderer().render(build_rows(rows, fields, request))
+
+        if orjson is None:
+            self.stdout.write(self.style.WARNING("⚠️ orjson is not installed, ORJSONRenderer falls back to JSONRenderer"))
+        self.stdout.write(f"\n📊 {iterations} runs per size (median, query + serialize + render)\n")
+        for n in sizes:
+            slow, slow_bytes = self.measure(lambda: serializer_path(n), iterations)
+            fast, fast_bytes = self.measure(lambda: rows_path(n), iterations)
+            self.stdout.write(
+                f"  {n:>6} rows | ProductSerializer {slow:8.2f}ms ({slow_bytes // 1024} KB) | "
+                f"values() + orjson {fast:8.2f}ms ({fast_bytes // 1024} KB) | {slow / fast:5.1f}x"
+            )
+
+        if not options['keep']:
+            self.stdout.write("\n🧹 Removing seeded products...")
+            Product.objects.filter(category_id=BENCH_CATEGORY).delete()
+            Category.objects.filter(key=BENCH_CATEGORY).delete()
+        self.stdout.write(self.style.SUCCESS("✅ Serialization benchmark complete"))
+
+    def seed(self, count):
+        category, _ = Category.objects.get_or_create(
+            key=BENCH_CATEGORY,
+            defaults={'label': 'Serialization Benchmark', 'description': 'Seeded by benchmark_serialization'}
+        )
+        existing = Product.objects.filter(category=category).count()
+        if existing >= count:
+            self.stdout.write(f"📦 Reusing {existing} seeded products")
+            return
+
+        self.stdout.write(f"📦 Seeding {count - existing} products...")
+        rng = random.Random(42)
+        Product.objects.bulk_create([
+            Product(
+                id=f'serial-bench-{n}',
+                slug=f'serial-bench-{n}',
+                title=f'Benchmark Product {n}',
+                description='Seeded product used to measure list serialization',
+                price=rng.randint(500, 20000) / 100,
+                image_url=f'https://example.com/products/{n}.jpg',
+                category=category,
+                stock_quantity=rng.randint(0, 50),
+                review_count=rng.randint(0, 200),
+                average_rating=rng.randint(10, 50) / 10,
+            )
+            for n in range(existing, count)
+        ], batch_size=1000)
+
+    @staticmethod
+    def measure(func, iterations):
+        size = len(func())  # warm up
+        samples = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples), size
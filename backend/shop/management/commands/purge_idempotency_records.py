@@ -0,0 +1,18 @@
+"""
+Django management command to delete expired idempotency records.
+
+Records older than IDEMPOTENCY_TTL no longer replay anything; run this
+periodically (e.g. daily from cron) to keep the table small.
+"""
+
+from django.core.management.base import BaseCommand
+from shop.idempotency import IDEMPOTENCY_TTL, purge_expired_records
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency records older than the replay window'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_records()
+        self.stdout.write(f"🧹 Removed {deleted} idempotency record(s) older than {IDEMPOTENCY_TTL}")
+        self.stdout.write(self.style.SUCCESS("✅ Idempotency records purged"))
@@ -0,0 +1,30 @@
+"""
+Django management command to rebuild the denormalized review aggregates
+(average_rating, review_count and the per-star histogram) on Product.
+"""
+
+from django.core.management.base import BaseCommand
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Rebuild product review aggregates from approved reviews'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--product',
+            action='append',
+            dest='product_ids',
+            help='Only reconcile the given product ID (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        product_ids = options.get('product_ids')
+        scope = f"{len(product_ids)} product(s)" if product_ids else "all products"
+        self.stdout.write(f"🔄 Reconciling review aggregates for {scope}...")
+        
+        changed = Product.recalculate_review_stats(product_ids)
+        
+        if changed:
+            self.stdout.write(self.style.WARNING(f"⚠️  Fixed drifted aggregates on {changed} product(s)"))
+        self.stdout.write(self.style.SUCCESS("✅ Review aggregates are up to date"))
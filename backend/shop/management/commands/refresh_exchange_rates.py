@@ -0,0 +1,40 @@
+"""
+Django management command to refresh the stored USD to GHS exchange rate.
+
+Asks every rate provider at once and stores the first valid answer, so
+conversions on the request path always find a fresh rate. Run it from
+cron, or as a long-lived process with --interval. Requests still refresh
+a stale rate in the background when this isn't running.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from shop.currency_service import refresh_exchange_rate
+
+
+class Command(BaseCommand):
+    help = 'Refresh the stored exchange rates'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running and refresh every N seconds (default: refresh once)',
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            exchange_rate = refresh_exchange_rate()
+            if exchange_rate:
+                self.stdout.write(f"💱 {exchange_rate} (from {exchange_rate.source})")
+            else:
+                self.stdout.write(self.style.WARNING("⚠️ No rate provider answered; kept the stored rate"))
+            if not interval:
+                break
+            close_old_connections()
+            time.sleep(interval)
+        self.stdout.write(self.style.SUCCESS("✅ Exchange rates refreshed"))
@@ -0,0 +1,37 @@
+"""
+Django management command to delete expired stock reservations.
+
+Expired holds already stop counting against available stock; sweeping them
+keeps the table small and refreshes cached listings. Run it from cron, or
+as a long-lived process with --interval.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from shop.reservations import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Release expired stock reservations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=0,
+            help='Keep running and sweep every N seconds (default: sweep once)',
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            released = release_expired_reservations()
+            if released:
+                self.stdout.write(f"🧹 Released {released} expired reservation(s)")
+            if not interval:
+                break
+            close_old_connections()
+            time.sleep(interval)
+        self.stdout.write(self.style.SUCCESS("✅ Expired reservations released"))
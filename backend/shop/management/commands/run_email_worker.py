@@ -0,0 +1,68 @@
+"""
+Django management command that delivers queued emails from the outbox.
+
+Runs as a long-lived worker process (see Procfile). While there is mail to
+send it works through the outbox batch after batch over one SMTP
+connection; once the outbox is empty it closes the connection and polls
+every --interval seconds. Use --once from cron instead of a worker.
+"""
+
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from shop.email_outbox import BATCH_SIZE, send_due_emails
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the email outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Emails claimed per batch (default: {BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to wait between polls when the outbox is empty (default: 5)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the outbox once and exit',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        connection = get_connection()
+        total_sent = total_failed = 0
+
+        try:
+            while True:
+                sent, failed = send_due_emails(connection, batch_size=batch_size)
+                total_sent += sent
+                total_failed += failed
+                if sent or failed:
+                    self.stdout.write(f"📧 Sent {sent} email(s), {failed} failed")
+
+                if sent + failed >= batch_size:
+                    # More may be waiting; keep the connection open
+                    continue
+
+                # Idle: SMTP servers drop quiet connections anyway
+                connection.close()
+                if options['once']:
+                    break
+                close_old_connections()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Email worker stopped: {total_sent} sent, {total_failed} failed"))
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:44
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_review_aggregates(apps, schema_editor):
+    """Fill the new aggregate columns from existing approved reviews"""
+    Product = apps.get_model('shop', 'Product')
+    ProductReview = apps.get_model('shop', 'ProductReview')
+    
+    rows = ProductReview.objects.filter(is_approved=True).values('product_id').annotate(
+        total=Count('id'),
+        **{f'rating_{stars}_count': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)}
+    )
+    for row in rows:
+        rating_total = sum(row[f'rating_{stars}_count'] * stars for stars in range(1, 6))
+        Product.objects.filter(pk=row['product_id']).update(
+            review_count=row['total'],
+            average_rating=rating_total / row['total'],
+            **{f'rating_{stars}_count': row[f'rating_{stars}_count'] for stars in range(1, 6)}
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_add_productimage_url_field'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='average_rating',
+            field=models.FloatField(default=0.0, editable=False, help_text='Average rating of approved reviews (auto-calculated)'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of approved reviews (auto-calculated)'),
+        ),
+        migrations.RunPython(populate_review_aggregates, migrations.RunPython.noop),
+    ]
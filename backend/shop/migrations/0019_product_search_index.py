@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-17 00:58
+
+from django.db import migrations
+
+
+def install_search_index(apps, schema_editor):
+    """Create the full-text index for the current database vendor"""
+    from shop.search import get_search_backend
+    get_search_backend(schema_editor.connection).install(schema_editor)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from shop.search import get_search_backend
+    get_search_backend(schema_editor.connection).uninstall(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
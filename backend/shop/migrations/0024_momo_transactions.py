@@ -0,0 +1,37 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:41
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_email_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MomoTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.CharField(help_text='Reference returned to the client', max_length=64, unique=True)),
+                ('phone', models.CharField(max_length=20)),
+                ('usd_amount', models.DecimalField(decimal_places=2, help_text='Amount in USD dollars', max_digits=10)),
+                ('ghs_amount', models.PositiveIntegerField(help_text='Amount charged in pesewas')),
+                ('currency', models.CharField(default='GHS', max_length=3)),
+                ('exchange_rate', models.FloatField(blank=True, null=True)),
+                ('conversion_info', models.JSONField(blank=True, default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('success', 'Success'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('resolves_to', models.CharField(blank=True, choices=[('pending', 'Pending'), ('success', 'Success'), ('failed', 'Failed')], max_length=10)),
+                ('resolve_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'MoMo Transaction',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'resolve_at'], name='momo_status_resolve_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0024_momo_transactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base', models.CharField(max_length=3)),
+                ('quote', models.CharField(max_length=3)),
+                ('rate', models.DecimalField(decimal_places=6, max_digits=14)),
+                ('source', models.CharField(help_text='Provider the rate came from', max_length=30)),
+                ('fetched_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Exchange Rate',
+                'constraints': [models.UniqueConstraint(fields=('base', 'quote'), name='exchange_rate_pair_unique')],
+            },
+        ),
+    ]
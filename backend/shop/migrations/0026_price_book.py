@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0025_exchange_rates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('display', models.CharField(max_length=32)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='localized_prices', to='shop.product')),
+                ('variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='localized_prices', to='shop.productvariant')),
+            ],
+            options={
+                'verbose_name': 'Price Book Entry',
+                'verbose_name_plural': 'Price Book',
+                'indexes': [models.Index(fields=['currency', 'product'], name='price_book_lookup_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('variant__isnull', True)), fields=('currency', 'product'), name='price_book_product_unique'), models.UniqueConstraint(condition=models.Q(('variant__isnull', False)), fields=('currency', 'variant'), name='price_book_variant_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-17 05:58
+
+from django.db import migrations, models
+
+
+def mark_completed(apps, schema_editor):
+    """Records stored before this column existed all hold a finished response"""
+    IdempotencyRecord = apps.get_model('shop', 'IdempotencyRecord')
+    IdempotencyRecord.objects.filter(status_code__isnull=False).update(status='completed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0027_email_outbox_sending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='status',
+            field=models.CharField(choices=[('in_progress', 'In progress'), ('completed', 'Completed')], default='in_progress', max_length=20),
+        ),
+        migrations.RunPython(mark_completed, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-17 06:14
+
+from django.db import migrations
+
+
+def reinstall_sqlite_search_index(apps, schema_editor):
+    """Replace the rowid-keyed SQLite FTS5 table with one keyed by product id"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    from shop.search import get_search_backend
+    backend = get_search_backend(schema_editor.connection)
+    backend.uninstall(schema_editor)
+    backend.install(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0028_idempotency_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(reinstall_sqlite_search_index, migrations.RunPython.noop),
+    ]
@@ -2,8 +2,14 @@ from django.db import models
 from django.utils.text import slugify
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
-from django.db.models.signals import pre_save, post_save
+from django.db import transaction
+from django.db.models import Count, Exists, F, FloatField, Func, OuterRef, Q, Subquery
+from django.db.models.functions import Cast, Coalesce, Greatest, Now
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .dirty_fields import DirtyFieldsMixin
 
 # Import media URL constants
 try:
@@ -91,9 +97,49 @@ class Category(models.Model):
             return "https://via.placeholder.com/400x400/e5e7eb/6b7280?text=No+Image"
 
 
-class Product(models.Model):
+class ProductQuerySet(models.QuerySet):
+    """QuerySet with the annotations needed to render catalog listings"""
+    
+    def with_variant_stock(self, exclude_reference=None):
+        """
+        Annotate stock net of active reservations: `held_quantity` (units of
+        the product itself on hold) and `has_variant_stock` (any available
+        variant with unheld stock left). Holds made under `exclude_reference`
+        (the caller's own checkout) don't count.
+        """
+        variant_stock = ProductVariant.objects.filter(
+            product=OuterRef('pk'),
+            is_available=True
+        ).with_holds(exclude_reference).filter(stock_quantity__gt=F('held_quantity'))
+        return self.annotate(
+            held_quantity=StockReservation.held(exclude_reference, product=OuterRef('pk'), variant__isnull=True),
+            has_variant_stock=Exists(variant_stock),
+        )
+    
+    def for_listing(self):
+        """
+        Active products with everything a listing card needs resolved in the
+        same SELECT: category (join), variant stock (EXISTS subquery) and the
+        primary gallery image (scalar subqueries). Review aggregates are
+        plain columns on Product, so a listing page costs one statement
+        regardless of page size.
+        """
+        primary_image = ProductImage.objects.filter(
+            product=OuterRef('pk'),
+            is_primary=True
+        ).order_by('order', 'created_at')
+        
+        return self.filter(is_active=True).select_related('category').with_variant_stock().annotate(
+            primary_image_file=Subquery(primary_image.values('image')[:1]),
+            primary_image_url=Subquery(primary_image.values('image_url')[:1]),
+        )
+
+
+class Product(DirtyFieldsMixin, models.Model):
     """Product model for shop items"""
     
+    tracked_fields = ('category', 'price')
+    
     id = models.CharField(
         max_length=100, 
         primary_key=True,
@@ -157,12 +203,49 @@ class Product(models.Model):
         help_text="Whether the product should be featured on the home page"
     )
     
+    # Review aggregates (maintained incrementally from ProductReview changes)
+    average_rating = models.FloatField(
+        default=0.0,
+        editable=False,
+        help_text="Average rating of approved reviews (auto-calculated)"
+    )
+    review_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Number of approved reviews (auto-calculated)"
+    )
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProductQuerySet.as_manager()
+    
+    RATING_COUNT_FIELDS = {
+        1: 'rating_1_count',
+        2: 'rating_2_count',
+        3: 'rating_3_count',
+        4: 'rating_4_count',
+        5: 'rating_5_count',
+    }
+    
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination orders (see shop.pagination.KeysetPagination)
+            models.Index(fields=['created_at', 'id'], name='product_created_keyset_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_keyset_idx'),
+            models.Index(fields=['title', 'id'], name='product_title_keyset_idx'),
+        ]
+        constraints = [
+            # Backstop for shop.inventory's conditional decrements
+            models.CheckConstraint(condition=Q(stock_quantity__gte=0), name='product_stock_non_negative'),
+        ]
     
     def __str__(self):
         return self.title
@@ -170,11 +253,18 @@ class Product(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
+        adding = self._state.adding
         super().save(*args, **kwargs)
         
-        # Update category product count
-        if hasattr(self, 'category') and self.category:
-            self.category.update_product_count()
+        # Update category product counts, only when the category changed
+        if adding or 'category' in self.saved_changes:
+            if self.category_id:
+                self.category.update_product_count()
+            previous_category_key = self.saved_changes.get('category')
+            if previous_category_key:
+                previous_category = Category.objects.filter(key=previous_category_key).first()
+                if previous_category:
+                    previous_category.update_product_count()
     
     def delete(self, *args, **kwargs):
         category = self.category
@@ -193,21 +283,113 @@ class Product(models.Model):
             return self.image.url
         elif self.image_url:
             return self.image_url
-        else:
-            return "https://via.placeholder.com/400x400/e5e7eb/6b7280?text=No+Image"
+        
+        # Fall back to the primary gallery image when annotated by for_listing()
+        primary_file = self.__dict__.get('primary_image_file')
+        if primary_file:
+            return ProductImage._meta.get_field('image').storage.url(primary_file)
+        primary_url = self.__dict__.get('primary_image_url')
+        if primary_url:
+            return primary_url
+        
+        return "https://via.placeholder.com/400x400/e5e7eb/6b7280?text=No+Image"
     
     @property
     def display_image_url(self):
         """Property to get the display image URL"""
         return self.get_image_url()
+    
+    @property
+    def rating_distribution(self):
+        """Return the approved review histogram as {stars: count}"""
+        return {
+            rating: getattr(self, field)
+            for rating, field in sorted(self.RATING_COUNT_FIELDS.items(), reverse=True)
+        }
+    
+    @classmethod
+    def apply_review_delta(cls, product_id, rating, delta):
+        """
+        Add (delta=1) or remove (delta=-1) one approved review with the given
+        rating from the stored aggregates in a single UPDATE statement.
+        """
+        rating_field = cls.RATING_COUNT_FIELDS.get(rating)
+        if not rating_field:
+            return
+        
+        new_count = F('review_count') + delta
+        new_total = sum(F(field) * stars for stars, field in cls.RATING_COUNT_FIELDS.items()) + rating * delta
+        
+        cls.objects.filter(pk=product_id).update(
+            review_count=new_count,
+            average_rating=Cast(new_total, FloatField()) / Cast(Greatest(new_count, 1), FloatField()),
+            **{rating_field: F(rating_field) + delta}
+        )
+    
+    @classmethod
+    def recalculate_review_stats(cls, product_ids=None):
+        """
+        Rebuild review aggregates from the approved reviews.
+        
+        Used after bulk review updates (which bypass signals) and by the
+        reconcile_review_stats command. Returns the number of products changed.
+        """
+        products = cls.objects.all()
+        reviews = ProductReview.objects.filter(is_approved=True)
+        if product_ids is not None:
+            product_ids = list(product_ids)
+            products = products.filter(pk__in=product_ids)
+            reviews = reviews.filter(product_id__in=product_ids)
+        
+        stats = {
+            row['product_id']: row
+            for row in reviews.values('product_id').annotate(
+                total=Count('id'),
+                **{
+                    field: Count('id', filter=Q(rating=stars))
+                    for stars, field in cls.RATING_COUNT_FIELDS.items()
+                }
+            )
+        }
+        
+        fields = ['review_count', 'average_rating'] + list(cls.RATING_COUNT_FIELDS.values())
+        changed = []
+        for product in products.only('pk', *fields):
+            row = stats.get(product.pk, {})
+            values = {field: row.get(field, 0) for field in cls.RATING_COUNT_FIELDS.values()}
+            values['review_count'] = row.get('total', 0)
+            rating_total = sum(values[field] * stars for stars, field in cls.RATING_COUNT_FIELDS.items())
+            values['average_rating'] = rating_total / values['review_count'] if values['review_count'] else 0.0
+            
+            if any(getattr(product, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(product, field, value)
+                changed.append(product)
+        
+        cls.objects.bulk_update(changed, fields, batch_size=500)
+        if changed:
+            # bulk_update() bypasses post_save, so invalidate cached listings here
+            from .catalog_cache import bump_catalog_version
+            transaction.on_commit(bump_catalog_version)
+        return len(changed)
 
+    @property
+    def available_quantity(self):
+        """Stock not held by active reservations (needs the with_variant_stock() annotation)"""
+        return self.stock_quantity - self.__dict__.get('held_quantity', 0)
+    
     @property
     def is_in_stock(self):
         """Check if product is in stock (considering both main stock and variants)"""
         # First check main product stock
-        if self.stock_quantity > 0:
+        if self.available_quantity > 0:
             return True
         
+        # Use the EXISTS annotation from for_listing() when available
+        has_variant_stock = self.__dict__.get('has_variant_stock')
+        if has_variant_stock is not None:
+            return has_variant_stock
+        
         # If main stock is 0, check if any variants are in stock
         try:
             # Check if any variants have stock
@@ -273,9 +455,12 @@ class ProductTagAssignment(models.Model):
 # Tags are now accessed via tag_assignments relationship in serializers
 
 
-class Order(models.Model):
+class Order(DirtyFieldsMixin, models.Model):
     """Order model for tracking purchases"""
     
+    # Status transitions drive the customer emails (order_status_changed)
+    tracked_fields = ('status',)
+    
     STATUS_CHOICES = [
         ('pending', 'Pending'),
         ('processing', 'Processing'),
@@ -350,6 +535,7 @@ class Order(models.Model):
     payment_reference = models.CharField(
         max_length=200,
         blank=True,
+        db_index=True,
         help_text="Payment gateway reference"
     )
     
@@ -438,38 +624,56 @@ class OrderItem(models.Model):
         return f"${self.total_price:.2f}"
 
 
+def order_item_lines(order):
+    """
+    Line items of `order` for email templates. Uses the OrderItem objects
+    the creator attached as order._line_items (products already loaded);
+    otherwise loads them with their products in one query.
+    """
+    items = getattr(order, '_line_items', None)
+    if items is None:
+        items = order.items.select_related('product')
+    lines = []
+    for item in items:
+        name = item.product.title if item.product else "Product"
+        variant_info = [part for part in (item.selected_size, item.selected_color) if part]
+        if variant_info:
+            name += f" ({', '.join(variant_info)})"
+        lines.append({
+            'name': name,
+            'sku': getattr(item.product, 'sku', 'N/A'),
+            'quantity': item.quantity,
+            'price': f"${item.unit_price:.2f}",
+            'total': f"${item.total_price:.2f}"
+        })
+    return lines
+
+
+def notify_new_order(order):
+    """Admin notification for a new order; runs after the order is committed"""
+    try:
+        from .email_service import send_admin_notification_email
+        success = send_admin_notification_email(order, order_item_lines(order))
+        print(f"Admin notification email sent for new order {order.id}: {success}")
+    except Exception as e:
+        print(f"Failed to send admin notification for new order {order.id}: {e}")
+
+
 # Signal handlers for email notifications
 @receiver(post_save, sender=Order)
 def order_status_changed(sender, instance, created, **kwargs):
     """Send email notifications when order status changes or new order is created"""
     try:
         if created:
-            # New order created - send admin notification
-            try:
-                from .email_service import send_admin_notification_email
-                
-                # Get order items for the notification
-                order_items = []
-                for item in instance.items.all():
-                    order_items.append({
-                        'name': item.product.title,
-                        'sku': getattr(item.product, 'sku', 'N/A'),
-                        'quantity': item.quantity,
-                        'price': f"${item.unit_price:.2f}",
-                        'total': f"${item.total_price:.2f}"
-                    })
-                
-                success = send_admin_notification_email(instance, order_items)
-                print(f"Admin notification email sent for new order {instance.id}: {success}")
-                
-            except Exception as e:
-                print(f"Failed to send admin notification for new order {instance.id}: {e}")
+            # New order created - send the admin notification once the
+            # order and its items are committed (they're inserted after it)
+            transaction.on_commit(lambda: notify_new_order(instance))
         
         elif not created and instance.pk:  # Only for existing orders (not new ones)
             try:
-                # Get the previous state from the database
-                if hasattr(instance, '_old_status'):
-                    old_status = instance._old_status
+                # Status before this save, tracked on the instance (no re-fetch)
+                if 'status' in instance.saved_changes:
+                    old_status = instance.saved_changes['status']
                     
                     if old_status != instance.status:
                         # Status has changed, send appropriate email
@@ -518,18 +722,6 @@ def order_status_changed(sender, instance, created, **kwargs):
         pass  # Don't let email errors break the admin interface
 
 
-# Store old status before saving
-@receiver(pre_save, sender=Order)
-def store_old_status(sender, instance, **kwargs):
-    """Store the old status before saving"""
-    if instance.pk:
-        try:
-            old_order = Order.objects.get(pk=instance.pk)
-            instance._old_status = old_order.status
-        except Order.DoesNotExist:
-            instance._old_status = None
-
-
 class ProductImage(models.Model):
     """Multiple images for a product"""
     
@@ -629,6 +821,13 @@ class ProductColor(models.Model):
         return self.name
 
 
+class ProductVariantQuerySet(models.QuerySet):
+    
+    def with_holds(self, exclude_reference=None):
+        """Annotate `held_quantity`: units on hold by active reservations"""
+        return self.annotate(held_quantity=StockReservation.held(exclude_reference, variant=OuterRef('pk')))
+
+
 class ProductVariant(models.Model):
     """Product variants with specific size and color combinations"""
     
@@ -663,8 +862,13 @@ class ProductVariant(models.Model):
         help_text="Whether this variant is available"
     )
     
+    objects = ProductVariantQuerySet.as_manager()
+    
     class Meta:
         unique_together = ['product', 'size', 'color']
+        constraints = [
+            models.CheckConstraint(condition=Q(stock_quantity__gte=0), name='variant_stock_non_negative'),
+        ]
         
     def __str__(self):
         return f"{self.product.title} - {self.size.name} - {self.color.name}"
@@ -674,10 +878,72 @@ class ProductVariant(models.Model):
         """Calculate final price including adjustment"""
         return self.product.price + self.price_adjustment
     
+    @property
+    def available_quantity(self):
+        """Stock not held by active reservations (needs the with_holds() annotation)"""
+        return self.stock_quantity - self.__dict__.get('held_quantity', 0)
+    
     @property
     def is_in_stock(self):
         """Check if this variant is in stock"""
-        return self.stock_quantity > 0 and self.is_available
+        return self.available_quantity > 0 and self.is_available
+
+
+class StockReservation(models.Model):
+    """
+    Temporary hold on stock while a customer pays.
+    
+    Created when a checkout session starts (see shop.reservations), consumed
+    by create_order and ignored once expired; release_expired_reservations
+    deletes the leftovers. Holds on a variant leave the product's own stock
+    alone, matching how orders decrement stock.
+    """
+    
+    reference = models.CharField(
+        max_length=255,
+        db_index=True,
+        help_text="Payment session or reference the hold belongs to"
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='reservations'
+    )
+    variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='reservations'
+    )
+    quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['expires_at']
+        indexes = [
+            # Active-hold sums per product / variant (see held())
+            models.Index(fields=['product', 'variant', 'expires_at'], name='reservation_product_idx'),
+            models.Index(fields=['variant', 'expires_at'], name='reservation_variant_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.quantity}x {self.product_id} held for {self.reference}"
+    
+    @classmethod
+    def held(cls, exclude_reference=None, **lookups):
+        """
+        Subquery expression summing active holds that match `lookups`
+        (typically against an OuterRef), 0 when there are none.
+        """
+        holds = cls.objects.filter(expires_at__gt=Now(), **lookups)
+        if exclude_reference:
+            holds = holds.exclude(reference=exclude_reference)
+        # SUM without GROUP BY: one row per outer row
+        total = holds.order_by().annotate(total=Func(F('quantity'), function='SUM')).values('total')
+        return Coalesce(Subquery(total, output_field=models.IntegerField()), 0)
 
 
 class PromoCode(models.Model):
@@ -895,12 +1161,54 @@ class ProductReview(models.Model):
     def __str__(self):
         return f"{self.user_name} - {self.product.title} ({self.rating}★)"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what this review contributed to the product aggregates
+        instance._counted_state = instance.counted_state
+        return instance
+    
+    @property
+    def counted_state(self):
+        """(product_id, rating) if this review counts towards the aggregates"""
+        if self.is_approved:
+            return (self.product_id, self.rating)
+        return None
+    
     @property
     def rating_stars(self):
         """Return rating as stars string"""
         return "★" * self.rating + "☆" * (5 - self.rating)
 
 
+@receiver(post_save, sender=ProductReview)
+def update_review_aggregates_on_save(sender, instance, created, **kwargs):
+    """Keep Product review aggregates in sync when a review is created or edited"""
+    old_state = None if created else getattr(instance, '_counted_state', None)
+    new_state = instance.counted_state
+    
+    if not created and not hasattr(instance, '_counted_state'):
+        # Instance wasn't loaded from the database, so we don't know what it
+        # contributed before - rebuild this product's aggregates instead.
+        Product.recalculate_review_stats([instance.product_id])
+    elif old_state != new_state:
+        with transaction.atomic():
+            if old_state:
+                Product.apply_review_delta(old_state[0], old_state[1], -1)
+            if new_state:
+                Product.apply_review_delta(new_state[0], new_state[1], 1)
+    
+    instance._counted_state = new_state
+
+
+@receiver(post_delete, sender=ProductReview)
+def update_review_aggregates_on_delete(sender, instance, **kwargs):
+    """Remove a deleted review from the Product review aggregates"""
+    state = getattr(instance, '_counted_state', instance.counted_state)
+    if state:
+        Product.apply_review_delta(state[0], state[1], -1)
+
+
 class ReviewHelpfulVote(models.Model):
     """Helpful votes for reviews"""
     
@@ -970,4 +1278,172 @@ class ReviewImage(models.Model):
         ordering = ['order', 'created_at']
         
     def __str__(self):
-        return f"Image for review by {self.review.user_name}"
\ No newline at end of file
+        return f"Image for review by {self.review.user_name}"
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Stored outcome of a request made with an Idempotency-Key header.
+    
+    The unique (scope, key) row is claimed ('in_progress') before the
+    request runs and completed with its response afterwards; duplicates
+    replay the response, or get a 409 while the first attempt is still in
+    flight (see shop.idempotency).
+    """
+    
+    STATUS_CHOICES = [
+        ('in_progress', 'In progress'),
+        ('completed', 'Completed'),
+    ]
+    
+    scope = models.CharField(max_length=100, help_text="Endpoint the key was used on")
+    key = models.CharField(max_length=255, help_text="Client supplied Idempotency-Key")
+    request_hash = models.CharField(max_length=64, help_text="SHA-256 of the request body")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='in_progress')
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='idempotency_scope_key_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
+
+
+class EmailOutbox(models.Model):
+    """
+    An outgoing email, written in the same transaction as the change that
+    triggered it (order placed, status changed) and delivered later by the
+    run_email_worker command (see shop.email_outbox).
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    ]
+    
+    subject = models.CharField(max_length=255)
+    body = models.TextField(help_text="Plain text body")
+    html_body = models.TextField(blank=True, help_text="HTML alternative")
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    reply_to = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['next_attempt_at', 'pk']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='email_outbox_due_idx'),
+        ]
+        verbose_name = "Outgoing Email"
+        verbose_name_plural = "Email Outbox"
+    
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
+
+
+class MomoTransaction(models.Model):
+    """
+    An MTN MoMo payment request. Stored in the database (and cached by
+    shop.momo) so any worker can answer status polls, and restarts don't
+    lose pending payments.
+    """
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('success', 'Success'),
+        ('failed', 'Failed'),
+    ]
+    
+    reference = models.CharField(max_length=64, unique=True, help_text="Reference returned to the client")
+    phone = models.CharField(max_length=20)
+    usd_amount = models.DecimalField(max_digits=10, decimal_places=2, help_text="Amount in USD dollars")
+    ghs_amount = models.PositiveIntegerField(help_text="Amount charged in pesewas")
+    currency = models.CharField(max_length=3, default='GHS')
+    exchange_rate = models.FloatField(null=True, blank=True)
+    conversion_info = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    # Sandbox: status the payment moves to at resolve_at
+    resolves_to = models.CharField(max_length=10, choices=STATUS_CHOICES, blank=True)
+    resolve_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'resolve_at'], name='momo_status_resolve_idx'),
+        ]
+        verbose_name = "MoMo Transaction"
+    
+    def __str__(self):
+        return f"{self.reference} ({self.status})"
+
+
+class ExchangeRate(models.Model):
+    """
+    Latest known exchange rate for a currency pair, kept fresh by
+    shop.currency_service so conversions never wait on a rate provider.
+    """
+    
+    base = models.CharField(max_length=3)
+    quote = models.CharField(max_length=3)
+    rate = models.DecimalField(max_digits=14, decimal_places=6)
+    source = models.CharField(max_length=30, help_text="Provider the rate came from")
+    fetched_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['base', 'quote'], name='exchange_rate_pair_unique'),
+        ]
+        verbose_name = "Exchange Rate"
+    
+    def __str__(self):
+        return f"1 {self.base} = {self.rate} {self.quote}"
+
+
+class PriceBook(models.Model):
+    """
+    A product's (or variant's) price converted to another currency, with
+    its display string. Precomputed by shop.price_book whenever a rate or
+    a price changes, so listings only read them.
+    """
+    
+    currency = models.CharField(max_length=3)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='localized_prices')
+    # Set for a variant's final price, empty for the product's own price
+    variant = models.ForeignKey(
+        ProductVariant, on_delete=models.CASCADE, null=True, blank=True, related_name='localized_prices'
+    )
+    price = models.DecimalField(max_digits=14, decimal_places=2)
+    display = models.CharField(max_length=32)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['currency', 'product'], condition=Q(variant__isnull=True),
+                name='price_book_product_unique',
+            ),
+            models.UniqueConstraint(
+                fields=['currency', 'variant'], condition=Q(variant__isnull=False),
+                name='price_book_variant_unique',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['currency', 'product'], name='price_book_lookup_idx'),
+        ]
+        verbose_name = "Price Book Entry"
+        verbose_name_plural = "Price Book"
+    
+    def __str__(self):
+        return f"{self.product_id} {self.display}"
@@ -0,0 +1,93 @@
+"""
+MoMo transaction store.
+
+Transactions live in the MomoTransaction table with a write-through cache
+(the MOMO namespace of shop.cache) in front, so a status poll is one
+cache read on whichever worker it lands. Every write updates the cache.
+Pending entries are cached only briefly, so a write that skipped the
+cache (a bulk update, a shell) shows up within PENDING_CACHE_TIMEOUT;
+finished payments don't change and are cached for longer.
+
+Sandbox payments resolve on a timer: the outcome and its due time are
+stored on the row (resolves_to, resolve_at) and applied by the first read
+after it is due, in any worker. No sleeping threads, and nothing is lost
+when a worker restarts.
+
+A payment that fails gives its held stock back (shop.reservations) when
+it moves to `failed`, not on every status read.
+"""
+
+from django.utils import timezone
+
+from .cache import MOMO
+from .models import MomoTransaction
+from .reservations import release_reservations
+
+PENDING_CACHE_TIMEOUT = 2
+FINISHED_CACHE_TIMEOUT = 3600
+
+_STATE_FIELDS = (
+    'reference', 'status', 'phone', 'usd_amount', 'ghs_amount', 'currency',
+    'exchange_rate', 'conversion_info', 'resolves_to', 'resolve_at',
+)
+
+
+def _cache_key(reference):
+    return f'txn:{reference}'
+
+
+def _cache_state(state):
+    timeout = PENDING_CACHE_TIMEOUT if state['status'] == 'pending' else FINISHED_CACHE_TIMEOUT
+    MOMO.set(_cache_key(state['reference']), state, timeout)
+    return state
+
+
+def refresh_cached_transaction(reference):
+    """Re-read a payment into the cache (after writes made elsewhere, e.g. the admin)"""
+    state = MomoTransaction.objects.filter(reference=reference).values(*_STATE_FIELDS).first()
+    return _cache_state(state) if state else None
+
+
+def create_transaction(reference, phone, usd_amount, conversion, resolves_to='', resolve_in=None):
+    """
+    Record a new pending payment. For sandbox test numbers pass the
+    outcome (`resolves_to`) and a timedelta after which it applies.
+    """
+    transaction = MomoTransaction.objects.create(
+        reference=reference,
+        phone=phone,
+        usd_amount=usd_amount,
+        ghs_amount=conversion['ghs_amount_pesewas'],
+        currency='GHS',
+        exchange_rate=conversion['exchange_rate'],
+        conversion_info=conversion,
+        resolves_to=resolves_to,
+        resolve_at=timezone.now() + resolve_in if resolve_in is not None else None,
+    )
+    _cache_state({field: getattr(transaction, field) for field in _STATE_FIELDS})
+    return transaction
+
+
+def get_transaction(reference, now=None):
+    """Current state of a payment as a dict (see _STATE_FIELDS), or None"""
+    state = MOMO.get(_cache_key(reference)) or refresh_cached_transaction(reference)
+    if state is None:
+        return None
+    if state['status'] == 'pending' and state['resolve_at'] and state['resolve_at'] <= (now or timezone.now()):
+        state = set_status(reference, state['resolves_to'], only_if='pending')
+    return state
+
+
+def set_status(reference, status, only_if=None):
+    """
+    Move a payment to `status`; with `only_if`, only from that status (so
+    concurrent workers apply a transition once). Returns the payment's
+    state afterwards, freshly cached.
+    """
+    transactions = MomoTransaction.objects.filter(reference=reference)
+    if only_if is not None:
+        transactions = transactions.filter(status=only_if)
+    if transactions.update(status=status, updated_at=timezone.now()) and status == 'failed':
+        # Give the held stock back, once: only the transition that applied does
+        release_reservations(reference)
+    return refresh_cached_transaction(reference)
@@ -0,0 +1,184 @@
+"""
+Keyset (cursor) pagination for catalog endpoints.
+
+Pages are addressed by an opaque cursor that encodes the sort key values of
+the boundary row instead of an OFFSET, so page 500 costs the same index
+range scan as page 1 and no COUNT(*) is issued unless a total is asked for.
+"""
+
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class InvalidCursor(Exception):
+    """Raised when a cursor can't be decoded or doesn't match the sort order."""
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor paginator over a fixed set of sort orders.
+
+    Every ordering ends with the primary key so positions are unique. Query
+    parameters: ``cursor``, ``sort``, ``page_size`` and ``include_total``.
+    """
+
+    cursor_query_param = 'cursor'
+    sort_query_param = 'sort'
+    page_size_query_param = 'page_size'
+    total_query_param = 'include_total'
+
+    page_size = 50
+    max_page_size = 100
+
+    default_sort = 'newest'
+    orderings = {
+        'newest': ('-created_at', '-id'),
+        'oldest': ('created_at', 'id'),
+        'price_low': ('price', 'id'),
+        'price_high': ('-price', '-id'),
+        'name': ('title', 'id'),
+    }
+
+    @classmethod
+    def key_fields(cls):
+        """Every column any ordering reads (keep them when projecting with only())"""
+        return {field.lstrip('-') for ordering in cls.orderings.values() for field in ordering}
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.sort = self.get_sort(request)
+        self.ordering = self.orderings[self.sort]
+        self.limit = self.get_page_size(request)
+        self.total = queryset.count() if self.wants_total(request) else None
+
+        position, reverse = self.decode_cursor(request)
+        ordering = self._reversed(self.ordering) if reverse else self.ordering
+
+        if position is not None:
+            queryset = queryset.filter(self._after(queryset.model, ordering, position))
+
+        # Fetch one extra row to know whether there is another page
+        rows = list(queryset.order_by(*ordering)[:self.limit + 1])
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+
+        if reverse:
+            rows.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = rows
+        return rows
+
+    def get_paginated_payload(self, data):
+        payload = {
+            'results': data,
+            'count': len(data),
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'sort': self.sort,
+        }
+        if self.total is not None:
+            payload['total'] = self.total
+        return payload
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_payload(data))
+
+    def get_sort(self, request):
+        sort = request.GET.get(self.sort_query_param, self.default_sort)
+        return sort if sort in self.orderings else self.default_sort
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.GET.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def wants_total(self, request):
+        return request.GET.get(self.total_query_param, '').lower() in ('1', 'true', 'yes')
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self._link(self._position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self._link(self._position(self.page[0]), reverse=True)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'s': self.sort, 'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        """Return (position, reverse) for the request's cursor, or (None, False)"""
+        encoded = request.GET.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            position = payload['p']
+            reverse = bool(payload.get('r'))
+        except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+            raise InvalidCursor('Invalid cursor')
+
+        if payload.get('s') != self.sort or not isinstance(position, list) or len(position) != len(self.ordering):
+            raise InvalidCursor('Cursor does not match the requested sort order')
+        return position, reverse
+
+    def _position(self, obj):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            # Model instances, or dicts from a values() queryset
+            value = obj[name] if isinstance(obj, dict) else getattr(obj, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return values
+
+    def _link(self, position, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, '_t')  # frontend cache-buster
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+    @staticmethod
+    def _reversed(ordering):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+    @staticmethod
+    def _after(model, ordering, position):
+        """
+        Build the row-value comparison ``(a, b) > (x, y)`` as
+        ``a > x OR (a = x AND b > y)``, honouring each field's direction.
+        """
+        try:
+            values = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(ordering, position)
+            ]
+        except ValidationError:
+            raise InvalidCursor('Invalid cursor')
+
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f'{name}__{lookup}': values[index]})
+            for prev_field, prev_value in zip(ordering[:index], values[:index]):
+                clause &= Q(**{prev_field.lstrip('-'): prev_value})
+            condition |= clause
+        return condition
@@ -0,0 +1,155 @@
+"""
+Push-style payment status for the checkout pages.
+
+Instead of polling a status endpoint on a timer, the client opens one
+request and is told when the payment changes:
+
+- an SSE stream (text/event-stream) that sends a `status` event for the
+  current state and every change after it, and ends once the payment is
+  finished;
+- a long-poll that returns as soon as the status differs from the one the
+  client already knows, or after `timeout` seconds.
+
+A waiting request re-reads the status with an asyncio sleep in between,
+which costs nothing while it waits. The sleep starts at POLL_INTERVAL and
+backs off to MAX_POLL_INTERVAL while nothing changes. Reads hit the cache
+(shop.momo, Stripe session status), and both are updated as soon as the
+payment changes.
+
+Waiting only pays off on an ASGI server (the `events` process, see the
+Procfile), where hundreds of waiting customers hold no worker threads.
+The main site runs on sync WSGI workers, where a waiting request would
+hold a whole worker: there the stream sends the current state and asks
+EventSource to reconnect after RECONNECT_DELAY, and the long-poll answers
+at once, which amounts to the plain polling the pages did before.
+"""
+
+import asyncio
+import json
+
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+
+POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 5
+POLL_BACKOFF = 1.5
+
+LONG_POLL_TIMEOUT = 25
+MAX_LONG_POLL_TIMEOUT = 55
+
+# Streams end after this long; EventSource reconnects on its own
+STREAM_DURATION = 300
+KEEPALIVE_INTERVAL = 15
+
+# EventSource reconnect delay (ms) for streams that can't wait (WSGI)
+RECONNECT_DELAY = 2000
+
+FINISHED_STATUSES = {'success', 'failed', 'paid', 'expired'}
+
+
+def can_wait(request):
+    """Whether the request is served by the event loop, so waiting holds no worker"""
+    return isinstance(request, ASGIRequest)
+
+
+def _next_interval(interval):
+    return min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+
+
+def long_poll_timeout(request):
+    if not can_wait(request):
+        return 0
+    try:
+        timeout = float(request.GET.get('timeout', LONG_POLL_TIMEOUT))
+    except ValueError:
+        timeout = LONG_POLL_TIMEOUT
+    return min(max(timeout, 0), MAX_LONG_POLL_TIMEOUT)
+
+
+async def wait_for_change(read, known_status, timeout):
+    """
+    Await `read()` (an async callable returning the status dict, or None)
+    until its status differs from `known_status`, the payment is finished,
+    or `timeout` seconds pass. Returns the last state read.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    interval = POLL_INTERVAL
+    state = await read()
+    while (
+        state is not None
+        and state['status'] == known_status
+        and state['status'] not in FINISHED_STATUSES
+        and loop.time() < deadline
+    ):
+        await asyncio.sleep(min(interval, max(deadline - loop.time(), 0)))
+        interval = _next_interval(interval)
+        state = await read()
+    return state
+
+
+def _event(state):
+    return f"event: status\ndata: {json.dumps(state, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def status_events(read, duration=STREAM_DURATION):
+    """
+    SSE frames: the current state, then every change until finished. With
+    `duration=0`, only the current state and a reconnect delay.
+    """
+    if not duration:
+        state = await read()
+        if state is None:
+            yield 'event: error\ndata: {"error": "Transaction not found"}\n\n'
+        else:
+            yield f"retry: {RECONNECT_DELAY}\n" + _event(state)
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    last_status = None
+    last_sent = loop.time()
+    interval = POLL_INTERVAL
+    while loop.time() < deadline:
+        state = await read()
+        if state is None:
+            yield 'event: error\ndata: {"error": "Transaction not found"}\n\n'
+            return
+        if state['status'] != last_status:
+            last_status = state['status']
+            last_sent = loop.time()
+            interval = POLL_INTERVAL
+            yield _event(state)
+            if last_status in FINISHED_STATUSES:
+                return
+        else:
+            interval = _next_interval(interval)
+            if loop.time() - last_sent >= KEEPALIVE_INTERVAL:
+                # Comment line: keeps proxies from closing an idle connection
+                last_sent = loop.time()
+                yield ': keepalive\n\n'
+        await asyncio.sleep(interval)
+
+
+
+def event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Don't let nginx-style proxies buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def status_stream_response(request, read):
+    if can_wait(request):
+        return event_stream_response(status_events(read))
+    # Sync workers get the current state only, as a plain iterator
+    return event_stream_response([frame async for frame in status_events(read, duration=0)])
+
+
+async def long_poll_response(request, read):
+    state = await wait_for_change(read, request.GET.get('status'), long_poll_timeout(request))
+    if state is None:
+        return JsonResponse({'error': 'Transaction not found'}, status=404)
+    return JsonResponse(state, encoder=DjangoJSONEncoder)
@@ -6,10 +6,14 @@ urlpatterns = [
     path('stripe/create-checkout-session/', payment_views.create_stripe_checkout_session, name='stripe-checkout'),
     path('stripe/verify-session/<str:session_id>/', payment_views.verify_stripe_session, name='stripe-verify-session'),
     path('stripe/webhook/', payment_views.stripe_webhook, name='stripe-webhook'),
+    path('stripe/status/<str:session_id>/events/', payment_views.stripe_status_events, name='stripe-status-events'),
+    path('stripe/status/<str:session_id>/wait/', payment_views.wait_stripe_status, name='stripe-status-wait'),
     
     # MTN MoMo endpoints
     path('momo/initiate/', payment_views.initiate_momo_payment, name='momo-initiate'),
     path('momo/status/<str:reference>/', payment_views.check_momo_status, name='momo-status'),
+    path('momo/status/<str:reference>/events/', payment_views.momo_status_events, name='momo-status-events'),
+    path('momo/status/<str:reference>/wait/', payment_views.wait_momo_status, name='momo-status-wait'),
     
     # Order creation
     path('create-order/', payment_views.create_order, name='create-order'),
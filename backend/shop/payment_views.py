@@ -2,17 +2,26 @@ import stripe
 import requests
 import json
 import uuid
+from datetime import timedelta
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_GET, require_http_methods
+from django.db import DatabaseError, transaction
 from django.utils import timezone
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from .models import Order, OrderItem, Product
+from .cache import STRIPE_SESSIONS
 from .currency_service import convert_usd_to_ghs, get_rate_display
 from .email_service import send_order_confirmation_email
+from .idempotency import idempotent
+from .inventory import CartLookup, InsufficientStock, decrement_stock
+from .momo import create_transaction as create_momo_transaction, get_transaction as get_momo_transaction
+from .payment_events import long_poll_response, status_stream_response
+from .reservations import consume_reservations, release_reservations, rename_reservations, reserve_stock
 import logging
 
 logger = logging.getLogger(__name__)
@@ -26,12 +35,18 @@ MOMO_SUBSCRIPTION_KEY = getattr(settings, 'MOMO_SUBSCRIPTION_KEY', '')
 MOMO_API_USER = getattr(settings, 'MOMO_API_USER', '')
 MOMO_API_KEY = getattr(settings, 'MOMO_API_KEY', '')
 
-# In-memory storage for MoMo transactions (use Redis/database in production)
-momo_transactions = {}
+def _cart_items(items):
+    """Cart lines that reference a catalog product, in the shape reserve_stock() expects"""
+    return [
+        {'product_id': item['product_id'], 'variant_id': item.get('variant_id'), 'quantity': item.get('quantity', 1)}
+        for item in items
+        if item.get('product_id')
+    ]
 
 
 @api_view(['POST'])
 @csrf_exempt
+@idempotent('stripe-checkout')
 def create_stripe_checkout_session(request):
     """Create a Stripe Checkout session"""
     try:
@@ -43,6 +58,17 @@ def create_stripe_checkout_session(request):
         if not items:
             return Response({'error': 'No items provided'}, status=status.HTTP_400_BAD_REQUEST)
         
+        # Hold the stock while the customer pays; the holds move to the
+        # session id once Stripe assigns one
+        hold_reference = f"pending_{uuid.uuid4().hex}"
+        try:
+            holds = reserve_stock(hold_reference, _cart_items(items))
+        except InsufficientStock as e:
+            return Response({
+                'error': 'Some items are out of stock or unavailable',
+                'stock_errors': e.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
         # Create line items for Stripe
         line_items = []
         for item in items:
@@ -85,21 +111,27 @@ def create_stripe_checkout_session(request):
             })
         
         # Create Stripe checkout session
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=line_items,
-            mode='payment',
-            success_url=success_url + '?session_id={CHECKOUT_SESSION_ID}',
-            cancel_url=cancel_url,
-            metadata={
-                'order_type': 'ennc_shop',
-                'item_count': len(items)
-            }
-        )
+        try:
+            checkout_session = stripe.checkout.Session.create(
+                payment_method_types=['card'],
+                line_items=line_items,
+                mode='payment',
+                success_url=success_url + '?session_id={CHECKOUT_SESSION_ID}',
+                cancel_url=cancel_url,
+                metadata={
+                    'order_type': 'ennc_shop',
+                    'item_count': len(items)
+                }
+            )
+        except Exception:
+            release_reservations(hold_reference)
+            raise
+        rename_reservations(hold_reference, checkout_session.id)
         
         return Response({
             'url': checkout_session.url,
-            'session_id': checkout_session.id
+            'session_id': checkout_session.id,
+            'reserved_until': holds[0].expires_at.isoformat() if holds else None
         })
         
     except stripe.error.StripeError as e:
@@ -215,13 +247,89 @@ def stripe_webhook(request):
         session = event['data']['object']
         # Handle successful payment
         logger.info(f"Payment succeeded for session: {session['id']}")
+        _publish_stripe_status(session['id'], _stripe_session_status(session))
         # You can create an order here or update order status
+    elif event['type'] == 'checkout.session.expired':
+        session_id = event['data']['object']['id']
+        # The customer never paid: give the held stock back now rather than at expiry
+        release_reservations(session_id)
+        _publish_stripe_status(session_id, 'expired')
     
     return Response({'status': 'success'})
 
 
+# How often a waiting request asks Stripe itself when no webhook has arrived
+STRIPE_REFRESH_INTERVAL = 5
+
+
+def _stripe_session_status(session):
+    """'paid', 'expired' or 'pending' for a checkout session"""
+    if session['payment_status'] == 'paid' or (
+        session['status'] == 'complete' and session['payment_status'] == 'no_payment_required'
+    ):
+        return 'paid'
+    return 'expired' if session['status'] == 'expired' else 'pending'
+
+
+def _publish_stripe_status(session_id, session_status):
+    """Record a session's status for the waiting status requests"""
+    STRIPE_SESSIONS.set(f'session:{session_id}', session_status)
+
+
+def _fetch_stripe_status(session_id):
+    """Ask Stripe for a session's status (None if there's no such session)"""
+    try:
+        session_status = _stripe_session_status(stripe.checkout.Session.retrieve(session_id))
+    except stripe.error.InvalidRequestError:
+        return None
+    except stripe.error.StripeError as e:
+        logger.warning(f"Stripe status refresh failed for session {session_id}: {e}")
+        return 'pending'
+    if session_status != 'pending':
+        _publish_stripe_status(session_id, session_status)
+    return session_status
+
+
+def _stripe_status_reader(session_id):
+    """
+    Async status read for one session: the status published by the webhook,
+    or Stripe's own answer every STRIPE_REFRESH_INTERVAL seconds until then.
+    """
+    last_fetch = None
+    session_status = 'pending'
+
+    async def read():
+        nonlocal last_fetch, session_status
+        published = await STRIPE_SESSIONS.aget(f'session:{session_id}')
+        if published is not None:
+            session_status = published
+        else:
+            now = timezone.now()
+            if last_fetch is None or (now - last_fetch).total_seconds() >= STRIPE_REFRESH_INTERVAL:
+                last_fetch = now
+                session_status = await sync_to_async(_fetch_stripe_status)(session_id)
+        if session_status is None:
+            return None
+        return {'session_id': session_id, 'status': session_status}
+
+    return read
+
+
+@require_GET
+async def stripe_status_events(request, session_id):
+    """SSE stream of a Stripe checkout session's status"""
+    return await status_stream_response(request, _stripe_status_reader(session_id))
+
+
+@require_GET
+async def wait_stripe_status(request, session_id):
+    """Long-poll: returns once the status differs from ?status= (or after ?timeout= seconds)"""
+    return await long_poll_response(request, _stripe_status_reader(session_id))
+
+
 @api_view(['POST'])
 @csrf_exempt
+@idempotent('momo-initiate')
 def initiate_momo_payment(request):
     """Initiate MTN MoMo payment with currency conversion to GHS"""
     try:
@@ -239,77 +347,40 @@ def initiate_momo_payment(request):
         
         # Convert USD to GHS
         conversion_result = convert_usd_to_ghs(usd_amount)
-        ghs_amount = conversion_result['ghs_amount_pesewas']  # Amount in pesewas
         
         logger.info(f"MoMo payment conversion: {conversion_result['usd_amount_display']} -> {conversion_result['ghs_amount_display']} (Rate: {conversion_result['exchange_rate']})")
         
         # Generate unique reference
         reference = str(uuid.uuid4())
         
+        # Hold the cart's stock (when sent) while the customer approves the payment
+        try:
+            holds = reserve_stock(reference, _cart_items(data.get('items', [])))
+        except InsufficientStock as e:
+            return Response({
+                'error': 'Some items are out of stock or unavailable',
+                'stock_errors': e.errors
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
         # For demo purposes, simulate MoMo API call
         # In production, you would make actual API calls to MTN MoMo with GHS amount
         
-        # Simulate different responses based on phone number for testing
+        # Simulate different responses based on phone number for testing;
+        # the outcome is applied by the first status check after it's due
         if phone.endswith('1111'):  # Test number for success
-            momo_transactions[reference] = {
-                'status': 'pending',
-                'phone': phone,
-                'usd_amount': usd_amount,
-                'ghs_amount': ghs_amount,
-                'currency': 'GHS',
-                'exchange_rate': conversion_result['exchange_rate'],
-                'conversion_info': conversion_result,
-                'created_at': str(uuid.uuid4())
-            }
-            
-            # Simulate success after 5 seconds
-            import threading
-            def simulate_success():
-                import time
-                time.sleep(5)
-                if reference in momo_transactions:
-                    momo_transactions[reference]['status'] = 'success'
-            
-            threading.Thread(target=simulate_success).start()
-            
+            outcome = {'resolves_to': 'success', 'resolve_in': timedelta(seconds=5)}
         elif phone.endswith('2222'):  # Test number for failure
-            momo_transactions[reference] = {
-                'status': 'pending',
-                'phone': phone,
-                'usd_amount': usd_amount,
-                'ghs_amount': ghs_amount,
-                'currency': 'GHS',
-                'exchange_rate': conversion_result['exchange_rate'],
-                'conversion_info': conversion_result,
-                'created_at': str(uuid.uuid4())
-            }
-            
-            # Simulate failure after 3 seconds
-            import threading
-            def simulate_failure():
-                import time
-                time.sleep(3)
-                if reference in momo_transactions:
-                    momo_transactions[reference]['status'] = 'failed'
-            
-            threading.Thread(target=simulate_failure).start()
-            
+            outcome = {'resolves_to': 'failed', 'resolve_in': timedelta(seconds=3)}
         else:  # Regular flow - pending status
-            momo_transactions[reference] = {
-                'status': 'pending',
-                'phone': phone,
-                'usd_amount': usd_amount,
-                'ghs_amount': ghs_amount,
-                'currency': 'GHS',
-                'exchange_rate': conversion_result['exchange_rate'],
-                'conversion_info': conversion_result,
-                'created_at': str(uuid.uuid4())
-            }
+            outcome = {}
+        
+        create_momo_transaction(reference, phone, usd_amount, conversion_result, **outcome)
         
         return Response({
             'reference': reference,
             'status': 'pending',
             'message': f'Payment initiated for {conversion_result["ghs_amount_display"]}. Please check your phone for MoMo prompt.',
+            'reserved_until': holds[0].expires_at.isoformat() if holds else None,
             'currency_conversion': {
                 'original_amount': conversion_result['usd_amount_display'],
                 'charged_amount': conversion_result['ghs_amount_display'],
@@ -328,29 +399,93 @@ def initiate_momo_payment(request):
 def check_momo_status(request, reference):
     """Check MTN MoMo payment status"""
     try:
-        if reference not in momo_transactions:
+        momo_status = _momo_status(reference)
+        if momo_status is None:
             return Response({'error': 'Transaction not found'}, status=status.HTTP_404_NOT_FOUND)
-        
-        transaction = momo_transactions[reference]
-        
-        return Response({
-            'reference': reference,
-            'status': transaction['status'],
-            'phone': transaction['phone'],
-            'usd_amount': transaction.get('usd_amount', transaction.get('amount', 0)),
-            'ghs_amount': transaction.get('ghs_amount', 0),
-            'currency': transaction.get('currency', 'GHS'),
-            'exchange_rate': transaction.get('exchange_rate'),
-            'conversion_info': transaction.get('conversion_info', {})
-        })
+        return Response(momo_status)
         
     except Exception as e:
         logger.error(f"MoMo status check error: {e}")
         return Response({'error': 'Failed to check payment status'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _momo_status(reference):
+    """Status response body for a MoMo payment, or None if there's no such payment"""
+    payment = get_momo_transaction(reference)
+    if payment is None:
+        return None
+    
+    return {
+        'reference': reference,
+        'status': payment['status'],
+        'phone': payment['phone'],
+        'usd_amount': float(payment['usd_amount']),
+        'ghs_amount': payment['ghs_amount'],
+        'currency': payment['currency'],
+        'exchange_rate': payment['exchange_rate'],
+        'conversion_info': payment['conversion_info']
+    }
+
+
+def _momo_status_reader(reference):
+    read = sync_to_async(_momo_status)
+    return lambda: read(reference)
+
+
+@require_GET
+async def momo_status_events(request, reference):
+    """SSE stream of a MoMo payment's status"""
+    return await status_stream_response(request, _momo_status_reader(reference))
+
+
+@require_GET
+async def wait_momo_status(request, reference):
+    """Long-poll: returns once the status differs from ?status= (or after ?timeout= seconds)"""
+    return await long_poll_response(request, _momo_status_reader(reference))
+
+
+def _queue_order_confirmation(order, order_items):
+    """
+    Queue the customer's order confirmation; never fails the order.
+
+    With the outbox enabled the email is inserted in the order's
+    transaction, so it goes out only if the order commits. Otherwise it is
+    sent once the order commits: an SMTP round trip inside the transaction
+    would hold the stock row locks taken by decrement_stock() for as long
+    as the mail server takes.
+    """
+    if not order.customer_email:
+        logger.warning(f"No customer email provided for order {order.id}")
+        return False
+    # Admin notification is sent automatically via post_save signal.
+    if not getattr(settings, 'EMAIL_OUTBOX_ENABLED', False):
+        transaction.on_commit(lambda: _send_order_confirmation(order, order_items), robust=True)
+        return True
+    # In a savepoint: a failed outbox insert must not abort the order's
+    # transaction
+    try:
+        with transaction.atomic():
+            success = send_order_confirmation_email(order, order_items)
+    except DatabaseError as e:
+        logger.error(f"Couldn't queue the confirmation email for order {order.id}: {e}")
+        success = False
+    if success:
+        logger.info(f"✅ Order confirmation email queued for {order.customer_email} (order {order.id})")
+    else:
+        logger.error(f"❌ Order confirmation email failed for order {order.id}")
+    return success
+
+
+def _send_order_confirmation(order, order_items):
+    if send_order_confirmation_email(order, order_items):
+        logger.info(f"✅ Order confirmation email sent to {order.customer_email} (order {order.id})")
+    else:
+        logger.error(f"❌ Order confirmation email failed for order {order.id}")
+
+
 @api_view(['POST'])
 @csrf_exempt
+@idempotent('create-free-order')
 def create_free_order(request):
     """Create an order without payment for specific countries"""
     try:
@@ -376,78 +511,83 @@ def create_free_order(request):
         payment_method = 'free_checkout'
         payment_reference = f"FREE_{order_id}_{int(timezone.now().timestamp())}"
         
-        # Create order with confirmed status
-        order = Order.objects.create(
-            id=order_id,
-            customer_email=data.get('customer_email', ''),
-            customer_name=data.get('customer_name', ''),
-            shipping_address=data.get('shipping_address', ''),
-            shipping_city=data.get('shipping_city', ''),
-            shipping_country=shipping_country,
-            shipping_postal_code=data.get('shipping_postal_code', ''),
-            subtotal=data.get('subtotal', 0),
-            shipping_cost=data.get('shipping_cost', 9.99),
-            tax_amount=data.get('tax_amount', 0),
-            total=data.get('total', 0),
-            payment_method=payment_method,
-            payment_reference=payment_reference,
-            status='confirmed'
-        )
-        
-        # Create order items (simplified - no complex validation)
-        items = data.get('items', [])
-        order_items = []
+        # Order and items commit together; the confirmation goes out only if they do
+        with transaction.atomic():
+            # Create order with confirmed status
+            order = Order.objects.create(
+                id=order_id,
+                customer_email=data.get('customer_email', ''),
+                customer_name=data.get('customer_name', ''),
+                shipping_address=data.get('shipping_address', ''),
+                shipping_city=data.get('shipping_city', ''),
+                shipping_country=shipping_country,
+                shipping_postal_code=data.get('shipping_postal_code', ''),
+                subtotal=data.get('subtotal', 0),
+                shipping_cost=data.get('shipping_cost', 9.99),
+                tax_amount=data.get('tax_amount', 0),
+                total=data.get('total', 0),
+                payment_method=payment_method,
+                payment_reference=payment_reference,
+                status='confirmed'
+            )
+        
+            # Create order items (simplified - no complex validation)
+            items = data.get('items', [])
+            order_items = []
+            # For the new-order notification (sent on commit)
+            order._line_items = []
         
-        for item_data in items:
-            try:
-                # Try to get product for name, but don't fail if not found
-                product_name = f"Product {item_data.get('product_id', 'Unknown')}"
-                product = None
-                
+            for item_data in items:
                 try:
-                    product = Product.objects.get(id=item_data['product_id'])
-                    product_name = product.title
-                except Product.DoesNotExist:
-                    pass  # Use placeholder name
+                    # Try to get product for name, but don't fail if not found
+                    product_name = f"Product {item_data.get('product_id', 'Unknown')}"
+                    product = None
                 
-                # Create order item
-                OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    selected_size=item_data.get('selected_size', ''),
-                    selected_color=item_data.get('selected_color', ''),
-                    quantity=item_data.get('quantity', 1),
-                    unit_price=item_data.get('unit_price', 0)
-                )
+                    try:
+                        product = Product.objects.get(id=item_data['product_id'])
+                        product_name = product.title
+                    except Product.DoesNotExist:
+                        pass  # Use placeholder name
                 
-                # Add to email data
-                variant_info = []
-                if item_data.get('selected_size'):
-                    variant_info.append(f"Size: {item_data.get('selected_size')}")
-                if item_data.get('selected_color'):
-                    variant_info.append(f"Color: {item_data.get('selected_color')}")
+                    # Create order item (savepoint: a bad item doesn't break the order)
+                    with transaction.atomic():
+                        order_item = OrderItem.objects.create(
+                            order=order,
+                            product=product,
+                            selected_size=item_data.get('selected_size', ''),
+                            selected_color=item_data.get('selected_color', ''),
+                            quantity=item_data.get('quantity', 1),
+                            unit_price=item_data.get('unit_price', 0)
+                        )
+                    order._line_items.append(order_item)
                 
-                if variant_info:
-                    product_name += f" ({', '.join(variant_info)})"
+                    # Add to email data
+                    variant_info = []
+                    if item_data.get('selected_size'):
+                        variant_info.append(f"Size: {item_data.get('selected_size')}")
+                    if item_data.get('selected_color'):
+                        variant_info.append(f"Color: {item_data.get('selected_color')}")
                 
-                order_items.append({
-                    'name': product_name,
-                    'quantity': item_data.get('quantity', 1),
-                    'price': f"${item_data.get('unit_price', 0):.2f}",
-                    'total': f"${item_data.get('quantity', 1) * item_data.get('unit_price', 0):.2f}"
-                })
+                    if variant_info:
+                        product_name += f" ({', '.join(variant_info)})"
                 
-            except Exception as e:
-                logger.error(f"Error creating order item: {e}")
-                continue
+                    order_items.append({
+                        'name': product_name,
+                        'quantity': item_data.get('quantity', 1),
+                        'price': f"${item_data.get('unit_price', 0):.2f}",
+                        'total': f"${item_data.get('quantity', 1) * item_data.get('unit_price', 0):.2f}"
+                    })
+                
+                except Exception as e:
+                    logger.error(f"Error creating order item: {e}")
+                    continue
         
-        # Try to send email notification (don't fail if it doesn't work)
-        emails_sent = False
-        try:
-            if order.customer_email:
-                emails_sent = send_order_confirmation_email(order, order_items)
-        except Exception as e:
-            logger.error(f"Email notification failed: {e}")
+            # Queue email notification (don't fail the order if it doesn't work)
+            emails_sent = False
+            try:
+                emails_sent = _queue_order_confirmation(order, order_items)
+            except Exception as e:
+                logger.error(f"Email notification failed: {e}")
         
         logger.info(f"Free checkout order created: {order_id} for {shipping_country}")
         
@@ -473,6 +613,7 @@ def create_free_order(request):
 
 @api_view(['POST'])
 @csrf_exempt
+@idempotent('create-order')
 def create_order(request):
     """Create an order after successful payment or for countries with free checkout"""
     try:
@@ -501,18 +642,21 @@ def create_order(request):
         # Generate order ID
         order_id = f"ORD{uuid.uuid4().hex[:8].upper()}"
         
+        # Load every product and variant in the cart once (one query each).
+        # Stock held for this payment is the buyer's own, so it counts as available
+        items = data.get('items', [])
+        hold_reference = payment_reference if requires_payment else None
+        cart = CartLookup(items, reference=hold_reference)
+        
         # Calculate shipping cost from items if not provided
         calculated_shipping = data.get('shipping_cost', 0)
         if calculated_shipping == 0:
             # Calculate shipping from individual products
-            items = data.get('items', [])
             for item_data in items:
-                try:
-                    product = Product.objects.get(id=item_data['product_id'])
+                product = cart.product(item_data)
+                if product is not None:
                     item_shipping = getattr(product, 'shipping_cost', 9.99)  # Default $9.99
                     calculated_shipping += item_shipping * item_data.get('quantity', 1)
-                except Product.DoesNotExist:
-                    pass
         
         # Set payment method and reference based on country
         if not requires_payment:
@@ -525,68 +669,44 @@ def create_order(request):
             payment_reference = data.get('payment_reference', '')
             order_status = 'processing'
         
-        # Create order
-        order = Order.objects.create(
-            id=order_id,
-            customer_email=data.get('customer_email', ''),
-            customer_name=data.get('customer_name', ''),
-            shipping_address=data.get('shipping_address', ''),
-            shipping_city=data.get('shipping_city', ''),
-            shipping_country=shipping_country,
-            shipping_postal_code=data.get('shipping_postal_code', ''),
-            subtotal=data.get('subtotal', 0),
-            shipping_cost=calculated_shipping,
-            tax_amount=data.get('tax_amount', 0),
-            total=data.get('total', 0),
-            payment_method=payment_method,
-            payment_reference=payment_reference,
-            status=order_status
-        )
-        
-        # Validate stock before creating order items
-        items = data.get('items', [])
+        # Validate up front for per-item messages; the conditional decrement
+        # below is what actually guarantees stock under concurrent checkouts
         stock_errors = []
         
         for item_data in items:
-            try:
-                product = Product.objects.get(id=item_data['product_id'])
-                requested_quantity = item_data.get('quantity', 1)
-                variant_id = item_data.get('variant_id')
-                
-                # Check if product is active
-                if not product.is_active:
-                    stock_errors.append(f"{product.title} is no longer available")
-                    continue
-                
-                # Check variant stock if variant is specified
-                if variant_id:
-                    try:
-                        from .models import ProductVariant
-                        variant = ProductVariant.objects.get(id=variant_id, product=product)
-                        if not variant.is_available:
-                            stock_errors.append(f"{product.title} (selected variant) is not available")
-                        elif variant.stock_quantity < requested_quantity:
-                            stock_errors.append(
-                                f"{product.title} (selected variant): Only {variant.stock_quantity} in stock, "
-                                f"but {requested_quantity} requested"
-                            )
-                    except ImportError:
-                        logger.warning("ProductVariant model not available, skipping variant validation")
-                    except Exception as e:
-                        logger.warning(f"Variant validation error: {e}")
-                        stock_errors.append(f"{product.title}: Selected variant not found")
-                else:
-                    # Check main product stock
-                    if not product.is_in_stock:
-                        stock_errors.append(f"{product.title} is out of stock")
-                    elif product.stock_quantity < requested_quantity:
-                        stock_errors.append(
-                            f"{product.title}: Only {product.stock_quantity} in stock, "
-                            f"but {requested_quantity} requested"
-                        )
-                        
-            except Product.DoesNotExist:
+            product = cart.product(item_data)
+            if product is None:
                 stock_errors.append(f"Product with ID {item_data.get('product_id')} not found")
+                continue
+            
+            requested_quantity = item_data.get('quantity', 1)
+            
+            # Check if product is active
+            if not product.is_active:
+                stock_errors.append(f"{product.title} is no longer available")
+                continue
+            
+            # Check variant stock if variant is specified
+            if item_data.get('variant_id'):
+                variant = cart.variant(item_data)
+                if variant is None or variant.product_id != product.pk:
+                    stock_errors.append(f"{product.title}: Selected variant not found")
+                elif not variant.is_available:
+                    stock_errors.append(f"{product.title} (selected variant) is not available")
+                elif variant.available_quantity < requested_quantity:
+                    stock_errors.append(
+                        f"{product.title} (selected variant): Only {variant.available_quantity} in stock, "
+                        f"but {requested_quantity} requested"
+                    )
+            else:
+                # Check main product stock
+                if not product.is_in_stock:
+                    stock_errors.append(f"{product.title} is out of stock")
+                elif product.available_quantity < requested_quantity:
+                    stock_errors.append(
+                        f"{product.title}: Only {product.available_quantity} in stock, "
+                        f"but {requested_quantity} requested"
+                    )
         
         # If there are stock errors, return them
         if stock_errors:
@@ -597,118 +717,95 @@ def create_order(request):
                 'message': 'Some items are out of stock or unavailable'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create order items
+        # Build order items in memory
         order_items = []
+        item_rows = []
+        stock_lines = []
         for item_data in items:
-            try:
-                product = Product.objects.get(id=item_data['product_id'])
-                
-                # Extract variant information
-                selected_size = item_data.get('selected_size', '')
-                selected_color = item_data.get('selected_color', '')
-                variant_id = item_data.get('variant_id')
-                
-                # Try to get the product variant if provided
-                product_variant = None
-                if variant_id:
-                    try:
-                        from .models import ProductVariant
-                        product_variant = ProductVariant.objects.get(id=variant_id)
-                        # Use variant's size and color names if not provided
-                        if not selected_size and product_variant.size:
-                            selected_size = product_variant.size.display_name
-                        if not selected_color and product_variant.color:
-                            selected_color = product_variant.color.name
-                    except ImportError:
-                        logger.warning("ProductVariant model not available, creating order without variant")
-                    except Exception as e:
-                        logger.warning(f"Product variant {variant_id} not found for order {order_id}: {e}")
-                
-                # Create order item with or without variant
-                try:
-                    order_item = OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        product_variant=product_variant,
-                        selected_size=selected_size,
-                        selected_color=selected_color,
-                        quantity=item_data['quantity'],
-                        unit_price=item_data['unit_price']
-                    )
-                except Exception as e:
-                    # If product_variant field doesn't exist, create without it
-                    logger.warning(f"Failed to create order item with variant, trying without: {e}")
-                    order_item = OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        selected_size=selected_size,
-                        selected_color=selected_color,
-                        quantity=item_data['quantity'],
-                        unit_price=item_data['unit_price']
-                    )
-                
-                # Reduce stock after successful order item creation
-                requested_quantity = item_data['quantity']
-                try:
-                    if product_variant:
-                        # Reduce variant stock
-                        product_variant.stock_quantity = max(0, product_variant.stock_quantity - requested_quantity)
-                        product_variant.save()
-                        logger.info(f"Reduced variant stock for {product.title}: {requested_quantity} units")
-                    else:
-                        # Reduce main product stock
-                        product.stock_quantity = max(0, product.stock_quantity - requested_quantity)
-                        product.save()
-                        logger.info(f"Reduced product stock for {product.title}: {requested_quantity} units")
-                except Exception as e:
-                    logger.warning(f"Failed to reduce stock for {product.title}: {e}")
-                    # Continue with order creation even if stock reduction fails
-                
-                # Add to email data with variant info
-                variant_info = []
-                if selected_size:
-                    variant_info.append(f"Size: {selected_size}")
-                if selected_color:
-                    variant_info.append(f"Color: {selected_color}")
-                
-                product_name = product.title
-                if variant_info:
-                    product_name += f" ({', '.join(variant_info)})"
-                
-                order_items.append({
-                    'name': product_name,
-                    'sku': getattr(product, 'sku', 'N/A'),
-                    'quantity': item_data['quantity'],
-                    'price': f"${item_data['unit_price']:.2f}",
-                    'total': f"${item_data['quantity'] * item_data['unit_price']:.2f}",
-                    'variant_info': ', '.join(variant_info) if variant_info else None
-                })
-            except Product.DoesNotExist:
-                logger.warning(f"Product {item_data['product_id']} not found for order {order_id}")
-        
-        # Send email notifications
-        emails_sent = False
-        try:
-            # Send order confirmation to customer
-            if order.customer_email:
-                logger.info(f"Attempting to send order confirmation email to {order.customer_email} for order {order_id}")
-                success = send_order_confirmation_email(order, order_items)
-                if success:
-                    logger.info(f"✅ Order confirmation email sent successfully to {order.customer_email} for order {order_id}")
-                    emails_sent = True
-                else:
-                    logger.error(f"❌ Order confirmation email failed for order {order_id}")
-            else:
-                logger.warning(f"No customer email provided for order {order_id}")
+            product = cart.product(item_data)
+            product_variant = cart.variant(item_data)
             
-            # Admin notification is now sent automatically via post_save signal
-            logger.info(f"Admin notification will be sent automatically for order {order_id}")
+            # Extract variant information
+            selected_size = item_data.get('selected_size', '')
+            selected_color = item_data.get('selected_color', '')
+            if product_variant:
+                # Use variant's size and color names if not provided
+                if not selected_size and product_variant.size:
+                    selected_size = product_variant.size.display_name
+                if not selected_color and product_variant.color:
+                    selected_color = product_variant.color.name
             
-        except Exception as e:
-            logger.error(f"Exception while sending email notifications for order {order_id}: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            # Don't fail the order creation if email fails
+            quantity = item_data['quantity']
+            unit_price = item_data['unit_price']
+            item_rows.append(OrderItem(
+                order_id=order_id,
+                product=product,
+                product_variant=product_variant,
+                selected_size=selected_size,
+                selected_color=selected_color,
+                quantity=quantity,
+                unit_price=unit_price,
+                total_price=quantity * unit_price,  # bulk_create() skips OrderItem.save()
+            ))
+            stock_lines.append((product, product_variant, quantity))
+            
+            # Add to email data with variant info
+            variant_info = []
+            if selected_size:
+                variant_info.append(f"Size: {selected_size}")
+            if selected_color:
+                variant_info.append(f"Color: {selected_color}")
+            
+            product_name = product.title
+            if variant_info:
+                product_name += f" ({', '.join(variant_info)})"
+            
+            order_items.append({
+                'name': product_name,
+                'sku': getattr(product, 'sku', 'N/A'),
+                'quantity': quantity,
+                'price': f"${unit_price:.2f}",
+                'total': f"${quantity * unit_price:.2f}",
+                'variant_info': ', '.join(variant_info) if variant_info else None
+            })
+        
+        # Order, items and stock decrements commit together or not at all
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(
+                    id=order_id,
+                    customer_email=data.get('customer_email', ''),
+                    customer_name=data.get('customer_name', ''),
+                    shipping_address=data.get('shipping_address', ''),
+                    shipping_city=data.get('shipping_city', ''),
+                    shipping_country=shipping_country,
+                    shipping_postal_code=data.get('shipping_postal_code', ''),
+                    subtotal=data.get('subtotal', 0),
+                    shipping_cost=calculated_shipping,
+                    tax_amount=data.get('tax_amount', 0),
+                    total=data.get('total', 0),
+                    payment_method=payment_method,
+                    payment_reference=payment_reference,
+                    status=order_status
+                )
+                OrderItem.objects.bulk_create(item_rows)
+                # For the new-order notification (sent on commit)
+                order._line_items = item_rows
+                
+                # Turn this payment's holds into the real decrement; any short
+                # line rolls back the order (and keeps the holds)
+                consume_reservations(hold_reference)
+                decrement_stock(stock_lines)
+                
+                # Goes out only if the order commits
+                emails_sent = _queue_order_confirmation(order, order_items)
+        except InsufficientStock as e:
+            logger.warning(f"Stock ran out while placing order {order_id}: {e.errors}")
+            return Response({
+                'error': 'Stock validation failed',
+                'stock_errors': e.errors,
+                'message': 'Some items are out of stock or unavailable'
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         return Response({
             'order_id': order_id,
@@ -750,6 +847,8 @@ def test_payments(request):
             'stripe_checkout': '/api/payments/stripe/create-checkout-session/',
             'momo_initiate': '/api/payments/momo/initiate/',
             'momo_status': '/api/payments/momo/status/{reference}/',
+            'momo_status_events': '/api/payments/momo/status/{reference}/events/',
+            'momo_status_wait': '/api/payments/momo/status/{reference}/wait/?status=pending',
             'create_order': '/api/payments/create-order/',
             'exchange_rate': '/api/payments/exchange-rate/'
         }
@@ -767,6 +866,8 @@ def get_exchange_rate(request):
             'display': rate_info['display'],
             'is_cached': rate_info['is_cached'],
             'is_fallback': rate_info['is_fallback'],
+            'is_stale': rate_info['is_stale'],
+            'updated_at': rate_info['updated_at'],
             'cache_duration_seconds': rate_info['cache_duration'],
             'sample_conversion': {
                 'usd_input': '$25.00',
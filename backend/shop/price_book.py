@@ -0,0 +1,151 @@
+"""
+Localized catalog prices.
+
+Product prices are in USD. For the other currencies a shopper can browse
+in, the PriceBook table holds every product's price and every variant's
+final price already converted and formatted, so listings just read them:
+
+- rebuild_price_book() recomputes whole currencies in one pass (one read
+  of the prices, one delete, one bulk insert). It runs after exchange
+  rates are refreshed (shop.currency_service).
+- Product and variant saves recompute that product's rows once they
+  commit (shop.signals).
+
+Catalog views pick the currency with resolve_currency() (?currency=, then
+the Accept-Language region) and attach prices with lookup_prices(). USD
+responses are unchanged.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+
+from .models import ExchangeRate, PriceBook, Product, ProductVariant
+
+BASE_CURRENCY = 'USD'
+
+# Currency -> display prefix
+CURRENCIES = {
+    'GHS': 'GH₵ ',
+    'NGN': '₦',
+    'EUR': '€',
+    'GBP': '£',
+}
+
+# Accept-Language region -> currency
+REGION_CURRENCIES = {
+    'GH': 'GHS',
+    'NG': 'NGN',
+    'GB': 'GBP',
+    **{region: 'EUR' for region in (
+        'AT', 'BE', 'CY', 'DE', 'EE', 'ES', 'FI', 'FR', 'GR', 'HR', 'IE',
+        'IT', 'LT', 'LU', 'LV', 'MT', 'NL', 'PT', 'SI', 'SK',
+    )},
+}
+
+_CENT = Decimal('0.01')
+
+
+def resolve_currency(request):
+    """
+    Currency for a catalog request: a supported ?currency=, otherwise the
+    region of the first Accept-Language entry that names one, else USD.
+    """
+    requested = request.GET.get('currency', '').upper()
+    if requested:
+        return requested if requested in CURRENCIES else BASE_CURRENCY
+    for entry in request.META.get('HTTP_ACCEPT_LANGUAGE', '').split(','):
+        tag = entry.split(';')[0].strip().replace('_', '-').split('-')
+        if len(tag) > 1 and len(tag[-1]) == 2:
+            return REGION_CURRENCIES.get(tag[-1].upper(), BASE_CURRENCY)
+    return BASE_CURRENCY
+
+
+def format_price(currency, amount):
+    return f"{CURRENCIES[currency]}{amount:,.2f}"
+
+
+def _entries(rates, product_prices, variant_prices):
+    """PriceBook rows for every rate x price"""
+    entries = []
+    for currency, rate in rates.items():
+        for product_id, price in product_prices:
+            amount = (price * rate).quantize(_CENT, ROUND_HALF_UP)
+            entries.append(PriceBook(
+                currency=currency, product_id=product_id, price=amount, display=format_price(currency, amount),
+            ))
+        for variant_id, product_id, price, adjustment in variant_prices:
+            amount = ((price + adjustment) * rate).quantize(_CENT, ROUND_HALF_UP)
+            entries.append(PriceBook(
+                currency=currency, product_id=product_id, variant_id=variant_id,
+                price=amount, display=format_price(currency, amount),
+            ))
+    return entries
+
+
+def rebuild_price_book(currencies=None, product_ids=None):
+    """
+    Recompute the prices for `currencies` (default: all with a stored
+    rate), for every product or just `product_ids`. Returns the number of
+    rows written.
+    """
+    with transaction.atomic():
+        # Rebuilds of the same currency take turns on its rate row, and read
+        # the prices only once they hold it: a rebuild waiting on another
+        # sees that one's rows (and any newer prices) and replaces them,
+        # instead of racing it to insert the same keys
+        rates = (
+            ExchangeRate.objects.select_for_update()
+            .filter(base=BASE_CURRENCY, quote__in=currencies or list(CURRENCIES))
+            .order_by('quote')
+        )
+        rates = dict(rates.values_list('quote', 'rate'))
+        if not rates:
+            return 0
+
+        products = Product.objects.all()
+        variants = ProductVariant.objects.all()
+        stale = PriceBook.objects.filter(currency__in=rates)
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+            variants = variants.filter(product_id__in=product_ids)
+            stale = stale.filter(product_id__in=product_ids)
+
+        entries = _entries(
+            rates,
+            products.values_list('id', 'price'),
+            variants.values_list('id', 'product_id', 'product__price', 'price_adjustment'),
+        )
+        stale.delete()
+        PriceBook.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+class LocalPrices:
+    """Localized prices for one currency, as looked up for a page of products"""
+
+    def __init__(self, currency, rows=()):
+        self.currency = currency
+        self.products = {}
+        self.variants = {}
+        for product_id, variant_id, price, display in rows:
+            if variant_id is None:
+                self.products[product_id] = (price, display)
+            else:
+                self.variants[variant_id] = (price, display)
+
+    def for_product(self, product_id):
+        price, display = self.products.get(product_id, (None, None))
+        return {'currency': self.currency, 'local_price': price, 'local_price_display': display}
+
+    def for_variant(self, variant_id):
+        price, display = self.variants.get(variant_id, (None, None))
+        return {'local_final_price': price, 'local_final_price_display': display}
+
+
+def lookup_prices(currency, product_ids, variants=False):
+    """LocalPrices for `product_ids` (and their variants) in one query"""
+    rows = PriceBook.objects.filter(currency=currency, product_id__in=list(product_ids))
+    if not variants:
+        rows = rows.filter(variant__isnull=True)
+    return LocalPrices(currency, rows.values_list('product_id', 'variant_id', 'price', 'display'))
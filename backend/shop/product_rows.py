@@ -0,0 +1,84 @@
+"""
+Fast path for read-only product lists.
+
+Rows come straight from QuerySet.values() as dicts and are turned into
+response items by plain functions: no model instances, no serializer field
+walk. Each output field names the columns it reads, so only those are
+selected. Used by the simple products endpoint; the output matches what it
+built from model instances before.
+"""
+
+from .models import Product, ProductImage
+
+PLACEHOLDER_IMAGE = "https://via.placeholder.com/400x400/e5e7eb/6b7280?text=No+Image"
+
+_product_storage = Product._meta.get_field('image').storage
+_gallery_storage = ProductImage._meta.get_field('image').storage
+
+
+def _image(row, request):
+    """Same precedence as Product.get_image_url(), made absolute"""
+    if row['image']:
+        url = _product_storage.url(row['image'])
+    elif row['image_url']:
+        url = row['image_url']
+    elif row['primary_image_file']:
+        url = _gallery_storage.url(row['primary_image_file'])
+    elif row['primary_image_url']:
+        url = row['primary_image_url']
+    else:
+        return PLACEHOLDER_IMAGE
+    return request.build_absolute_uri(url) if url.startswith('/') else url
+
+
+def _created_at(row, request):
+    return row['created_at'].isoformat() if row['created_at'] else None
+
+
+def _average_rating(row, request):
+    return round(row['average_rating'], 1) if row['review_count'] else 0.0
+
+
+# Output field -> (values() columns it reads, transform(row, request)).
+# Image columns come from Product.objects.for_listing() annotations.
+PRODUCT_ROW_FIELDS = {
+    'id': (('id',), lambda row, request: row['id']),
+    'title': (('title',), lambda row, request: row['title']),
+    'slug': (('slug',), lambda row, request: row['slug']),
+    'price': (('price',), lambda row, request: row['price']),
+    'price_display': (('price',), lambda row, request: f"${row['price']:.2f}"),
+    'description': (('description',), lambda row, request: row['description']),
+    'image': (('image', 'image_url', 'primary_image_file', 'primary_image_url'), _image),
+    'category': (('category_id',), lambda row, request: row['category_id']),
+    'category_label': (('category__label',), lambda row, request: row['category__label']),
+    # Stock net of active reservations (for_listing() annotates held_quantity)
+    'stock_quantity': (
+        ('stock_quantity', 'held_quantity'),
+        lambda row, request: row['stock_quantity'] - row['held_quantity'],
+    ),
+    'is_active': (('is_active',), lambda row, request: row['is_active']),
+    'is_in_stock': (
+        ('stock_quantity', 'held_quantity', 'has_variant_stock'),
+        lambda row, request: row['stock_quantity'] > row['held_quantity'] or bool(row['has_variant_stock']),
+    ),
+    'is_featured': (('is_featured',), lambda row, request: row['is_featured']),
+    'tags': ((), lambda row, request: []),
+    'created_at': (('created_at',), _created_at),
+    'average_rating': (('average_rating', 'review_count'), _average_rating),
+    'total_reviews': (('review_count',), lambda row, request: row['review_count']),
+}
+
+
+def row_fields(selected=None):
+    """(name, transform) pairs and the columns they need, for the selected fields"""
+    fields = []
+    columns = set()
+    for name, (sources, transform) in PRODUCT_ROW_FIELDS.items():
+        if selected is None or name in selected:
+            fields.append((name, transform))
+            columns.update(sources)
+    return fields, columns
+
+
+def build_rows(rows, fields, request):
+    return [{name: transform(row, request) for name, transform in fields} for row in rows]
@@ -0,0 +1,111 @@
+"""
+Time-bounded stock holds during payment.
+
+When a checkout session starts (Stripe session, MoMo request) the cart is
+reserved under the payment reference for RESERVATION_TTL. Available stock
+everywhere it is read for buying (listings, stock validation, order
+placement) is stock minus active holds, so while one customer pays nobody
+else can buy the units they hold. create_order consumes the holds for its
+payment reference in the same transaction that decrements stock. Expired
+holds stop counting immediately; release_expired_reservations deletes them.
+"""
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .inventory import CartLookup, InsufficientStock, _quantity
+from .models import StockReservation
+
+RESERVATION_TTL = timedelta(minutes=15)
+
+
+def _bump_stock_version():
+    # Listings show availability net of holds
+    from .catalog_cache import bump_stock_version
+    transaction.on_commit(bump_stock_version)
+
+
+def reserve_stock(reference, items, ttl=RESERVATION_TTL):
+    """
+    Hold stock for cart `items` under `reference`, replacing any holds the
+    reference already had. Raises InsufficientStock if a quantity isn't a
+    positive integer or unheld stock can't cover every line; nothing is
+    held then.
+    """
+    with transaction.atomic():
+        replaced, _ = StockReservation.objects.filter(reference=reference).delete()
+        # Row locks serialise concurrent reservations for the same products
+        cart = CartLookup(items, lock=True)
+
+        wanted = {}
+        errors = []
+        for item in items:
+            quantity = _quantity(item.get('quantity', 1))
+            if quantity is None:
+                errors.append(f"Invalid quantity for product {item.get('product_id')}")
+                continue
+            product = cart.product(item)
+            if product is None or not product.is_active:
+                errors.append(f"Product with ID {item.get('product_id')} not found")
+                continue
+            variant = None
+            if item.get('variant_id'):
+                variant = cart.variant(item)
+                if variant is None or variant.product_id != product.pk or not variant.is_available:
+                    errors.append(f"{product.title}: Selected variant not available")
+                    continue
+            key = (product.pk, variant.pk if variant else None)
+            entry = wanted.setdefault(key, [product, variant, 0])
+            entry[2] += quantity
+
+        for product, variant, quantity in wanted.values():
+            available = variant.available_quantity if variant else product.available_quantity
+            if available < quantity:
+                label = f"{product.title} (selected variant)" if variant else product.title
+                if available <= 0:
+                    errors.append(f"{label} is out of stock")
+                else:
+                    errors.append(f"{label}: Only {available} in stock, but {quantity} requested")
+
+        if errors:
+            raise InsufficientStock(errors)
+
+        expires_at = timezone.now() + ttl
+        holds = StockReservation.objects.bulk_create([
+            StockReservation(reference=reference, product=product, variant=variant, quantity=quantity, expires_at=expires_at)
+            for product, variant, quantity in wanted.values()
+        ])
+        if holds or replaced:
+            _bump_stock_version()
+    return holds
+
+
+def rename_reservations(old_reference, new_reference):
+    """Move holds to the reference the payment provider assigned"""
+    return StockReservation.objects.filter(reference=old_reference).update(reference=new_reference)
+
+
+def consume_reservations(reference):
+    """Drop the holds of a checkout that is being turned into an order (stock is decremented by the caller)"""
+    if not reference:
+        return 0
+    deleted, _ = StockReservation.objects.filter(reference=reference).delete()
+    return deleted
+
+
+def release_reservations(reference):
+    """Give held stock back, e.g. when a payment fails"""
+    deleted, _ = StockReservation.objects.filter(reference=reference).delete()
+    if deleted:
+        _bump_stock_version()
+    return deleted
+
+
+def release_expired_reservations(now=None):
+    """Delete expired holds; returns how many were removed"""
+    deleted, _ = StockReservation.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    if deleted:
+        _bump_stock_version()
+    return deleted
@@ -0,0 +1,29 @@
+"""
+Cached schema capability checks.
+
+Some serializers degrade gracefully on databases where the newer catalog
+tables haven't been migrated yet. Instead of probing with a query on every
+call, table presence is looked up once per process via introspection and
+cached; the cache is cleared after migrate.
+"""
+
+from functools import lru_cache
+
+from django.db import connection
+
+
+@lru_cache(maxsize=None)
+def existing_tables():
+    """Names of all tables in the default database"""
+    with connection.cursor() as cursor:
+        return frozenset(connection.introspection.table_names(cursor))
+
+
+def has_tables(*models):
+    """True if every given model's table exists"""
+    tables = existing_tables()
+    return all(model._meta.db_table in tables for model in models)
+
+
+def clear_cache():
+    existing_tables.cache_clear()
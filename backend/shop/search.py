@@ -0,0 +1,243 @@
+"""
+Full-text product search.
+
+Each database gets its own backend behind the same small interface:
+
+* PostgreSQL - a generated ``search_vector`` tsvector column on shop_product
+  (title weighted above description) with a GIN index, ranked by ts_rank.
+* SQLite - an FTS5 table (shop_product_fts) holding each product's id, title
+  and description, kept in sync by triggers, ranked by bm25. Rows are keyed
+  by product id, not by shop_product's implicit rowid, which VACUUM and
+  table rebuilds are free to renumber.
+* Anything else - icontains matching with a constant rank.
+
+The schema objects are created by migration 0019 and re-checked after every
+migrate, because SQLite table rebuilds silently drop triggers.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, Count, F, FloatField, Q, Value, Window
+from django.db.models.expressions import RawSQL
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Queries are cut to this many terms to keep tsquery/MATCH expressions small
+MAX_TERMS = 8
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())[:MAX_TERMS]
+
+
+class SearchBackend:
+    """Icontains fallback; also the interface the other backends implement"""
+
+    vendor = None
+
+    def install(self, schema_editor):
+        """Create the search schema objects"""
+
+    def uninstall(self, schema_editor):
+        """Drop the search schema objects"""
+
+    def ensure_installed(self, using=None):
+        """Repair the search schema if something dropped it"""
+
+    def filter(self, queryset, query):
+        """Restrict a product queryset to matches, without ranking"""
+        terms = tokenize(query)
+        if not terms:
+            return queryset.none()
+        condition = Q()
+        for term in terms:
+            condition &= Q(title__icontains=term) | Q(description__icontains=term)
+        return queryset.filter(condition)
+
+    def rank(self, query):
+        return Value(1.0, output_field=FloatField())
+
+    def search(self, queryset, query):
+        """Matches annotated with ``search_rank``, best first"""
+        queryset = self.filter(queryset, query)
+        return queryset.annotate(search_rank=self.rank(query)).order_by(F('search_rank').desc(), 'id')
+
+
+class PostgresSearchBackend(SearchBackend):
+    vendor = 'postgresql'
+    config = 'english'
+
+    def install(self, schema_editor):
+        schema_editor.execute(f"""
+            ALTER TABLE shop_product ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('{self.config}', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('{self.config}', coalesce(description, '')), 'B')
+            ) STORED
+        """)
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS shop_product_search_vector_gin "
+            "ON shop_product USING GIN (search_vector)"
+        )
+
+    def uninstall(self, schema_editor):
+        schema_editor.execute("DROP INDEX IF EXISTS shop_product_search_vector_gin")
+        schema_editor.execute("ALTER TABLE shop_product DROP COLUMN IF EXISTS search_vector")
+
+    def _tsquery(self, query):
+        # Terms are \w+ only, so they are safe inside to_tsquery syntax
+        return ' & '.join(f'{term}:*' for term in tokenize(query))
+
+    def filter(self, queryset, query):
+        tsquery = self._tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(RawSQL(
+            f"shop_product.search_vector @@ to_tsquery('{self.config}', %s)",
+            [tsquery], output_field=BooleanField(),
+        ))
+
+    def rank(self, query):
+        return RawSQL(
+            f"ts_rank(shop_product.search_vector, to_tsquery('{self.config}', %s))",
+            [self._tsquery(query)], output_field=FloatField(),
+        )
+
+
+class SQLiteSearchBackend(SearchBackend):
+    vendor = 'sqlite'
+
+    TRIGGERS = {
+        'shop_product_fts_ai': """
+            CREATE TRIGGER shop_product_fts_ai AFTER INSERT ON shop_product BEGIN
+                INSERT INTO shop_product_fts(product_id, title, description)
+                VALUES (new.id, new.title, new.description);
+            END
+        """,
+        'shop_product_fts_ad': """
+            CREATE TRIGGER shop_product_fts_ad AFTER DELETE ON shop_product BEGIN
+                DELETE FROM shop_product_fts WHERE product_id = old.id;
+            END
+        """,
+        'shop_product_fts_au': """
+            CREATE TRIGGER shop_product_fts_au AFTER UPDATE OF id, title, description ON shop_product BEGIN
+                DELETE FROM shop_product_fts WHERE product_id = old.id;
+                INSERT INTO shop_product_fts(product_id, title, description)
+                VALUES (new.id, new.title, new.description);
+            END
+        """,
+    }
+
+    def install(self, schema_editor):
+        # product_id is stored but not tokenized; it's what rows join on
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+            "product_id UNINDEXED, title, description, tokenize='porter unicode61')"
+        )
+        for name, sql in self.TRIGGERS.items():
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            schema_editor.execute(sql)
+        # Rank title hits 4x description hits in the table's built-in rank column
+        schema_editor.execute(
+            "INSERT INTO shop_product_fts(shop_product_fts, rank) VALUES ('rank', 'bm25(0.0, 4.0, 1.0)')"
+        )
+        # Resync: products may have changed while the triggers were missing
+        schema_editor.execute("DELETE FROM shop_product_fts")
+        schema_editor.execute(
+            "INSERT INTO shop_product_fts(product_id, title, description) "
+            "SELECT id, title, description FROM shop_product"
+        )
+
+    def uninstall(self, schema_editor):
+        for name in self.TRIGGERS:
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+
+    def ensure_installed(self, using=None):
+        from django.db import connections
+        conn = connections[using or 'default']
+        with conn.cursor() as cursor:
+            names = ['shop_product_fts', *self.TRIGGERS]
+            cursor.execute(
+                f"SELECT name FROM sqlite_master WHERE name IN ({', '.join(['%s'] * len(names))})",
+                names,
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+        if 'shop_product_fts' not in existing:
+            return False  # not migrated yet
+        if set(self.TRIGGERS) <= existing:
+            return False
+        # A table rebuild dropped the triggers
+        with conn.schema_editor() as schema_editor:
+            self.install(schema_editor)
+        return True
+
+    def _match(self, query):
+        # Quote every term so user input can't inject FTS5 syntax; prefix match each
+        return ' '.join(f'"{term}"*' for term in tokenize(query))
+
+    def filter(self, queryset, query):
+        match = self._match(query)
+        if not match:
+            return queryset.none()
+        return queryset.filter(RawSQL(
+            "shop_product.id IN (SELECT product_id FROM shop_product_fts WHERE shop_product_fts MATCH %s)",
+            [match], output_field=BooleanField(),
+        ))
+
+    def search(self, queryset, query):
+        match = self._match(query)
+        if not match:
+            return queryset.none()
+        # Join the FTS table instead of a correlated subquery so MATCH runs
+        # once. Its rank column is bm25, where lower is better.
+        return queryset.extra(
+            tables=['shop_product_fts'],
+            where=['shop_product_fts.product_id = shop_product.id', 'shop_product_fts MATCH %s'],
+            params=[match],
+            select={'search_rank': '-shop_product_fts.rank'},
+        ).order_by('-search_rank', 'id')
+
+
+BACKENDS = {backend.vendor: backend for backend in (PostgresSearchBackend, SQLiteSearchBackend)}
+
+
+def get_search_backend(conn=None):
+    """Search backend for a database connection (default connection if omitted)"""
+    vendor = (conn or connection).vendor
+    return BACKENDS.get(vendor, SearchBackend)()
+
+
+def search_products(queryset, query, offset=0, limit=20):
+    """
+    Ranked page of matches plus the total match count.
+
+    Ranking, paging and the total (a window aggregate riding along on every
+    row) come from one query over the bare product rows; the listing
+    annotations of ``queryset`` are then loaded for just that page.
+    """
+    if not tokenize(query):
+        return [], 0
+
+    backend = get_search_backend()
+    ranked = list(
+        backend.search(queryset, query)
+        .annotate(search_total=Window(expression=Count('*')))
+        .values_list('pk', 'search_rank', 'search_total')[offset:offset + limit]
+    )
+    if ranked:
+        total = ranked[0][2]
+    elif offset:
+        # Past the last page; the window count isn't available from an empty page
+        total = backend.filter(queryset, query).count()
+    else:
+        total = 0
+
+    products = queryset.in_bulk([pk for pk, _, _ in ranked])
+    rows = []
+    for pk, rank, _ in ranked:
+        product = products[pk]
+        product.search_rank = rank
+        rows.append(product)
+    return rows, total
@@ -1,14 +1,107 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import (
-    Category, Product, ProductTag, Order, OrderItem,
+    Category, Product, ProductTag, ProductTagAssignment, Order, OrderItem,
     ProductImage, ProductSize, ProductColor, ProductVariant, PromoCode,
     ProductReview, ReviewHelpfulVote, ReviewImage
 )
+from .cache import PROMO_CODES
+from .inventory import CartLookup, InsufficientStock, decrement_stock
+from .reservations import consume_reservations
+from .schema import has_tables
 
 
-class CategorySerializer(serializers.ModelSerializer):
+
+def _split_param(value):
+    return {part.strip() for part in (value or '').split(',') if part.strip()}
+
+
+def sparse_fieldset(params, available, presets=None):
+    """
+    Output fields selected by ``?fields=a,b`` / ``?exclude=a,b`` (None when
+    neither is given). ``fields`` may also name a preset, e.g. ``fields=card``.
+    """
+    fields = _split_param(params.get('fields'))
+    exclude = _split_param(params.get('exclude'))
+    if not fields and not exclude:
+        return None
+    
+    if fields:
+        selected = set()
+        for name in fields:
+            selected.update((presets or {}).get(name, (name,)))
+    else:
+        selected = set(available)
+    return (selected & set(available)) - exclude
+
+
+class SparseFieldsetMixin:
+    """
+    Sparse fieldsets for serializers used with a request in context.
+    
+    ``fieldsets`` names reusable selections. ``field_sources`` maps output
+    fields to the model columns they read (concrete fields map to themselves),
+    so views can push the same selection into the ORM with ``project()``.
+    ``extra_output_fields`` lists keys added in ``to_representation``.
+    """
+    fieldsets = {}
+    field_sources = {}
+    extra_output_fields = ()
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        self.selected_fields = self.requested_fields(request) if request is not None else None
+        if self.selected_fields is not None:
+            for name in set(self.fields) - self.selected_fields:
+                self.fields.pop(name)
+    
+    def wants(self, name):
+        """Whether an extra output key should be computed"""
+        return self.selected_fields is None or name in self.selected_fields
+    
+    @classmethod
+    def output_fields(cls):
+        return list(cls.Meta.fields) + list(cls.extra_output_fields)
+    
+    @classmethod
+    def requested_fields(cls, request):
+        params = getattr(request, 'query_params', request.GET)
+        return sparse_fieldset(params, cls.output_fields(), cls.fieldsets)
+    
+    @classmethod
+    def project(cls, queryset, request, also=()):
+        """
+        Restrict the queryset to the columns the requested fields read.
+        ``also`` adds columns needed elsewhere (e.g. pagination keys).
+        """
+        selected = cls.requested_fields(request)
+        if selected is None:
+            return queryset
+        
+        opts = queryset.model._meta
+        columns = {opts.pk.name, *also}
+        for name in selected:
+            if name in cls.field_sources:
+                columns.update(cls.field_sources[name])
+                continue
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete:
+                columns.add(name)
+        
+        related = {column.split('__')[0] for column in columns if '__' in column}
+        return queryset.select_related(None).select_related(*related).only(*columns)
+
+class CategorySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
     
+    field_sources = {'image': ('image', 'image_url')}
+    
     class Meta:
         model = Category
         fields = ['key', 'label', 'description', 'image', 'featured', 'product_count']
@@ -55,6 +148,8 @@ class ProductColorSerializer(serializers.ModelSerializer):
 class ProductVariantSerializer(serializers.ModelSerializer):
     size = ProductSizeSerializer(read_only=True)
     color = ProductColorSerializer(read_only=True)
+    # Net of active reservations when loaded with with_holds()
+    stock_quantity = serializers.IntegerField(source='available_quantity', read_only=True)
     final_price = serializers.IntegerField(read_only=True)
     final_price_display = serializers.SerializerMethodField()
     
@@ -67,15 +162,43 @@ class ProductVariantSerializer(serializers.ModelSerializer):
     
     def get_final_price_display(self, obj):
         return f"${obj.final_price:.2f}"
+    
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Set by catalog views for non-USD requests (see shop.price_book)
+        local_prices = self.context.get('local_prices')
+        if local_prices is not None:
+            data.update(local_prices.for_variant(instance.pk))
+        return data
+
+
+# Columns read by computed product fields, for SparseFieldsetMixin.project()
+PRODUCT_FIELD_SOURCES = {
+    'category_label': ('category__label',),
+    'price_display': ('price',),
+    'stock_quantity': ('stock_quantity',),
+    'is_in_stock': ('stock_quantity',),
+    'image': ('image', 'image_url'),
+    'average_rating': ('average_rating', 'review_count'),
+    'total_reviews': ('review_count',),
+}
+
+PRODUCT_CARD_FIELDS = ('id', 'title', 'slug', 'price', 'image', 'average_rating', 'total_reviews')
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category_label = serializers.CharField(source='category.label', read_only=True)
     price_display = serializers.CharField(read_only=True)
+    # Net of active reservations when listed through for_listing()
+    stock_quantity = serializers.IntegerField(source='available_quantity', read_only=True)
     is_in_stock = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
     total_reviews = serializers.SerializerMethodField()
     
+    fieldsets = {'card': PRODUCT_CARD_FIELDS}
+    field_sources = PRODUCT_FIELD_SOURCES
+    extra_output_fields = ('tags', 'image')
+    
     class Meta:
         model = Product
         fields = [
@@ -91,43 +214,50 @@ class ProductSerializer(serializers.ModelSerializer):
         return obj.is_in_stock
     
     def get_average_rating(self, obj):
-        """Calculate average rating for the product"""
-        from django.db.models import Avg
-        reviews = obj.reviews.filter(is_approved=True)
-        avg_rating = reviews.aggregate(Avg('rating'))['rating__avg']
-        return round(avg_rating, 1) if avg_rating else 0.0
+        """Average rating of approved reviews (stored on the product)"""
+        return round(obj.average_rating, 1) if obj.review_count else 0.0
     
     def get_total_reviews(self, obj):
-        """Get total number of approved reviews for the product"""
-        return obj.reviews.filter(is_approved=True).count()
+        """Number of approved reviews (stored on the product)"""
+        return obj.review_count
     
     def to_representation(self, instance):
         """Add computed fields safely"""
         data = super().to_representation(instance)
         
         # Add is_featured field from the model
-        try:
-            data['is_featured'] = getattr(instance, 'is_featured', False)
-        except AttributeError:
-            data['is_featured'] = False
+        if self.wants('is_featured'):
+            try:
+                data['is_featured'] = getattr(instance, 'is_featured', False)
+            except AttributeError:
+                data['is_featured'] = False
         
         # Add tags field
-        data['tags'] = []  # Default to empty list for now
+        if self.wants('tags'):
+            data['tags'] = []  # Default to empty list for now
         
         # Add image field using the model's get_image_url method
-        try:
-            data['image'] = instance.get_image_url()
-        except Exception:
-            data['image'] = "https://via.placeholder.com/400x400/e5e7eb/6b7280?text=No+Image"
+        if self.wants('image'):
+            try:
+                data['image'] = instance.get_image_url()
+            except Exception:
+                data['image'] = "https://via.placeholder.com/400x400/e5e7eb/6b7280?text=No+Image"
+        
+        # Localized price, for non-USD requests (see shop.price_book)
+        local_prices = self.context.get('local_prices')
+        if local_prices is not None and self.wants('price'):
+            data.update(local_prices.for_product(instance.pk))
         
         return data
 
 
 # Keep the full serializer as a backup for when all tables are properly set up
-class ProductFullSerializer(serializers.ModelSerializer):
+class ProductFullSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category_label = serializers.CharField(source='category.label', read_only=True)
     tags = serializers.SerializerMethodField()
     price_display = serializers.CharField(read_only=True)
+    # Net of active reservations (setup_eager_loading() annotates the holds)
+    stock_quantity = serializers.IntegerField(source='available_quantity', read_only=True)
     is_in_stock = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
     images = ProductImageSerializer(many=True, read_only=True)
@@ -137,6 +267,11 @@ class ProductFullSerializer(serializers.ModelSerializer):
     average_rating = serializers.SerializerMethodField()
     total_reviews = serializers.SerializerMethodField()
     
+    fieldsets = {'card': PRODUCT_CARD_FIELDS}
+    # Variant final_price reads the (prefetch-cached) product's price
+    field_sources = {**PRODUCT_FIELD_SOURCES, 'variants': ('price',)}
+    extra_output_fields = ('is_featured',)
+    
     class Meta:
         model = Product
         fields = [
@@ -146,54 +281,57 @@ class ProductFullSerializer(serializers.ModelSerializer):
             'available_colors', 'created_at', 'average_rating', 'total_reviews'
         ]
         
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Prefetch plan: everything this serializer reads comes from a fixed
+        handful of queries, whatever the number of images, variants or tags.
+        """
+        queryset = queryset.select_related('category').with_variant_stock().prefetch_related(
+            Prefetch('images', queryset=ProductImage.objects.order_by('order', 'created_at')),
+            Prefetch('tag_assignments', queryset=ProductTagAssignment.objects.select_related('tag')),
+        )
+        if has_tables(ProductVariant, ProductSize, ProductColor):
+            # Prefetching also fills variant.product, so final_price needs no query
+            queryset = queryset.prefetch_related(
+                Prefetch('variants', queryset=ProductVariant.objects.with_holds().select_related('size', 'color'))
+            )
+        return queryset
+    
     def to_representation(self, instance):
         """Handle missing fields gracefully"""
         data = super().to_representation(instance)
-        
-        # Use tag-based is_featured to avoid database field issues
-        try:
-            # Check if tag_assignments relationship exists and has the featured tag
-            if hasattr(instance, 'tag_assignments'):
-                has_featured_tag = instance.tag_assignments.filter(tag__name='featured').exists()
-                data['is_featured'] = has_featured_tag
-            else:
-                data['is_featured'] = False
-        except Exception as e:
-            # If there's any error (missing tables, etc.), default to False
-            data['is_featured'] = False
-            
+        if self.wants('is_featured'):
+            data['is_featured'] = 'featured' in self.get_tags(instance)
+        local_prices = self.context.get('local_prices')
+        if local_prices is not None and self.wants('price'):
+            data.update(local_prices.for_product(instance.pk))
         return data
     
     def get_is_in_stock(self, obj):
         """Check if product is in stock (considering both main stock and variants)"""
-        # Use the model's property which now considers variants
-        return obj.is_in_stock
+        if obj.available_quantity > 0:
+            return True
+        return any(variant.is_in_stock for variant in self._variants(obj))
     
     def get_tags(self, obj):
         try:
-            # Check if tag_assignments relationship exists
-            if hasattr(obj, 'tag_assignments'):
-                return [assignment.tag.name for assignment in obj.tag_assignments.all()]
-            else:
-                return []
+            return [assignment.tag.name for assignment in obj.tag_assignments.all()]
         except Exception as e:
             # Fallback to empty list if there's an error (missing tables, etc.)
             return []
     
     def get_image(self, obj):
         try:
-            # First try to get primary image from ProductImage (only if table exists)
-            if hasattr(obj, 'images'):
-                try:
-                    primary_image = obj.images.filter(is_primary=True).first()
-                    if primary_image and primary_image.image:
-                        request = self.context.get('request')
-                        if request:
-                            return request.build_absolute_uri(primary_image.image.url)
-                        return primary_image.image.url
-                except Exception:
-                    # ProductImage table might not exist, continue to fallback
-                    pass
+            # First try the primary gallery image (prefetched)
+            primary_image = next((image for image in obj.images.all() if image.is_primary), None)
+            if primary_image and primary_image.image:
+                request = self.context.get('request')
+                if request:
+                    return request.build_absolute_uri(primary_image.image.url)
+                return primary_image.image.url
+            if primary_image and primary_image.image_url and not (obj.image or obj.image_url):
+                return primary_image.image_url
             
             # Use the model's get_image_url method which handles both uploaded files and URLs
             return obj.get_image_url()
@@ -201,48 +339,33 @@ class ProductFullSerializer(serializers.ModelSerializer):
             # If there's any error with images, return placeholder
             return "https://via.placeholder.com/400x400/e5e7eb/6b7280?text=No+Image"
     
-    def get_available_sizes(self, obj):
-        try:
-            # Check if ProductSize and ProductVariant tables exist
-            from django.db import connection
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT 1 FROM shop_productsize LIMIT 1")
-            
-            sizes = ProductSize.objects.filter(
-                productvariant__product=obj,
-                productvariant__is_available=True
-            ).distinct()
-            return ProductSizeSerializer(sizes, many=True).data
-        except Exception as e:
-            # Tables don't exist or other error
+    def _variants(self, obj):
+        if not has_tables(ProductVariant, ProductSize, ProductColor):
             return []
+        return obj.variants.all()
+    
+    def _available_options(self, obj, attribute):
+        """Distinct sizes/colors of available variants, in their display order"""
+        options = {}
+        for variant in self._variants(obj):
+            if variant.is_available:
+                option = getattr(variant, attribute)
+                options[option.pk] = option
+        return sorted(options.values(), key=lambda option: (option.order, option.name))
+    
+    def get_available_sizes(self, obj):
+        return ProductSizeSerializer(self._available_options(obj, 'size'), many=True).data
     
     def get_available_colors(self, obj):
-        try:
-            # Check if ProductColor and ProductVariant tables exist
-            from django.db import connection
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT 1 FROM shop_productcolor LIMIT 1")
-            
-            colors = ProductColor.objects.filter(
-                productvariant__product=obj,
-                productvariant__is_available=True
-            ).distinct()
-            return ProductColorSerializer(colors, many=True).data
-        except Exception as e:
-            # Tables don't exist or other error
-            return []
+        return ProductColorSerializer(self._available_options(obj, 'color'), many=True).data
     
     def get_average_rating(self, obj):
-        """Calculate average rating for the product"""
-        from django.db.models import Avg
-        reviews = obj.reviews.filter(is_approved=True)
-        avg_rating = reviews.aggregate(Avg('rating'))['rating__avg']
-        return round(avg_rating, 1) if avg_rating else 0.0
+        """Average rating of approved reviews (stored on the product)"""
+        return round(obj.average_rating, 1) if obj.review_count else 0.0
     
     def get_total_reviews(self, obj):
-        """Get total number of approved reviews for the product"""
-        return obj.reviews.filter(is_approved=True).count()
+        """Number of approved reviews (stored on the product)"""
+        return obj.review_count
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -277,10 +400,12 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return ", ".join(parts) if parts else None
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     total_display = serializers.CharField(read_only=True)
     
+    field_sources = {'total_display': ('total',), 'items': ()}
+    
     class Meta:
         model = Order
         fields = [
@@ -310,43 +435,43 @@ class CreateOrderSerializer(serializers.ModelSerializer):
     def validate_items(self, items_data):
         """Validate stock availability for all items"""
         stock_errors = []
+        # Stock held for this payment is the buyer's own
+        cart = CartLookup(items_data, reference=self.initial_data.get('payment_reference'))
         
         for item_data in items_data:
-            try:
-                product = Product.objects.get(id=item_data['product_id'])
-                requested_quantity = item_data.get('quantity', 1)
-                variant_id = item_data.get('variant_id')
-                
-                # Check if product is active
-                if not product.is_active:
-                    stock_errors.append(f"{product.title} is no longer available")
-                    continue
-                
-                # Check variant stock if variant is specified
-                if variant_id:
-                    try:
-                        variant = ProductVariant.objects.get(id=variant_id, product=product)
-                        if not variant.is_available:
-                            stock_errors.append(f"{product.title} (selected variant) is not available")
-                        elif variant.stock_quantity < requested_quantity:
-                            stock_errors.append(
-                                f"{product.title} (selected variant): Only {variant.stock_quantity} in stock, "
-                                f"but {requested_quantity} requested"
-                            )
-                    except ProductVariant.DoesNotExist:
-                        stock_errors.append(f"{product.title}: Selected variant not found")
-                else:
-                    # Check main product stock
-                    if not product.is_in_stock:
-                        stock_errors.append(f"{product.title} is out of stock")
-                    elif product.stock_quantity < requested_quantity:
-                        stock_errors.append(
-                            f"{product.title}: Only {product.stock_quantity} in stock, "
-                            f"but {requested_quantity} requested"
-                        )
-                        
-            except Product.DoesNotExist:
+            product = cart.product(item_data)
+            if product is None:
                 stock_errors.append(f"Product with ID {item_data.get('product_id')} not found")
+                continue
+            
+            requested_quantity = item_data.get('quantity', 1)
+            
+            # Check if product is active
+            if not product.is_active:
+                stock_errors.append(f"{product.title} is no longer available")
+                continue
+            
+            # Check variant stock if variant is specified
+            if item_data.get('variant_id'):
+                variant = cart.variant(item_data)
+                if variant is None or variant.product_id != product.pk:
+                    stock_errors.append(f"{product.title}: Selected variant not found")
+                elif not variant.is_available:
+                    stock_errors.append(f"{product.title} (selected variant) is not available")
+                elif variant.available_quantity < requested_quantity:
+                    stock_errors.append(
+                        f"{product.title} (selected variant): Only {variant.available_quantity} in stock, "
+                        f"but {requested_quantity} requested"
+                    )
+            else:
+                # Check main product stock
+                if not product.is_in_stock:
+                    stock_errors.append(f"{product.title} is out of stock")
+                elif product.available_quantity < requested_quantity:
+                    stock_errors.append(
+                        f"{product.title}: Only {product.available_quantity} in stock, "
+                        f"but {requested_quantity} requested"
+                    )
         
         if stock_errors:
             raise serializers.ValidationError({
@@ -358,40 +483,48 @@ class CreateOrderSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
+        cart = CartLookup(items_data)
         
+        item_rows = []
+        stock_lines = []
         for item_data in items_data:
-            product = Product.objects.get(id=item_data['product_id'])
+            product = cart.product(item_data)
             
-            # Get variant if specified
-            product_variant = None
-            variant_id = item_data.get('variant_id')
-            if variant_id:
-                try:
-                    product_variant = ProductVariant.objects.get(id=variant_id, product=product)
-                except ProductVariant.DoesNotExist:
-                    pass
+            # Get variant if specified (ignored if it belongs to another product)
+            product_variant = cart.variant(item_data)
+            if product_variant is not None and product_variant.product_id != product.pk:
+                product_variant = None
             
-            OrderItem.objects.create(
-                order=order,
+            item_rows.append(OrderItem(
                 product=product,
                 product_variant=product_variant,
                 selected_size=item_data.get('selected_size', ''),
                 selected_color=item_data.get('selected_color', ''),
                 quantity=item_data['quantity'],
-                unit_price=item_data['unit_price']
-            )
-            
-            # Reduce stock after successful order creation
-            requested_quantity = item_data['quantity']
-            if product_variant:
-                # Reduce variant stock
-                product_variant.stock_quantity = max(0, product_variant.stock_quantity - requested_quantity)
-                product_variant.save()
-            else:
-                # Reduce main product stock
-                product.stock_quantity = max(0, product.stock_quantity - requested_quantity)
-                product.save()
+                unit_price=item_data['unit_price'],
+                total_price=item_data['quantity'] * item_data['unit_price'],  # bulk_create() skips save()
+            ))
+            stock_lines.append((product, product_variant, item_data['quantity']))
+        
+        # Order, items and stock decrements commit together or not at all
+        try:
+            with transaction.atomic():
+                order = Order.objects.create(**validated_data)
+                for item in item_rows:
+                    item.order = order
+                OrderItem.objects.bulk_create(item_rows)
+                # For the new-order notification (sent on commit)
+                order._line_items = item_rows
+                consume_reservations(validated_data.get('payment_reference'))
+                
+                # validate_items() ran without locks; the conditional decrement
+                # is what guarantees nobody else took the stock since
+                decrement_stock(stock_lines)
+        except InsufficientStock as e:
+            raise serializers.ValidationError({
+                'stock_errors': e.errors,
+                'message': 'Some items are out of stock or unavailable'
+            })
         
         return order
 
@@ -421,11 +554,13 @@ class ValidatePromoCodeSerializer(serializers.Serializer):
     
     def validate_code(self, value):
         """Validate that the promo code exists"""
-        try:
-            promo_code = PromoCode.objects.get(code=value.upper())
-            return promo_code
-        except PromoCode.DoesNotExist:
+        # Cached, unknown codes included (as False); saves clear PROMO_CODES
+        promo_code = PROMO_CODES.get_or_set(
+            value.upper(), lambda: PromoCode.objects.filter(code=value.upper()).first() or False
+        )
+        if not promo_code:
             raise serializers.ValidationError("Invalid promo code")
+        return promo_code
     
     def validate(self, data):
         """Validate the promo code against the subtotal"""
@@ -60,12 +60,13 @@ class ShippingWebhookView(View):
                 }, status=404)
             
             # Update order status
-            old_status = order.status
             order.status = new_status
+            status_changed = order.has_changed('status')
+            old_status = order.previous('status')
             order.save()
             
             # Send appropriate email notification
-            if new_status == 'shipped' and old_status != 'shipped':
+            if new_status == 'shipped' and status_changed:
                 success = send_shipping_confirmation_email(
                     order=order,
                     tracking_number=tracking_number,
@@ -75,7 +76,7 @@ class ShippingWebhookView(View):
                 )
                 logger.info(f"Shipping confirmation sent for order {order_id}: {success}")
             
-            elif new_status in ['delivered', 'cancelled'] and old_status != new_status:
+            elif new_status in ['delivered', 'cancelled'] and status_changed:
                 success = send_status_update_email(
                     order=order,
                     new_status=new_status.title(),
@@ -2,10 +2,16 @@
 Django signals for automatic media URL management
 """
 import os
-from django.db.models.signals import post_migrate
+from django.db import transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
 from django.dispatch import receiver
 from django.apps import apps
 
+from .models import (
+    Category, Product, ProductColor, ProductImage, ProductReview, ProductSize, ProductTag,
+    ProductTagAssignment, ProductVariant, PromoCode
+)
+
 
 @receiver(post_migrate)
 def restore_media_urls_after_migrate(sender, **kwargs):
@@ -62,4 +68,99 @@ def update_media_url_constants(sender, **kwargs):
                     
         except Exception as e:
             # Don't let signal errors break migrations
-            pass
\ No newline at end of file
+            pass
+
+
+@receiver(post_migrate)
+def ensure_cache_table(sender, using='default', **kwargs):
+    """Create the table of the database cache backend, when it's used (DATABASE_CACHE=True)"""
+    if sender.name == 'shop':
+        from django.core.management import call_command
+        call_command('createcachetable', database=using, verbosity=0)
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using='default', **kwargs):
+    """
+    Forget cached schema checks, and re-create the full-text triggers if a
+    migration dropped them (SQLite rebuilds the whole table for most ALTERs)
+    """
+    if sender.name == 'shop':
+        from . import schema
+        schema.clear_cache()
+        
+        try:
+            from django.db import connections
+            from .search import get_search_backend
+            
+            if get_search_backend(connections[using]).ensure_installed(using):
+                print("🔍 Post-migration: Rebuilt product search index")
+        except Exception as e:
+            print(f"⚠️  Search index check failed: {e}")
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductVariant)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=ProductReview)
+@receiver([post_save, post_delete], sender=ProductTag)
+@receiver([post_save, post_delete], sender=ProductTagAssignment)
+@receiver([post_save, post_delete], sender=ProductSize)
+@receiver([post_save, post_delete], sender=ProductColor)
+def bump_catalog_version_on_change(sender, **kwargs):
+    """Invalidate cached catalog responses once the change is committed"""
+    from .catalog_cache import bump_catalog_version
+    
+    transaction.on_commit(bump_catalog_version)
+
+
+# Connected after the catalog receivers: the index's in-place updates run
+# after the version bump they account for (see shop.suggest)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=ProductTag)
+def update_suggest_index(sender, instance, **kwargs):
+    from . import suggest
+    
+    if sender is Product:
+        update = suggest.update_product
+    elif sender is Category:
+        update = suggest.update_category
+    else:
+        update = suggest.update_tag
+    transaction.on_commit(lambda: update(instance))
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=ProductTag)
+def remove_from_suggest_index(sender, instance, **kwargs):
+    from . import suggest
+    
+    kind = 'product' if sender is Product else 'category' if sender is Category else 'tag'
+    ident = instance.name if kind == 'tag' else instance.key if kind == 'category' else instance.pk
+    transaction.on_commit(lambda: suggest.remove(kind, ident))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductVariant)
+def reprice_price_book(sender, instance, created, **kwargs):
+    """Reprice the product's price book rows once the save is committed"""
+    from .price_book import rebuild_price_book
+    
+    if sender is Product:
+        if not created and 'price' not in instance.saved_changes:
+            return
+        product_id = instance.pk
+    else:
+        product_id = instance.product_id
+    transaction.on_commit(lambda: rebuild_price_book(product_ids=[product_id]))
+
+
+@receiver([post_save, post_delete], sender=PromoCode)
+def invalidate_promo_codes(sender, **kwargs):
+    """Forget cached promo code lookups once the change is committed"""
+    from .cache import PROMO_CODES
+    
+    transaction.on_commit(PROMO_CODES.invalidate)
@@ -0,0 +1,259 @@
+"""
+In-memory autocomplete index for the search box.
+
+Product titles, category labels and tag display names are broken into
+word-start-padded trigrams and kept in an inverted index in each worker.
+Lookups score candidates by trigram overlap with the query, so prefixes
+("hood") and typos ("trcksuit") both match, and never touch the database.
+
+The index is warmed when a worker boots (or built on first use), patched in
+place when catalog rows change in this worker, and rebuilt in the background
+when the catalog version moves (changes made by other workers, noticed
+within a second) or it gets old.
+"""
+
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+from django.db import close_old_connections
+
+from .catalog_cache import CATALOG_CACHE_TIMEOUT, VersionCheck, get_catalog_version
+import logging
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Minimum share of the query's trigrams a suggestion must contain
+MIN_SIMILARITY = 0.4
+
+MAX_INDEX_AGE = CATALOG_CACHE_TIMEOUT
+
+# Small boosts so that, at equal similarity, categories and tags (broad
+# navigation targets) come before individual products
+KIND_BOOST = {'category': 0.06, 'tag': 0.04, 'product': 0.0}
+
+
+def normalize(text):
+    """Lowercase and strip accents"""
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+
+
+def trigrams(text):
+    """Trigrams of every word, padded at the start so word prefixes weigh more"""
+    grams = set()
+    for word in WORD_RE.findall(normalize(text)):
+        padded = f'  {word}'
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class Suggestion:
+    __slots__ = ('key', 'kind', 'label', 'data', 'grams', 'boost')
+
+    def __init__(self, kind, ident, label, data):
+        self.key = (kind, ident)
+        self.kind = kind
+        self.label = label
+        self.data = data
+        self.grams = trigrams(label)
+        # Kind boost, minus a little for long labels (more unmatched text)
+        self.boost = KIND_BOOST[kind] - len(self.grams) / 1000
+
+    def as_dict(self):
+        return {'type': self.kind, 'label': self.label, **self.data}
+
+
+class SuggestIndex:
+    """Trigram inverted index over Suggestion entries"""
+
+    def __init__(self, version=None):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.entries = {}
+        self.postings = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def add(self, suggestion):
+        with self._lock:
+            self._discard(suggestion.key)
+            self.entries[suggestion.key] = suggestion
+            for gram in suggestion.grams:
+                self.postings[gram].add(suggestion.key)
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        old = self.entries.pop(key, None)
+        if old is None:
+            return
+        for gram in old.grams:
+            keys = self.postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[gram]
+
+    def search(self, query, limit=8):
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+
+        size = len(query_grams)
+        # One or two characters can't be fuzzy-matched meaningfully: prefix only
+        needed = size if size <= 2 else math.ceil(size * MIN_SIMILARITY)
+
+        with self._lock:
+            # Anything sharing `needed` grams must appear in at least one of the
+            # size - needed + 1 rarest posting lists, so only those are scanned
+            postings = sorted((self.postings.get(gram, ()) for gram in query_grams), key=len)
+            candidates = set().union(*postings[:size - needed + 1])
+            entries = self.entries
+
+        scored = []
+        for key in candidates:
+            entry = entries.get(key)
+            if entry is None:
+                continue
+            shared = len(query_grams & entry.grams)
+            if shared < needed:
+                continue
+            score = shared / size + entry.boost
+            # Containing every query trigram means each query word is a word
+            # prefix of the label - rank those above fuzzy matches
+            if shared == size:
+                score += 0.5
+            scored.append((score, key))
+
+        best = heapq.nlargest(limit, scored)
+        return [entries[key].as_dict() for _, key in best]
+
+    def is_stale(self, version):
+        return version != self.version or time.monotonic() - self.built_at > MAX_INDEX_AGE
+
+
+def product_suggestion(product):
+    return Suggestion('product', product.id, product.title, {'slug': product.slug, 'category': product.category_id})
+
+
+def category_suggestion(category):
+    return Suggestion('category', category.key, category.label, {'key': category.key})
+
+
+def tag_suggestion(tag):
+    return Suggestion('tag', tag.name, tag.display_name, {'name': tag.name})
+
+
+def build_index():
+    """Load every suggestible row and build a fresh index"""
+    from .models import Category, Product, ProductTag
+
+    index = SuggestIndex(version=get_catalog_version())
+    for product in Product.objects.filter(is_active=True).only('id', 'title', 'slug', 'category_id'):
+        index.add(product_suggestion(product))
+    for category in Category.objects.only('key', 'label'):
+        index.add(category_suggestion(category))
+    for tag in ProductTag.objects.only('name', 'display_name'):
+        index.add(tag_suggestion(tag))
+    return index
+
+
+_index = None
+_build_lock = threading.Lock()
+_rebuilding = False
+
+# Lookups don't read the cache: the version is re-checked at most once a
+# second per worker
+_catalog_version = VersionCheck(get_catalog_version)
+
+
+def get_index():
+    """
+    The worker's index, building it on first use. While the boot-time build
+    is still running an empty index is returned instead, rather than
+    building a second copy on the request.
+    """
+    global _index
+    if _index is None:
+        with _build_lock:
+            if _index is None and _rebuilding:
+                return SuggestIndex()
+            if _index is None:
+                _index = build_index()
+                logger.info(f"Suggest index built with {len(_index.entries)} entries")
+    elif _index.is_stale(_catalog_version.get()):
+        _rebuild_in_background()
+    return _index
+
+
+def warm_index():
+    """Start building the index in the background, e.g. when a worker boots"""
+    if _index is None:
+        _rebuild_in_background()
+
+
+def _rebuild_in_background():
+    global _rebuilding
+    with _build_lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+
+    def run():
+        global _index, _rebuilding
+        try:
+            _index = build_index()
+        except Exception as e:
+            logger.error(f"Suggest index rebuild failed: {e}")
+        finally:
+            close_old_connections()
+            _rebuilding = False
+
+    threading.Thread(target=run, name='suggest-index', daemon=True).start()
+
+
+def suggest(query, limit=8):
+    return get_index().search(query, limit)
+
+
+def _patch(change):
+    """
+    Apply `change(index)` in place. The catalog change being applied bumped
+    the version by one; if that's the only bump since the index was built,
+    the patched index is current, so it takes the new version instead of
+    waiting for a rebuild.
+    """
+    index = _index
+    if index is None:
+        return
+    change(index)
+    version = get_catalog_version()
+    if isinstance(version, int) and index.version == version - 1:
+        index.version = version
+
+
+def update_product(product):
+    if product.is_active:
+        _patch(lambda index: index.add(product_suggestion(product)))
+    else:
+        _patch(lambda index: index.discard(('product', product.pk)))
+
+
+def update_category(category):
+    _patch(lambda index: index.add(category_suggestion(category)))
+
+
+def update_tag(tag):
+    _patch(lambda index: index.add(tag_suggestion(tag)))
+
+
+def remove(kind, ident):
+    _patch(lambda index: index.discard((kind, ident)))
@@ -1,3 +1,1658 @@
-from django.test import TestCase
+import json
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
 
-# Create your tests here.
+import stripe
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from . import cache as shop_cache, catalog_snapshot, currency_service, email_outbox, email_rendering, momo, payment_events, suggest
+from .catalog_cache import (
+    bump_catalog_version, get_catalog_version, get_listing_version, get_stock_version, reset_version_checks
+)
+from .email_service import EmailService
+from .idempotency import IN_PROGRESS_TIMEOUT, idempotent, request_fingerprint
+from .inventory import InsufficientStock, decrement_stock
+from .models import (
+    Category, EmailOutbox, ExchangeRate, IdempotencyRecord, MomoTransaction, Order, OrderItem, Product,
+    ProductColor, ProductImage, ProductReview, ProductSize, ProductTag, ProductTagAssignment, ProductVariant,
+    StockReservation
+)
+from .payment_views import _cart_items
+from .price_book import rebuild_price_book
+from .product_rows import build_rows, row_fields
+from .renderers import ORJSONRenderer
+from .reservations import (
+    consume_reservations, release_expired_reservations, release_reservations, reserve_stock
+)
+from .schema import existing_tables
+from .search import search_products
+from .serializers import PRODUCT_CARD_FIELDS, CreateOrderSerializer, ProductSerializer
+
+
+# Keeps the database cache backend (DATABASE_CACHE=True) out of query counts
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductDetailQueryCountTests(TestCase):
+    """Product detail must render in a fixed number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='hoodies', label='Hoodies', description='Hoodies')
+        cls.product = Product.objects.create(
+            id='hoodie-1', title='Kente Hoodie', slug='kente-hoodie', price=45,
+            description='Warm hoodie', category=category,
+        )
+        cls.sizes = [
+            ProductSize.objects.create(name=name, display_name=name, order=order)
+            for order, name in enumerate(['S', 'M', 'L', 'XL'])
+        ]
+        cls.colors = [
+            ProductColor.objects.create(name=name, hex_code='#000000', order=order)
+            for order, name in enumerate(['Black', 'White', 'Red'])
+        ]
+        featured = ProductTag.objects.create(name='featured', display_name='Featured')
+        ProductTagAssignment.objects.create(product=cls.product, tag=featured)
+        for order in range(3):
+            ProductImage.objects.create(
+                product=cls.product, image_url=f'https://example.com/{order}.jpg',
+                is_primary=order == 0, order=order,
+            )
+
+    def setUp(self):
+        cache.clear()
+        existing_tables()  # schema check is cached per process, warm it up
+
+    def add_variants(self, sizes, colors):
+        for size in sizes:
+            for color in colors:
+                ProductVariant.objects.create(product=self.product, size=size, color=color, stock_quantity=2)
+
+    def get_detail(self):
+        response = self.client.get(f'/api/shop/products/{self.product.slug}/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_detail_query_count(self):
+        self.add_variants(self.sizes[:2], self.colors[:1])
+        # product + images + tag assignments (with tags) + variants (with size/color)
+        with self.assertNumQueries(4):
+            data = self.get_detail()
+
+        self.assertEqual(len(data['variants']), 2)
+        self.assertEqual([size['name'] for size in data['available_sizes']], ['S', 'M'])
+        self.assertEqual(data['tags'], ['featured'])
+        self.assertTrue(data['is_featured'])
+        self.assertEqual(data['image'], 'https://example.com/0.jpg')
+
+    def test_query_count_independent_of_variants(self):
+        self.add_variants(self.sizes, self.colors)
+        with self.assertNumQueries(4):
+            data = self.get_detail()
+
+        self.assertEqual(len(data['variants']), 12)
+        self.assertEqual([color['name'] for color in data['available_colors']], ['Black', 'White', 'Red'])
+
+    def test_localized_prices(self):
+        self.add_variants(self.sizes[:1], self.colors[:1])
+        ExchangeRate.objects.create(
+            base='USD', quote='GHS', rate=Decimal('15.5'), source='test', fetched_at=timezone.now()
+        )
+        rebuild_price_book()
+        # one more query: the product's and its variants' price book rows
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/shop/products/{self.product.slug}/?currency=GHS')
+
+        data = response.json()
+        self.assertEqual(data['currency'], 'GHS')
+        self.assertEqual(data['local_price_display'], 'GH₵ 697.50')
+        self.assertEqual(data['variants'][0]['local_final_price_display'], 'GH₵ 697.50')
+
+
+# Snapshots off: measure the views themselves
+@override_settings(CACHES=LOCMEM_CACHES, CATALOG_SNAPSHOT_HOSTS=[])
+class ProductListingQueryCountTests(TestCase):
+    """Listings cost the same number of queries whatever the page size"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(key='shirts', label='Shirts', description='Shirts')
+        cls.sizes = [ProductSize.objects.create(name=name, display_name=name) for name in ('S', 'M')]
+        cls.color = ProductColor.objects.create(name='Black', hex_code='#000000')
+
+    def setUp(self):
+        cache.clear()
+        existing_tables()
+
+    def add_products(self, count):
+        start = Product.objects.count()
+        for index in range(start, start + count):
+            product = Product.objects.create(
+                id=f'shirt-{index}', title=f'Shirt {index}', slug=f'shirt-{index}', price=25,
+                description='Shirt', category=self.category, is_featured=True,
+            )
+            for size in self.sizes:
+                ProductVariant.objects.create(product=product, size=size, color=self.color, stock_quantity=3)
+            for order in range(2):
+                ProductImage.objects.create(
+                    product=product, image_url=f'https://example.com/{index}-{order}.jpg',
+                    is_primary=order == 0, order=order,
+                )
+
+    def assertConstantQueries(self, path, queries):
+        """Same query count with one product as with five, variants and images included"""
+        for count in (1, 4):
+            self.add_products(count)
+            cache.clear()
+            with self.assertNumQueries(queries):
+                response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_product_list(self):
+        # One SELECT: stock, variant stock and the primary image are subqueries
+        data = self.assertConstantQueries('/api/shop/products/', 1)
+        self.assertEqual(len(data['results']), 5)
+        self.assertTrue(all(item['is_in_stock'] for item in data['results']))
+        self.assertEqual(data['results'][-1]['image'], 'https://example.com/0-0.jpg')
+
+    def test_featured_list(self):
+        # COUNT for the page number pagination, then the same single SELECT
+        data = self.assertConstantQueries('/api/shop/products/featured/', 2)
+        self.assertEqual(len(data['results']), 5)
+        self.assertTrue(all(item['is_in_stock'] for item in data['results']))
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Concurrent orders for the last units must never oversell"""
+
+    STOCK = 5
+    BUYERS = 12
+
+    def setUp(self):
+        category = Category.objects.create(key='caps', label='Caps', description='Caps')
+        self.product = Product.objects.create(
+            id='cap-1', title='Kente Cap', slug='kente-cap', price=20,
+            description='Cap', category=category, stock_quantity=self.STOCK,
+        )
+
+    def place_order(self, barrier, results):
+        client = Client()
+        try:
+            barrier.wait()
+            # The in-memory SQLite test database reports lock contention as an
+            # error instead of waiting; such attempts roll back, so retry them
+            for _ in range(50):
+                response = client.post('/api/payments/create-order/', {
+                    'customer_email': 'buyer@example.com',
+                    'shipping_country': 'NG',
+                    'items': [{'product_id': self.product.id, 'quantity': 1, 'unit_price': 20}],
+                }, content_type='application/json')
+                if response.status_code != 500:
+                    break
+            results.append(response.status_code)
+        finally:
+            connection.close()
+
+    def test_no_oversell_under_concurrent_checkout(self):
+        barrier = threading.Barrier(self.BUYERS)
+        results = []
+        threads = [
+            threading.Thread(target=self.place_order, args=(barrier, results))
+            for _ in range(self.BUYERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        sold = OrderItem.objects.filter(product=self.product).aggregate(total=Sum('quantity'))['total'] or 0
+        self.assertEqual(sorted(results), [200] * self.STOCK + [400] * (self.BUYERS - self.STOCK))
+        self.assertEqual(sold, self.STOCK)
+        self.assertEqual(self.product.stock_quantity, 0)
+        # Rejected checkouts leave nothing behind
+        self.assertEqual(Order.objects.count(), self.STOCK)
+
+    def test_short_line_rolls_back_whole_order(self):
+        other = Product.objects.create(
+            id='cap-2', title='Plain Cap', slug='plain-cap', price=15,
+            description='Cap', category=self.product.category, stock_quantity=1,
+        )
+        serializer = CreateOrderSerializer(data={
+            'id': 'ORDTEST1', 'customer_email': 'buyer@example.com', 'customer_name': 'Buyer',
+            'shipping_address': '1 Road', 'shipping_city': 'Accra', 'shipping_country': 'GH',
+            'shipping_postal_code': '00233', 'subtotal': 50, 'shipping_cost': 0, 'tax_amount': 0, 'total': 50,
+            'payment_method': 'card', 'payment_reference': 'ref-1',
+            'items': [
+                {'product_id': self.product.id, 'quantity': 1, 'unit_price': 20},
+                {'product_id': other.id, 'quantity': 1, 'unit_price': 15},
+            ],
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        # Someone else buys the last plain cap after validation
+        Product.objects.filter(pk=other.pk).update(stock_quantity=0)
+
+        with self.assertRaises(ValidationError):
+            serializer.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, self.STOCK)
+        self.assertFalse(Order.objects.exists())
+
+
+class StockReservationTests(TestCase):
+    """Stock held during payment is unavailable to everyone else until released or expired"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='caps', label='Caps', description='Caps')
+        cls.product = Product.objects.create(
+            id='cap-1', title='Kente Cap', slug='kente-cap', price=20,
+            description='Cap', category=category, stock_quantity=3,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def available(self, reference=None):
+        return Product.objects.with_variant_stock(reference).get(pk=self.product.pk).available_quantity
+
+    def cart(self, quantity):
+        return [{'product_id': self.product.id, 'quantity': quantity}]
+
+    def order_serializer(self, reference, quantity):
+        return CreateOrderSerializer(data={
+            'id': f'ORD{reference.upper()}', 'customer_email': 'buyer@example.com', 'customer_name': 'Buyer',
+            'shipping_address': '1 Road', 'shipping_city': 'Accra', 'shipping_country': 'GH',
+            'shipping_postal_code': '00233', 'subtotal': 20 * quantity, 'shipping_cost': 0, 'tax_amount': 0,
+            'total': 20 * quantity, 'payment_method': 'card', 'payment_reference': reference,
+            'items': [{'product_id': self.product.id, 'quantity': quantity, 'unit_price': 20}],
+        })
+
+    def test_reserve_holds_stock(self):
+        reserve_stock('cs_1', self.cart(2))
+        self.assertEqual(self.available(), 1)
+        # The holder still sees its own units
+        self.assertEqual(self.available('cs_1'), 3)
+
+        with self.assertRaises(InsufficientStock):
+            reserve_stock('cs_2', self.cart(2))
+        self.assertFalse(StockReservation.objects.filter(reference='cs_2').exists())
+
+    def test_reserve_again_replaces_holds(self):
+        reserve_stock('cs_1', self.cart(2))
+        reserve_stock('cs_1', self.cart(3))
+        self.assertEqual(StockReservation.objects.get(reference='cs_1').quantity, 3)
+        self.assertEqual(self.available(), 0)
+
+    def test_order_consumes_own_holds(self):
+        reserve_stock('cs_1', self.cart(2))
+        serializer = self.order_serializer('cs_1', 2)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock_quantity, 1)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(consume_reservations('cs_1'), 0)
+
+    def test_order_cant_take_held_stock(self):
+        reserve_stock('cs_1', self.cart(2))
+        serializer = self.order_serializer('cs_2', 2)
+        self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['items']['stock_errors'], ['Kente Cap: Only 1 in stock, but 2 requested'])
+
+    def test_order_bumps_only_stock_version(self):
+        catalog_version, stock_version = get_catalog_version(), get_stock_version()
+        serializer = self.order_serializer('cs_1', 1)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+
+        self.assertEqual(get_catalog_version(), catalog_version)
+        self.assertNotEqual(get_stock_version(), stock_version)
+
+    def test_release(self):
+        reserve_stock('cs_1', self.cart(3))
+        self.assertEqual(release_reservations('cs_1'), 1)
+        self.assertEqual(self.available(), 3)
+
+    def test_expired_holds(self):
+        reserve_stock('cs_1', self.cart(2))
+        StockReservation.objects.update(expires_at=timezone.now())
+        # Expired holds stop counting before they're swept
+        self.assertEqual(self.available(), 3)
+        reserve_stock('cs_2', self.cart(3))
+
+        self.assertEqual(release_expired_reservations(), 1)
+        self.assertEqual(list(StockReservation.objects.values_list('reference', flat=True)), ['cs_2'])
+
+    def test_reserve_rejects_invalid_quantities(self):
+        for quantity in (0, -1, 'two', None):
+            with self.subTest(quantity=quantity), self.assertRaises(InsufficientStock) as raised:
+                reserve_stock('cs_1', self.cart(quantity))
+            self.assertEqual(raised.exception.errors, ['Invalid quantity for product cap-1'])
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_checkout_with_invalid_quantity_is_rejected(self):
+        response = self.client.post('/api/payments/stripe/create-checkout-session/', {
+            'items': [{'title': 'Kente Cap', 'amount': 20, 'quantity': 'lots', 'product_id': self.product.id}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['stock_errors'], ['Invalid quantity for product cap-1'])
+
+    def test_detail_shows_stock_net_of_holds(self):
+        reserve_stock('cs_1', self.cart(3))
+        data = self.client.get('/api/shop/products/kente-cap/').json()
+        self.assertEqual(data['stock_quantity'], 0)
+        self.assertFalse(data['is_in_stock'])
+
+    def test_detail_variant_stock_net_of_holds(self):
+        size = ProductSize.objects.create(name='M', display_name='Medium')
+        color = ProductColor.objects.create(name='Gold', hex_code='#FFD700')
+        variant = ProductVariant.objects.create(product=self.product, size=size, color=color, stock_quantity=2)
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=0)
+        reserve_stock('cs_1', [{'product_id': self.product.id, 'variant_id': variant.pk, 'quantity': 2}])
+
+        data = self.client.get('/api/shop/products/kente-cap/').json()
+        self.assertEqual(data['variants'][0]['stock_quantity'], 0)
+        self.assertFalse(data['variants'][0]['is_in_stock'])
+        self.assertFalse(data['is_in_stock'])
+
+    def test_expired_checkout_session_releases_holds(self):
+        reserve_stock('cs_1', self.cart(2))
+        event = {'type': 'checkout.session.expired', 'data': {'object': {'id': 'cs_1'}}}
+        construct_event = vars(stripe.Webhook)['construct_event']
+        self.addCleanup(setattr, stripe.Webhook, 'construct_event', construct_event)
+        stripe.Webhook.construct_event = lambda *args: event
+
+        response = self.client.post('/api/payments/stripe/webhook/', b'{}', content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(self.available(), 3)
+
+    def test_cart_items_skip_non_product_lines(self):
+        # Checkout sends shipping and tax as extra Stripe line items
+        items = [
+            {'title': 'Kente Cap', 'amount': 20, 'quantity': 2, 'product_id': 'cap-1', 'variant_id': None},
+            {'title': 'Shipping', 'amount': 9.99, 'quantity': 1},
+        ]
+        self.assertEqual(_cart_items(items), [{'product_id': 'cap-1', 'variant_id': None, 'quantity': 2}])
+
+
+@override_settings(ALLOWED_HOSTS=['*'], CATALOG_SNAPSHOT_HOSTS=['shop.example'])
+class CatalogSnapshotHostTests(TestCase):
+    """Snapshots are only kept for configured hosts, and served without queries or cache reads"""
+
+    def build_snapshot(self):
+        view, path = catalog_snapshot._routes['categories']
+        self.addCleanup(catalog_snapshot._routes.__setitem__, 'categories', (view, path))
+        catalog_snapshot._routes['categories'] = (view, '/api/shop/categories/')
+        catalog_snapshot._templates['shop.example'] = {'HTTP_HOST': 'shop.example', 'SERVER_PORT': '80'}
+        self.addCleanup(catalog_snapshot._templates.pop, 'shop.example', None)
+        self.addCleanup(catalog_snapshot._snapshots.pop, 'shop.example', None)
+        # Builds only where the test asks for them, not in background threads
+        for name in ('_build_in_background', 'schedule_rebuild'):
+            self.addCleanup(setattr, catalog_snapshot, name, getattr(catalog_snapshot, name))
+            setattr(catalog_snapshot, name, lambda *args: None)
+        reset_version_checks()
+        catalog_snapshot.build_snapshot('shop.example')
+
+    def version_reads(self):
+        """Count the listing version reads made for snapshot requests"""
+        reads = []
+        check = catalog_snapshot._listing_version
+        self.addCleanup(setattr, check, 'read', check.read)
+        check.read = lambda: reads.append(True) or get_listing_version()
+        return reads
+
+    def test_unknown_host_not_snapshotted(self):
+        response = self.client.get('/api/shop/categories/', HTTP_HOST='attacker.example')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('attacker.example', catalog_snapshot._templates)
+        self.assertNotIn('attacker.example', catalog_snapshot._snapshots)
+
+    def test_served_without_version_reads(self):
+        self.build_snapshot()
+        reads = self.version_reads()
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                response = self.client.get('/api/shop/categories/', HTTP_HOST='shop.example')
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(reads), 1)
+
+    def test_gzip_negotiation(self):
+        self.build_snapshot()
+        for accept_encoding, gzipped in (
+            ('gzip, deflate, br', True),
+            ('gzip;q=0.5', True),
+            ('*', True),
+            ('gzip;q=0', False),
+            ('br, *;q=0', False),
+            ('gzip;q=0, *', False),
+            ('', False),
+        ):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.client.get(
+                    '/api/shop/categories/', HTTP_HOST='shop.example', HTTP_ACCEPT_ENCODING=accept_encoding,
+                )
+                self.assertEqual(response.get('Content-Encoding') == 'gzip', gzipped)
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_local_change_seen_at_once(self):
+        self.build_snapshot()
+        self.client.get('/api/shop/categories/', HTTP_HOST='shop.example')
+        bump_catalog_version()
+        reads = self.version_reads()
+        # The stale snapshot isn't served; the view answers
+        with self.assertNumQueries(1):
+            self.client.get('/api/shop/categories/', HTTP_HOST='shop.example')
+        self.assertEqual(len(reads), 1)
+
+
+class SuggestIndexTests(TestCase):
+    """The in-memory suggest index follows catalog changes without rebuilding"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(key='hoodies', label='Hoodies', description='Hoodies')
+
+    def setUp(self):
+        self.addCleanup(setattr, suggest, '_index', suggest._index)
+        suggest._index = suggest.build_index()
+        suggest._catalog_version.reset()
+
+    def test_update_keeps_index_current(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                id='hoodie-1', title='Kente Hoodie', slug='kente-hoodie', price=45,
+                description='Warm hoodie', category=self.category,
+            )
+
+        self.assertFalse(suggest._index.is_stale(get_catalog_version()))
+        self.assertEqual([entry['label'] for entry in suggest.suggest('kente')], ['Kente Hoodie'])
+
+    def test_lookups_read_version_once_per_interval(self):
+        reads = []
+        check = suggest._catalog_version
+        self.addCleanup(setattr, check, 'read', check.read)
+        check.read = lambda: reads.append(True) or get_catalog_version()
+        with self.assertNumQueries(0):
+            for query in ('h', 'ho', 'hoo', 'hood'):
+                suggest.suggest(query)
+        self.assertEqual(len(reads), 1)
+
+    def test_other_workers_changes_rebuild(self):
+        rebuilds = []
+        self.addCleanup(setattr, suggest, '_rebuild_in_background', suggest._rebuild_in_background)
+        suggest._rebuild_in_background = lambda: rebuilds.append(True)
+        suggest.suggest('hood')
+        # Another worker's bump doesn't reset this worker's check
+        shop_cache.CATALOG.invalidate()
+        suggest.suggest('hood')
+        self.assertEqual(rebuilds, [])
+
+        self.addCleanup(setattr, suggest._catalog_version, 'interval', suggest._catalog_version.interval)
+        suggest._catalog_version.interval = 0
+        suggest.suggest('hood')
+        self.assertEqual(rebuilds, [True])
+
+    def test_empty_while_warming(self):
+        suggest._index = None
+        self.addCleanup(setattr, suggest, '_rebuilding', False)
+        suggest._rebuilding = True
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest.suggest('hood'), [])
+        self.assertIsNone(suggest._index)
+
+
+class IdempotencyTests(TestCase):
+    """Requests repeated with the same Idempotency-Key run the view once"""
+
+    def setUp(self):
+        self.calls = []
+
+        @api_view(['POST'])
+        @idempotent('test')
+        def view(request):
+            self.calls.append(request.data)
+            if request.data.get('fail'):
+                return Response({'error': 'upstream down'}, status=502)
+            return Response({'order': len(self.calls)}, status=201)
+
+        self.view = view
+        self.factory = APIRequestFactory()
+
+    def post(self, data, key='key-1'):
+        request = self.factory.post('/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+        return self.view(request)
+
+    def test_replay(self):
+        first = self.post({'total': 10})
+        second = self.post({'total': 10})
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual((second.status_code, second.data), (201, {'order': 1}))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+        self.assertEqual(IdempotencyRecord.objects.get().status, 'completed')
+
+    def test_different_body_rejected(self):
+        self.post({'total': 10})
+        response = self.post({'total': 99})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_server_error_not_stored(self):
+        self.assertEqual(self.post({'fail': True}).status_code, 502)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+        # The retry runs the view again
+        self.assertEqual(self.post({'fail': True}).status_code, 502)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_in_flight_duplicate(self):
+        # Another attempt with the same key and body is still running
+        request_hash = request_fingerprint(SimpleNamespace(data={'total': 10}))
+        IdempotencyRecord.objects.create(scope='test', key='key-1', request_hash=request_hash)
+        response = self.post({'total': 10})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.calls, [])
+
+        # A claim abandoned by a dead worker is taken over
+        IdempotencyRecord.objects.update(created_at=timezone.now() - IN_PROGRESS_TIMEOUT * 2)
+        self.assertEqual(self.post({'total': 10}).status_code, 201)
+        self.assertEqual(len(self.calls), 1)
+
+
+class ProductSearchTests(TestCase):
+    """The full-text index follows product inserts, updates and deletes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(key='hoodies', label='Hoodies', description='Hoodies')
+
+    def create(self, id, title, description='Plain'):
+        return Product.objects.create(
+            id=id, title=title, slug=id, price=45, description=description, category=self.category,
+        )
+
+    def search(self, query):
+        rows, total = search_products(Product.objects.all(), query)
+        self.assertEqual(total, len(rows))
+        return [product.pk for product in rows]
+
+    def test_ranked_matches(self):
+        self.create('hoodie-1', 'Kente Hoodie')
+        self.create('tee-1', 'Plain Tee', description='Goes with any kente hoodie')
+        self.create('cap-1', 'Plain Cap')
+        # Title matches rank above description matches
+        self.assertEqual(self.search('kente hood'), ['hoodie-1', 'tee-1'])
+
+    def test_index_follows_changes(self):
+        hoodie = self.create('hoodie-1', 'Kente Hoodie')
+        self.create('hoodie-2', 'Adinkra Hoodie')
+        hoodie.title = 'Batik Hoodie'
+        hoodie.save()
+        self.assertEqual(self.search('kente'), [])
+        self.assertEqual(self.search('batik'), ['hoodie-1'])
+
+        hoodie.delete()
+        self.assertEqual(self.search('hoodie'), ['hoodie-2'])
+
+
+class PriceBookTests(TestCase):
+    """Localized prices follow product price changes once they commit"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='hoodies', label='Hoodies', description='Hoodies')
+        cls.product = Product.objects.create(
+            id='hoodie-1', title='Kente Hoodie', slug='kente-hoodie', price=40,
+            description='Warm hoodie', category=category,
+        )
+        ExchangeRate.objects.create(base='USD', quote='EUR', rate=Decimal('0.5'), source='test', fetched_at=timezone.now())
+        rebuild_price_book()
+
+    def local_price(self):
+        return self.product.localized_prices.get(currency='EUR', variant__isnull=True).price
+
+    def test_price_change_reprices_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.product.price = 50
+            self.product.save()
+            self.assertEqual(self.local_price(), Decimal('20.00'))
+
+        self.assertTrue(callbacks)
+        self.assertEqual(self.local_price(), Decimal('25.00'))
+
+    def test_cached_response_keeps_vary(self):
+        cache.clear()
+        for _ in range(2):  # miss, then hit
+            response = self.client.get('/api/shop/products/featured/?currency=EUR')
+            self.assertEqual(response.status_code, 200)
+            vary = {header.strip() for header in response['Vary'].split(',')}
+            self.assertTrue({'Accept', 'Accept-Language'} <= vary, vary)
+
+
+class CacheNamespaceTests(TestCase):
+    """Namespaces prefix keys; versioned ones drop every entry on invalidate()"""
+
+    def setUp(self):
+        cache.clear()
+        self.namespace = shop_cache.Namespace('test', timeout=60, versioned=True)
+        self.addCleanup(shop_cache._namespaces.pop, 'test')
+
+    def test_invalidate(self):
+        self.namespace.set('a', 1)
+        self.assertEqual(self.namespace.get('a'), 1)
+        self.namespace.invalidate()
+        self.assertIsNone(self.namespace.get('a'))
+        self.assertEqual(shop_cache.stats()['test'], {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_aget(self):
+        # The version is seeded by the async path too
+        self.assertIsNone(async_to_sync(self.namespace.aget)('a'))
+        self.namespace.set('a', 1)
+        self.assertEqual(async_to_sync(self.namespace.aget)('a'), 1)
+        self.assertEqual(async_to_sync(self.namespace.aversion)(), self.namespace.version())
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get('/api/shop/cache-stats/').status_code, 403)
+
+        user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'password')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/api/shop/cache-stats/').status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get('/api/shop/cache-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('test', response.json()['namespaces'])
+
+
+class CatalogCacheTests(TestCase):
+    """Cached catalog responses revalidate by ETag and drop on catalog changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(key='hoodies', label='Hoodies', description='Hoodies')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_etag_not_modified(self):
+        response = self.client.get('/api/shop/products/?category=hoodies')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get('/api/shop/products/?category=hoodies', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_warm_listing_makes_no_queries(self):
+        self.client.get('/api/shop/products/?category=hoodies')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/shop/products/?category=hoodies').status_code, 200)
+
+    def test_catalog_change_invalidates(self):
+        version = get_catalog_version()
+        etag = self.client.get('/api/shop/products/?category=hoodies')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                id='hoodie-1', title='Kente Hoodie', slug='kente-hoodie', price=45,
+                description='Warm hoodie', category=self.category,
+            )
+
+        self.assertNotEqual(get_catalog_version(), version)
+        response = self.client.get('/api/shop/products/?category=hoodies', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Kente Hoodie')
+
+
+class DirtyFieldsTests(TestCase):
+    """Tracked fields report what a save changed"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hoodies = Category.objects.create(key='hoodies', label='Hoodies', description='Hoodies')
+        cls.caps = Category.objects.create(key='caps', label='Caps', description='Caps')
+        Product.objects.create(
+            id='hoodie-1', title='Kente Hoodie', slug='kente-hoodie', price=45,
+            description='Warm hoodie', category=cls.hoodies,
+        )
+
+    def setUp(self):
+        self.product = Product.objects.get(pk='hoodie-1')
+
+    def test_saved_changes_with_update_fields(self):
+        self.product.price = 50
+        self.product.category = self.caps
+        self.product.save(update_fields=['price'])
+
+        self.assertEqual(self.product.saved_changes, {'price': Decimal('45.00')})
+        # The category wasn't written, so it still counts as changed
+        self.assertFalse(self.product.has_changed('price'))
+        self.assertTrue(self.product.has_changed('category'))
+        self.assertEqual(self.product.previous('category'), 'hoodies')
+
+    def test_failed_save_restores_snapshot(self):
+        self.product.price = 50
+        self.product.stock_quantity = -1  # violates product_stock_non_negative
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.product.save()
+
+        self.assertTrue(self.product.has_changed('price'))
+        self.assertEqual(self.product.previous('price'), Decimal('45.00'))
+        self.assertEqual(self.product.saved_changes, {})
+
+    def test_category_move_updates_both_counts(self):
+        self.hoodies.refresh_from_db()
+        self.assertEqual(self.hoodies.product_count, 1)
+
+        self.product.category = self.caps
+        self.product.save()
+        self.assertEqual(self.product.saved_changes, {'category': 'hoodies'})
+
+        self.hoodies.refresh_from_db()
+        self.caps.refresh_from_db()
+        self.assertEqual((self.hoodies.product_count, self.caps.product_count), (0, 1))
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages cover every product exactly once, whatever the sort"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='hoodies', label='Hoodies', description='Hoodies')
+        for index in range(11):
+            Product.objects.create(
+                id=f'hoodie-{index:02}', title=f'Hoodie {index % 3}', slug=f'hoodie-{index:02}',
+                price=[20, 30, 40][index % 3], description='Warm hoodie', category=category,
+            )
+        # Ties on every sort key but the id
+        Product.objects.update(created_at=timezone.now())
+
+    def setUp(self):
+        cache.clear()
+
+    def walk(self, sort):
+        """Ids on every page following `next` links, then back along `previous`"""
+        url = f'/api/shop/products/?sort={sort}&page_size=4'
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append([row['id'] for row in data['results']])
+            url = data['next']
+        backwards = [pages[-1]]
+        url = data['previous']
+        while url:
+            data = self.client.get(url).json()
+            backwards.append([row['id'] for row in data['results']])
+            url = data['previous']
+        return pages, backwards[::-1]
+
+    def test_walk_all_pages(self):
+        for sort in ('newest', 'oldest', 'price_low', 'price_high', 'name'):
+            with self.subTest(sort=sort):
+                pages, backwards = self.walk(sort)
+                ids = [pk for page in pages for pk in page]
+                self.assertEqual([len(page) for page in pages], [4, 4, 3])
+                self.assertEqual(sorted(ids), sorted(Product.objects.values_list('id', flat=True)))
+                self.assertEqual(backwards, pages)
+
+    def test_sort_order(self):
+        pages, _ = self.walk('price_low')
+        ids = [pk for page in pages for pk in page]
+        expected = Product.objects.order_by('price', 'id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-base64!', 'eyJzIjoibmFtZSJ9', 'eyJzIjoibmV3ZXN0IiwicCI6WzFdfQ'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(f'/api/shop/products/?cursor={cursor}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+
+class FacetTests(TestCase):
+    """Facet counts apply every selection except the facet's own"""
+
+    @classmethod
+    def setUpTestData(cls):
+        hoodies = Category.objects.create(key='hoodies', label='Hoodies', description='Hoodies')
+        tees = Category.objects.create(key='tees', label='Tees', description='Tees')
+        small = ProductSize.objects.create(name='S', display_name='Small', order=1)
+        medium = ProductSize.objects.create(name='M', display_name='Medium', order=2)
+        black = ProductColor.objects.create(name='Black', hex_code='#000000', order=1)
+        for pk, category, price, size, stock in (
+            ('hoodie-s', hoodies, 20, small, 2),
+            ('hoodie-m', hoodies, 40, medium, 2),
+            ('tee-s', tees, 30, small, 0),
+        ):
+            product = Product.objects.create(
+                id=pk, title=pk, slug=pk, price=price, description=pk, category=category,
+            )
+            ProductVariant.objects.create(product=product, size=size, color=black, stock_quantity=stock)
+
+    def setUp(self):
+        cache.clear()
+
+    def facets(self, query=''):
+        response = self.client.get(f'/api/shop/products/facets/{query}')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        counts = {
+            facet: {str(entry['value']): entry['count'] for entry in entries}
+            for facet, entries in data['facets'].items()
+        }
+        return data, counts
+
+    def test_unfiltered(self):
+        data, counts = self.facets()
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(counts['category'], {'hoodies': 2, 'tees': 1})
+        self.assertEqual(counts['size'], {'S': 2, 'M': 1})
+        self.assertEqual(counts['price']['0-25'], 1)
+        self.assertEqual(counts['price']['25-50'], 2)
+        self.assertEqual(counts['availability'], {'in_stock': 2, 'out_of_stock': 1})
+
+    def test_selection_counts_other_values_of_its_facet(self):
+        data, counts = self.facets('?size=S')
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['selected']['size'], ['S'])
+        # Size values ignore the size selection; the other facets honour it
+        self.assertEqual(counts['size'], {'S': 2, 'M': 1})
+        self.assertEqual(counts['category'], {'hoodies': 1, 'tees': 1})
+        self.assertEqual(counts['availability'], {'in_stock': 1, 'out_of_stock': 1})
+
+    def test_combined_selections(self):
+        data, counts = self.facets('?category=hoodies&availability=in_stock')
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(counts['category'], {'hoodies': 2, 'tees': 0})
+        self.assertEqual(counts['size'], {'S': 1, 'M': 1})
+        self.assertEqual(counts['availability'], {'in_stock': 2, 'out_of_stock': 0})
+
+    def test_counts_follow_catalog_changes(self):
+        self.facets()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(pk='tee-s').delete()
+        data, counts = self.facets()
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(counts['category'], {'hoodies': 2, 'tees': 0})
+
+
+class SparseFieldsetTests(TestCase):
+    """?fields= / ?exclude= trim both the response and the columns loaded"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='hoodies', label='Hoodies', description='Hoodies')
+        Product.objects.create(
+            id='hoodie', title='Hoodie', slug='hoodie', price=40, description='Warm hoodie', category=category,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_list_preset(self):
+        response = self.client.get('/api/shop/products/?fields=card')
+        self.assertEqual(response.status_code, 200)
+        row = response.json()['results'][0]
+        self.assertEqual(set(row), set(PRODUCT_CARD_FIELDS))
+        self.assertEqual(row['title'], 'Hoodie')
+
+    def test_detail_fields(self):
+        response = self.client.get('/api/shop/products/hoodie/?fields=id,title,price')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'id', 'title', 'price'})
+
+    def test_exclude(self):
+        response = self.client.get('/api/shop/categories/?exclude=description,image')
+        self.assertEqual(response.status_code, 200)
+        row = response.json()['results'][0]
+        self.assertEqual(set(row), {'key', 'label', 'featured', 'product_count'})
+
+    def test_unknown_fields_are_ignored(self):
+        response = self.client.get('/api/shop/products/hoodie/?fields=title,nonsense')
+        self.assertEqual(set(response.json()), {'title'})
+
+    def test_project_defers_unused_columns(self):
+        request = APIRequestFactory().get('/', {'fields': 'title,category_label'})
+        product = ProductSerializer.project(Product.objects.all(), request).get()
+        deferred = product.get_deferred_fields()
+        self.assertIn('description', deferred)
+        self.assertNotIn('title', deferred)
+        with self.assertNumQueries(0):
+            self.assertEqual(product.category.label, 'Hoodies')
+
+    def test_no_selection_loads_everything(self):
+        request = APIRequestFactory().get('/')
+        product = ProductSerializer.project(Product.objects.all(), request).get()
+        self.assertEqual(product.get_deferred_fields(), set())
+
+
+class CheckoutBatchingTests(TestCase):
+    """Checkout cost doesn't grow with the number of cart lines"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='caps', label='Caps', description='Caps')
+        size = ProductSize.objects.create(name='M', display_name='M', order=1)
+        color = ProductColor.objects.create(name='Black', hex_code='#000000', order=1)
+        cls.products = [
+            Product.objects.create(
+                id=f'cap-{index}', title=f'Cap {index}', slug=f'cap-{index}', price=20,
+                description='Cap', category=category, stock_quantity=5,
+            )
+            for index in range(6)
+        ]
+        cls.variants = [
+            ProductVariant.objects.create(product=product, size=size, color=color, stock_quantity=5)
+            for product in cls.products
+        ]
+
+    def lines(self, count):
+        """`count` cart lines, alternating plain products and variants"""
+        items = []
+        for index in range(count):
+            item = {'product_id': self.products[index // 2].id, 'quantity': 1, 'unit_price': 20}
+            if index % 2:
+                item['variant_id'] = self.variants[index // 2].id
+            items.append(item)
+        return items
+
+    def place_order(self, reference, items):
+        serializer = CreateOrderSerializer(data={
+            'id': f'ORD{reference.upper()}', 'customer_email': 'buyer@example.com', 'customer_name': 'Buyer',
+            'shipping_address': '1 Road', 'shipping_city': 'Accra', 'shipping_country': 'GH',
+            'shipping_postal_code': '00233', 'subtotal': 20 * len(items), 'shipping_cost': 0, 'tax_amount': 0,
+            'total': 20 * len(items), 'payment_method': 'card', 'payment_reference': reference,
+            'items': items,
+        })
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+            order = serializer.save()
+        return order, len(queries)
+
+    def test_query_count_independent_of_lines(self):
+        _, small = self.place_order('cs_1', self.lines(2))
+        order, large = self.place_order('cs_2', self.lines(12))
+        self.assertEqual(small, large)
+        self.assertEqual(order.items.count(), 12)
+        self.assertEqual(order.items.filter(product_variant__isnull=False).count(), 6)
+        self.assertEqual(
+            order.items.aggregate(total=Sum('total_price'))['total'], Decimal('240.00'),
+        )
+
+    def test_stock_taken_per_line(self):
+        self.place_order('cs_1', self.lines(4))
+        self.assertEqual(
+            list(Product.objects.order_by('id').values_list('stock_quantity', flat=True)), [4, 4, 5, 5, 5, 5],
+        )
+        self.assertEqual(
+            list(ProductVariant.objects.order_by('product_id').values_list('stock_quantity', flat=True)),
+            [4, 4, 5, 5, 5, 5],
+        )
+
+    def test_decrement_reports_every_short_line(self):
+        first, second = self.products[:2]
+        with self.assertRaises(InsufficientStock) as raised, transaction.atomic():
+            decrement_stock([(first, None, 6), (second, None, 2), (second, self.variants[1], 9)])
+        self.assertEqual(len(raised.exception.errors), 2)
+        # Nothing was taken, not even for the line that fit
+        self.assertEqual(Product.objects.get(pk=second.pk).stock_quantity, 5)
+
+
+class ValidateStockTests(TestCase):
+    """validate-stock checks one cart (`items`) or many (`carts`) in a fixed number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='caps', label='Caps', description='Caps')
+        cls.plenty = Product.objects.create(
+            id='cap-1', title='Plenty Cap', slug='cap-1', price=20, description='Cap', category=category,
+            stock_quantity=20,
+        )
+        cls.few = Product.objects.create(
+            id='cap-2', title='Few Cap', slug='cap-2', price=20, description='Cap', category=category,
+            stock_quantity=3,
+        )
+
+    def post(self, payload):
+        return self.client.post('/api/shop/validate-stock/', payload, content_type='application/json')
+
+    def test_single_cart(self):
+        response = self.post({'items': [
+            {'product_id': 'cap-1', 'quantity': 2},
+            {'product_id': 'cap-2', 'quantity': 1},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['valid'])
+        self.assertEqual(data['errors'], [])
+        self.assertEqual([warning['product_id'] for warning in data['warnings']], ['cap-2'])
+
+    def test_single_cart_errors(self):
+        data = self.post({'items': [
+            {'product_id': 'cap-2', 'quantity': 5},
+            {'product_id': 'missing', 'quantity': 1},
+        ]}).json()
+        self.assertFalse(data['valid'])
+        self.assertEqual(data['errors'][0]['available_quantity'], 3)
+        self.assertEqual(data['errors'][1]['error'], 'Product not found')
+
+    def test_own_holds_count_as_available(self):
+        reserve_stock('cs_1', [{'product_id': 'cap-2', 'quantity': 3}])
+        items = [{'product_id': 'cap-2', 'quantity': 3}]
+        self.assertFalse(self.post({'items': items}).json()['valid'])
+        self.assertTrue(self.post({'items': items, 'payment_reference': 'cs_1'}).json()['valid'])
+
+    def test_batch(self):
+        carts = [
+            {'id': 'a', 'items': [{'product_id': 'cap-1', 'quantity': 1}]},
+            {'id': 'b', 'items': [{'product_id': 'cap-2', 'quantity': 4}]},
+            {'id': 'c', 'items': [{'product_id': 'cap-1', 'quantity': 20}, {'product_id': 'cap-2', 'quantity': 3}]},
+        ]
+        data = self.post({'carts': carts}).json()
+        self.assertEqual([(result['id'], result['valid']) for result in data['results']], [
+            ('a', True), ('b', False), ('c', True),
+        ])
+        self.assertEqual((data['valid_count'], data['invalid_count']), (2, 1))
+
+    def test_batch_query_count_independent_of_carts(self):
+        carts = [{'id': index, 'items': [{'product_id': 'cap-1', 'quantity': 1}]} for index in range(50)]
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.post({'carts': carts[:2]}).json()['results']), 2)
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.post({'carts': carts}).json()['results']), 50)
+
+    def test_rejects_malformed_carts(self):
+        self.assertEqual(self.post({'carts': {'items': []}}).status_code, 400)
+        self.assertEqual(self.post({'items': []}).status_code, 400)
+
+
+class EmailRenderingTests(TestCase):
+    """Email templates are compiled once with their CSS inlined and a text twin"""
+
+    template = 'emails/order_status_update.html'
+
+    def setUp(self):
+        email_rendering.clear_template_cache()
+
+    def context(self, **values):
+        return {
+            'order_id': 'ORD1', 'new_status': 'shipped', 'update_date': timezone.now(),
+            'support_email': 'help@example.com', **values,
+        }
+
+    def test_inline_css(self):
+        html = email_rendering.inline_css(
+            '<style>p { color: red } .note { margin: 0 } td.note { padding: 0 } div > p { color: blue }</style>'
+            '<body><p class="note" style="padding: 1px">Hi</p><td class="note">x</td></body>'
+        )
+        self.assertIn('<p class="note" style="color: red; margin: 0; padding: 1px">', html)
+        self.assertIn('<td class="note" style="margin: 0; padding: 0">', html)
+        # Selectors that can't be inlined stay in the <style> block only
+        self.assertNotIn('color: blue"', html)
+
+    def test_render(self):
+        html, text = email_rendering.render_email(self.template, self.context(
+            tracking_number='1Z999', tracking_url='https://track.example/1Z999',
+        ))
+        self.assertIn('<div class="header" style="background: #6f42c1;', html)
+        self.assertIn('Order #ORD1', html)
+        self.assertNotIn('<', text)
+        self.assertIn('Status: Shipped', text)
+        self.assertIn('Track Your Package (https://track.example/1Z999)', text)
+
+    def test_text_skips_unset_blocks_and_escaping(self):
+        html, text = email_rendering.render_email(self.template, self.context(update_message='Fish & <chips>'))
+        self.assertIn('Fish &amp; &lt;chips&gt;', html)
+        self.assertIn('Fish & <chips>', text)
+        self.assertNotIn('Tracking Number', text)
+
+    def test_templates_compiled_once(self):
+        email_rendering.render_email(self.template, self.context())
+        email_rendering.render_many(self.template, [self.context(order_id=f'ORD{index}') for index in range(3)])
+        info = email_rendering.get_email_templates.cache_info()
+        self.assertEqual((info.misses, info.hits), (1, 1))
+
+    def test_render_many(self):
+        rendered = email_rendering.render_many(
+            self.template, [{'order_id': 'ORD1'}, {'order_id': 'ORD2'}],
+            shared_context={'support_email': 'help@example.com', 'new_status': 'paid'},
+        )
+        self.assertEqual(len(rendered), 2)
+        for (html, text), order_id in zip(rendered, ('ORD1', 'ORD2')):
+            self.assertIn(f'Order #{order_id}', text)
+            self.assertIn('help@example.com', html)
+
+
+@override_settings(EMAIL_OUTBOX_ENABLED=False, ADMIN_EMAIL='admin@example.com')
+class NewOrderNotificationTests(TestCase):
+    """The admin hears about a new order once it commits, with its line items"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='caps', label='Caps', description='Caps')
+        Product.objects.create(
+            id='cap-1', title='Kente Cap', slug='kente-cap', price=20, description='Cap', category=category,
+            stock_quantity=5,
+        )
+        Product.objects.create(
+            id='cap-2', title='Adinkra Cap', slug='adinkra-cap', price=25, description='Cap', category=category,
+            stock_quantity=5,
+        )
+
+    def admin_emails(self):
+        return [email for email in mail.outbox if email.to == ['admin@example.com']]
+
+    def test_serializer_order(self):
+        serializer = CreateOrderSerializer(data={
+            'id': 'ORDCS1', 'customer_email': 'buyer@example.com', 'customer_name': 'Buyer',
+            'shipping_address': '1 Road', 'shipping_city': 'Accra', 'shipping_country': 'GH',
+            'shipping_postal_code': '00233', 'subtotal': 65, 'shipping_cost': 0, 'tax_amount': 0,
+            'total': 65, 'payment_method': 'card', 'payment_reference': 'cs_1',
+            'items': [
+                {'product_id': 'cap-1', 'quantity': 2, 'unit_price': 20, 'selected_size': 'M'},
+                {'product_id': 'cap-2', 'quantity': 1, 'unit_price': 25},
+            ],
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer.save()
+            # Nothing is sent before the order commits
+            self.assertEqual(self.admin_emails(), [])
+
+        [email] = self.admin_emails()
+        self.assertIn('ORDCS1', email.subject)
+        self.assertIn('Kente Cap (M) - Qty: 2 - $40.00', email.body)
+        self.assertIn('Adinkra Cap - Qty: 1 - $25.00', email.body)
+
+    def test_items_added_after_the_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(
+                id='ORD2', customer_email='buyer@example.com', customer_name='Buyer', shipping_address='1 Road',
+                shipping_city='Accra', shipping_country='GH', shipping_postal_code='00233',
+                subtotal=20, total=20, payment_method='card',
+            )
+            OrderItem.objects.create(order=order, product_id='cap-1', quantity=1, unit_price=20)
+
+        [email] = self.admin_emails()
+        self.assertIn('Kente Cap - Qty: 1 - $20.00', email.body)
+
+    def test_rolled_back_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                Order.objects.create(
+                    id='ORD3', customer_email='buyer@example.com', customer_name='Buyer', shipping_address='1 Road',
+                    shipping_city='Accra', shipping_country='GH', shipping_postal_code='00233',
+                    subtotal=20, total=20, payment_method='card',
+                )
+                Order.objects.create(id='ORD3')
+        self.assertEqual(self.admin_emails(), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MomoTransactionTests(TestCase):
+    """MoMo payments live in the database, with the cache in front"""
+
+    conversion = {'ghs_amount_pesewas': 15000, 'exchange_rate': 15.0}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_reads(self):
+        momo.create_transaction('momo_1', '0240000000', Decimal('10.00'), self.conversion)
+        with self.assertNumQueries(0):
+            state = momo.get_transaction('momo_1')
+        self.assertEqual((state['status'], state['ghs_amount']), ('pending', 15000))
+
+    def test_survives_cache_loss(self):
+        momo.create_transaction('momo_1', '0240000000', Decimal('10.00'), self.conversion)
+        # Another worker, or a restart, with nothing cached
+        cache.clear()
+        state = momo.get_transaction('momo_1')
+        self.assertEqual(state['usd_amount'], Decimal('10.00'))
+        self.assertEqual(state['conversion_info'], self.conversion)
+        self.assertIsNone(momo.get_transaction('momo_missing'))
+
+    def test_sandbox_outcome_applied_once_due(self):
+        momo.create_transaction(
+            'momo_1', '0240000000', Decimal('10.00'), self.conversion,
+            resolves_to='success', resolve_in=timedelta(seconds=10),
+        )
+        self.assertEqual(momo.get_transaction('momo_1')['status'], 'pending')
+
+        later = timezone.now() + timedelta(seconds=11)
+        self.assertEqual(momo.get_transaction('momo_1', now=later)['status'], 'success')
+        self.assertEqual(MomoTransaction.objects.get(reference='momo_1').status, 'success')
+
+    def test_transition_only_from_expected_status(self):
+        momo.create_transaction('momo_1', '0240000000', Decimal('10.00'), self.conversion)
+        momo.set_status('momo_1', 'failed')
+        # A late sandbox resolution doesn't overwrite the final status
+        self.assertEqual(momo.set_status('momo_1', 'success', only_if='pending')['status'], 'failed')
+
+    def test_refresh_after_outside_write(self):
+        momo.create_transaction('momo_1', '0240000000', Decimal('10.00'), self.conversion)
+        MomoTransaction.objects.filter(reference='momo_1').update(status='success')
+        momo.refresh_cached_transaction('momo_1')
+        with self.assertNumQueries(0):
+            self.assertEqual(momo.get_transaction('momo_1')['status'], 'success')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ExchangeRateTests(TestCase):
+    """Conversions use the stored rate; providers are only asked by refreshes"""
+
+    def setUp(self):
+        cache.clear()
+        self.refreshes = []
+        self.addCleanup(setattr, currency_service, 'requests', currency_service.requests)
+        currency_service.requests = SimpleNamespace(get=self.no_network)
+        # Stand-in for the background thread
+        converter = currency_service.CurrencyConverter
+        self.addCleanup(setattr, converter, 'refresh_in_background', vars(converter)['refresh_in_background'])
+        converter.refresh_in_background = lambda: self.refreshes.append(True)
+
+    def no_network(self, *args, **kwargs):
+        raise AssertionError('A rate provider was called')
+
+    def store_rate(self, rate, age=timedelta(0)):
+        ExchangeRate.objects.create(
+            base='USD', quote='GHS', rate=rate, source='test', fetched_at=timezone.now() - age,
+        )
+
+    def test_stored_rate(self):
+        self.store_rate(Decimal('15.5'))
+        conversion = currency_service.convert_usd_to_ghs(Decimal('10.00'))
+        self.assertEqual(conversion['ghs_amount_pesewas'], 15500)
+        self.assertEqual(conversion['rate_source'], 'cached')
+        # Later conversions are served from the cache
+        with self.assertNumQueries(0):
+            self.assertEqual(currency_service.get_current_exchange_rate(), Decimal('15.5'))
+        self.assertEqual(self.refreshes, [])
+
+    def test_stale_rate_served_while_refreshing(self):
+        self.store_rate(Decimal('15.5'), age=timedelta(hours=2))
+        info = currency_service.get_rate_display()
+        self.assertEqual(info['rate'], 15.5)
+        self.assertTrue(info['is_stale'])
+        self.assertEqual(self.refreshes, [True])
+
+    def test_fallback_without_stored_rate(self):
+        conversion = currency_service.convert_usd_to_ghs(2)
+        self.assertEqual(conversion['rate_source'], 'fallback')
+        self.assertEqual(conversion['ghs_amount_pesewas'], 2500)
+        self.assertEqual(self.refreshes, [True])
+
+    def test_refresh_stores_first_answer(self):
+        converter = currency_service.CurrencyConverter
+        for name, answer in (
+            ('_fetch_from_exchangerate_api', {'GHS': Decimal('16'), 'EUR': Decimal('0.9')}),
+            ('_fetch_from_fixer_api', None),
+            ('_fetch_from_currencyapi', None),
+        ):
+            self.addCleanup(setattr, converter, name, vars(converter)[name])
+            setattr(converter, name, staticmethod(lambda answer=answer: answer))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(currency_service.refresh_exchange_rate().rate, Decimal('16'))
+        self.assertEqual(
+            dict(ExchangeRate.objects.values_list('quote', 'rate')), {'GHS': Decimal('16'), 'EUR': Decimal('0.9')},
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(currency_service.get_current_exchange_rate(), Decimal('16'))
+
+
+@override_settings(ADMIN_EMAIL='admin@example.com')
+class OrderConfirmationTests(TestCase):
+    """The customer's confirmation never goes out from inside the checkout transaction"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='caps', label='Caps', description='Caps')
+        Product.objects.create(
+            id='cap-1', title='Kente Cap', slug='kente-cap', price=20, description='Cap', category=category,
+            stock_quantity=5,
+        )
+
+    def place_order(self):
+        response = self.client.post('/api/payments/create-order/', {
+            'customer_email': 'buyer@example.com',
+            'shipping_country': 'NG',
+            'items': [{'product_id': 'cap-1', 'quantity': 1, 'unit_price': 20}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['email_sent'])
+        return response.json()['order_id']
+
+    def customer_emails(self):
+        return [email for email in mail.outbox if email.to == ['buyer@example.com']]
+
+    @override_settings(EMAIL_OUTBOX_ENABLED=False)
+    def test_sent_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order_id = self.place_order()
+            self.assertEqual(self.customer_emails(), [])
+
+        [email] = self.customer_emails()
+        self.assertIn(order_id, email.subject)
+
+    @override_settings(EMAIL_OUTBOX_ENABLED=True)
+    def test_queued_with_the_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.place_order()
+            # Inserted in the order's transaction; the worker sends it
+            self.assertEqual(EmailOutbox.objects.filter(to=['buyer@example.com']).count(), 1)
+        self.assertEqual(self.customer_emails(), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PaymentStatusEventsTests(TestCase):
+    """Status streams and long-polls wait on ASGI, and answer at once on WSGI"""
+
+    conversion = {'ghs_amount_pesewas': 15000, 'exchange_rate': 15.0}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(setattr, payment_events, 'POLL_INTERVAL', payment_events.POLL_INTERVAL)
+        payment_events.POLL_INTERVAL = 0.05
+
+    def create(self, **outcome):
+        momo.create_transaction('momo_1', '0240000000', Decimal('10.00'), self.conversion, **outcome)
+
+    async def test_wait_returns_on_change(self):
+        await sync_to_async(self.create)(resolves_to='success', resolve_in=timedelta(seconds=0.2))
+        response = await self.async_client.get('/api/payments/momo/status/momo_1/wait/?status=pending&timeout=5')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'success')
+
+    async def test_wait_times_out(self):
+        await sync_to_async(self.create)()
+        response = await self.async_client.get('/api/payments/momo/status/momo_1/wait/?status=pending&timeout=0.2')
+        self.assertEqual(response.json()['status'], 'pending')
+
+    async def test_wait_unknown_payment(self):
+        response = await self.async_client.get('/api/payments/momo/status/missing/wait/?timeout=1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_wait_answers_at_once_on_wsgi(self):
+        self.create()
+        started = time.monotonic()
+        response = self.client.get('/api/payments/momo/status/momo_1/wait/?status=pending&timeout=30')
+        self.assertEqual(response.json()['status'], 'pending')
+        self.assertLess(time.monotonic() - started, 5)
+
+    async def test_events_stream(self):
+        await sync_to_async(self.create)(resolves_to='failed', resolve_in=timedelta(seconds=0.2))
+        response = await self.async_client.get('/api/payments/momo/status/momo_1/events/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = [frame async for frame in response.streaming_content]
+        statuses = [
+            json.loads(frame.decode().split('data: ', 1)[1])['status']
+            for frame in frames if frame.startswith(b'event: status')
+        ]
+        # Ends once the payment is finished
+        self.assertEqual(statuses, ['pending', 'failed'])
+
+    def test_events_single_frame_on_wsgi(self):
+        self.create()
+        response = self.client.get('/api/payments/momo/status/momo_1/events/')
+        body = b''.join(response).decode()
+        self.assertTrue(body.startswith(f'retry: {payment_events.RECONNECT_DELAY}\n'))
+        self.assertEqual(body.count('event: status'), 1)
+
+    def test_events_unknown_payment(self):
+        response = self.client.get('/api/payments/momo/status/missing/events/')
+        self.assertIn('event: error', b''.join(response).decode())
+
+    def test_failed_payment_releases_holds_once(self):
+        category = Category.objects.create(key='caps', label='Caps', description='Caps')
+        Product.objects.create(
+            id='cap-1', title='Kente Cap', slug='kente-cap', price=20, description='Cap', category=category,
+            stock_quantity=3,
+        )
+        reserve_stock('momo_1', [{'product_id': 'cap-1', 'quantity': 2}])
+        self.create(resolves_to='failed', resolve_in=timedelta(0))
+
+        self.assertEqual(self.client.get('/api/payments/momo/status/momo_1/').json()['status'], 'failed')
+        self.assertFalse(StockReservation.objects.exists())
+        # Later reads of the finished payment don't touch the database
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/payments/momo/status/momo_1/').json()['status'], 'failed')
+
+
+class ReviewStatsTests(TestCase):
+    """Product review aggregates follow review changes without a rebuild"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(key='scarves', label='Scarves', description='Scarves')
+        cls.product = Product.objects.create(
+            id='scarf-1', title='Kente Scarf', slug='kente-scarf', price=30,
+            description='Scarf', category=category,
+        )
+
+    def review(self, name, rating, **fields):
+        return ProductReview.objects.create(
+            product=self.product, user_name=name, rating=rating, title='Review', comment='Nice', **fields
+        )
+
+    def assertStats(self, count, average, distribution):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.review_count, count)
+        self.assertAlmostEqual(self.product.average_rating, average)
+        self.assertEqual(self.product.rating_distribution, distribution)
+
+    def test_create_and_approve(self):
+        self.review('Ama', 5)
+        self.review('Kofi', 2)
+        pending = self.review('Esi', 4, is_approved=False)
+        self.assertStats(2, 3.5, {5: 1, 4: 0, 3: 0, 2: 1, 1: 0})
+
+        pending.is_approved = True
+        pending.save()
+        self.assertStats(3, 11 / 3, {5: 1, 4: 1, 3: 0, 2: 1, 1: 0})
+
+    def test_edit_rating(self):
+        review = self.review('Ama', 5)
+        review.rating = 1
+        review.save()
+        self.assertStats(1, 1.0, {5: 0, 4: 0, 3: 0, 2: 0, 1: 1})
+
+        # A review saved without being loaded first is rebuilt from the table
+        ProductReview(
+            pk=review.pk, product=self.product, user_name='Ama', rating=3, title='Review', comment='Ok',
+            created_at=review.created_at,
+        ).save()
+        self.assertStats(1, 3.0, {5: 0, 4: 0, 3: 1, 2: 0, 1: 0})
+
+    def test_delete(self):
+        self.review('Ama', 5)
+        review = self.review('Kofi', 3)
+        review.delete()
+        self.assertStats(1, 5.0, {5: 1, 4: 0, 3: 0, 2: 0, 1: 0})
+
+        ProductReview.objects.get().delete()
+        self.assertStats(0, 0.0, {5: 0, 4: 0, 3: 0, 2: 0, 1: 0})
+
+    def test_recalculate_repairs_drift(self):
+        self.review('Ama', 4)
+        Product.objects.filter(pk=self.product.pk).update(review_count=7, average_rating=1.0)
+        self.assertEqual(Product.recalculate_review_stats([self.product.pk]), 1)
+        self.assertStats(1, 4.0, {5: 0, 4: 1, 3: 0, 2: 0, 1: 0})
+        self.assertEqual(Product.recalculate_review_stats(), 0)
+
+    def test_admin_bulk_actions(self):
+        reviews = [self.review('Ama', 5, is_approved=False), self.review('Kofi', 3, is_approved=False)]
+        admin_user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin_user)
+
+        def run(action):
+            response = self.client.post('/admin/shop/productreview/', {
+                'action': action, '_selected_action': [review.pk for review in reviews],
+            })
+            self.assertEqual(response.status_code, 302)
+
+        run('approve_reviews')
+        self.assertStats(2, 4.0, {5: 1, 4: 0, 3: 1, 2: 0, 1: 0})
+        run('disapprove_reviews')
+        self.assertStats(0, 0.0, {5: 0, 4: 0, 3: 0, 2: 0, 1: 0})
+
+
+class ORJSONRendererTests(TestCase):
+    """ORJSONRenderer output is byte-for-byte what JSONRenderer would send"""
+
+    def assertSameAsDRF(self, data, media_type='application/json', context=None):
+        expected = JSONRenderer().render(data, media_type, context)
+        self.assertEqual(ORJSONRenderer().render(data, media_type, context), expected)
+        return expected
+
+    def test_types(self):
+        self.assertSameAsDRF({
+            'price': Decimal('19.99'),
+            'created_at': datetime(2026, 3, 6, 12, 30, 5, 123456, tzinfo=dt_timezone.utc),
+            'local': datetime(2026, 3, 6, 12, 30, tzinfo=dt_timezone(timedelta(hours=1))),
+            'naive': datetime(2026, 3, 6, 12, 30),
+            'day': date(2026, 3, 6),
+            'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'ratings': {5: 2, 1: 0},
+            'title': 'Kente “gold” – ₵',
+            'values': [None, True, 1.5, -3],
+        })
+
+    def test_line_separators_escaped(self):
+        rendered = self.assertSameAsDRF({'comment': 'one\u2028two\u2029three'})
+        self.assertEqual(rendered, b'{"comment":"one\\u2028two\\u2029three"}')
+
+    def test_indent(self):
+        data = {'items': [{'id': 1, 'price': Decimal('2.50')}]}
+        self.assertIn(b'\n    ', self.assertSameAsDRF(data, 'application/json; indent=4'))
+        self.assertSameAsDRF(data, context={'indent': 2})
+
+    @override_settings(CATALOG_SNAPSHOT_HOSTS=[])
+    def test_fast_path_listing(self):
+        category = Category.objects.create(key='caps', label='Caps', description='Caps')
+        Product.objects.create(
+            id='cap-1', title='Kente Cap', slug='kente-cap', price=Decimal('19.99'),
+            description='Cap', category=category, stock_quantity=2,
+        )
+        request = Request(APIRequestFactory().get('/api/shop/products/'))
+        fields, columns = row_fields()
+        items = build_rows(list(Product.objects.for_listing().values(*columns)), fields, request)
+        rendered = self.assertSameAsDRF(items)
+        self.assertEqual(json.loads(rendered), self.client.get('/api/shop/products/').json()['results'])
+
+        row = json.loads(rendered)[0]
+        serialized = json.loads(JSONRenderer().render(
+            ProductSerializer(Product.objects.for_listing().get(), context={'request': request}).data
+        ))
+        # The listing has always sent price as a number and created_at as
+        # isoformat(); every other field matches the serializer
+        self.assertEqual(row.pop('price'), 19.99)
+        self.assertEqual(serialized.pop('price'), '19.99')
+        self.assertEqual(row.pop('created_at').replace('+00:00', 'Z'), serialized.pop('created_at'))
+        self.assertEqual({name: row[name] for name in serialized if name in row}, {
+            name: value for name, value in serialized.items() if name in row
+        })
+        self.assertEqual(row['stock_quantity'], 2)
+
+
+class FailingConnection:
+    """Mail connection whose sends always fail"""
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP server went away')
+
+
+@override_settings(EMAIL_OUTBOX_ENABLED=True)
+class EmailOutboxTests(TestCase):
+    """Queued emails are sent by the worker, retried, then dead-lettered"""
+
+    def queue(self, subject='Order confirmed'):
+        message = EmailMultiAlternatives(subject, 'Thanks!', 'shop@example.com', ['buyer@example.com'])
+        message.attach_alternative('<p>Thanks!</p>', 'text/html')
+        EmailService.deliver(message)
+        return EmailOutbox.objects.get(subject=subject)
+
+    def test_queued_not_sent(self):
+        entry = self.queue()
+        self.assertEqual(entry.status, 'pending')
+        self.assertEqual(entry.html_body, '<p>Thanks!</p>')
+        self.assertEqual(mail.outbox, [])
+
+    def test_send_due_emails(self):
+        entry = self.queue()
+        self.assertEqual(email_outbox.send_due_emails(), (1, 0))
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'sent')
+        self.assertIsNotNone(entry.sent_at)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        # Nothing left to send
+        self.assertEqual(email_outbox.send_due_emails(), (0, 0))
+
+    def test_failed_send_retried_then_dead(self):
+        entry = self.queue()
+        now = timezone.now()
+        self.assertEqual(email_outbox.send_due_emails(FailingConnection(), now=now), (0, 1))
+
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'pending')
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(entry.next_attempt_at, now + email_outbox.retry_delay(1))
+        self.assertIn('went away', entry.last_error)
+        # Not due again before the backoff
+        self.assertEqual(email_outbox.send_due_emails(FailingConnection(), now=now), (0, 0))
+
+        for _ in range(email_outbox.MAX_ATTEMPTS - 1):
+            now += email_outbox.RETRY_MAX_DELAY
+            self.assertEqual(email_outbox.send_due_emails(FailingConnection(), now=now), (0, 1))
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'dead')
+        self.assertEqual(entry.attempts, email_outbox.MAX_ATTEMPTS)
+
+    def test_claimed_emails_reclaimed_after_timeout(self):
+        entry = self.queue()
+        now = timezone.now()
+        self.assertEqual(email_outbox.claim_due_emails(now=now), [entry])
+        # Another worker doesn't get it while the claim holds
+        self.assertEqual(email_outbox.claim_due_emails(now=now), [])
+
+        later = now + email_outbox.CLAIM_TIMEOUT
+        self.assertEqual(email_outbox.send_due_emails(now=later), (1, 0))
+        entry.refresh_from_db()
+        self.assertEqual(entry.status, 'sent')
@@ -1,16 +1,18 @@
 from django.urls import path, include
 from . import views
+from .catalog_snapshot import snapshot_view
 
 app_name = 'shop'
 
 urlpatterns = [
     # Categories
-    path('categories/', views.CategoryListView.as_view(), name='category-list'),
+    path('categories/', snapshot_view('categories', views.CategoryListView.as_view()), name='category-list'),
     path('categories/featured/', views.FeaturedCategoriesView.as_view(), name='featured-categories'),
     
     # Products
-    path('products/', views.simple_products, name='product-list'),  # Temporarily use simple view
-    path('products/featured/', views.FeaturedProductsView.as_view(), name='featured-products'),
+    path('products/', snapshot_view('products', views.simple_products), name='product-list'),  # Temporarily use simple view
+    path('products/featured/', snapshot_view('featured', views.FeaturedProductsView.as_view()), name='featured-products'),
+    path('products/facets/', views.product_facets, name='product-facets'),
     path('products/<slug:slug>/', views.ProductDetailView.as_view(), name='product-detail'),
     path('products/search/', views.product_search, name='product-search'),
     
@@ -37,7 +39,9 @@ urlpatterns = [
     
     # Stats
     path('stats/', views.shop_stats, name='shop-stats'),
+    path('cache-stats/', views.cache_stats, name='cache-stats'),
     path('search/', views.product_search, name='search'),
+    path('search/suggest/', views.search_suggest, name='search-suggest'),
     
     # Debug
     path('debug-products/', views.debug_products, name='debug-products'),
@@ -1,25 +1,60 @@
 from rest_framework import generics, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.db.models import Q, Avg, Count
+from django.db.models import Q, Count
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from .models import Category, Product, ProductTag, Order, ProductVariant, PromoCode, ProductReview, ReviewHelpfulVote
+from . import cache as shop_cache
+from .catalog_cache import catalog_cached
+from .facets import ProductFilter, facet_counts
+from .idempotency import idempotent
+from .inventory import check_carts
+from .models import Category, Product, ProductTag, Order, PromoCode, ProductReview, ReviewHelpfulVote
+from .pagination import InvalidCursor, KeysetPagination
+from .price_book import BASE_CURRENCY, lookup_prices, resolve_currency
+from .product_rows import PRODUCT_ROW_FIELDS, build_rows, row_fields
+from .search import search_products
+from .suggest import suggest
 from .serializers import (
     CategorySerializer, ProductSerializer, ProductFullSerializer, ProductTagSerializer,
     OrderSerializer, CreateOrderSerializer, PromoCodeSerializer, ValidatePromoCodeSerializer,
-    ProductReviewSerializer, CreateReviewSerializer, ReviewStatsSerializer, ReviewHelpfulVoteSerializer
+    ProductReviewSerializer, CreateReviewSerializer, ReviewStatsSerializer, ReviewHelpfulVoteSerializer,
+    sparse_fieldset
 )
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class LocalizedPricesMixin:
+    """
+    Adds the localized prices of the products being serialized to the
+    serializer context, when the request wants a currency other than USD
+    (?currency= or Accept-Language, see shop.price_book).
+    """
+    include_variants = False
+    
+    def get_serializer(self, *args, **kwargs):
+        currency = resolve_currency(self.request)
+        if args and currency != BASE_CURRENCY:
+            products = args[0] if kwargs.get('many') else [args[0]]
+            kwargs['context'] = {
+                **self.get_serializer_context(),
+                'local_prices': lookup_prices(currency, [product.pk for product in products], self.include_variants),
+            }
+        return super().get_serializer(*args, **kwargs)
+
+
+@method_decorator(catalog_cached(stock=False), name='dispatch')
 class CategoryListView(generics.ListAPIView):
-    """List all categories"""
-    queryset = Category.objects.all()
+    """List all categories (supports ?fields= / ?exclude=)"""
     serializer_class = CategorySerializer
+    
+    def get_queryset(self):
+        return CategorySerializer.project(Category.objects.all(), self.request)
 
 
 class FeaturedCategoriesView(generics.ListAPIView):
@@ -28,56 +63,42 @@ class FeaturedCategoriesView(generics.ListAPIView):
     serializer_class = CategorySerializer
 
 
-class ProductListView(generics.ListAPIView):
+class ProductListView(LocalizedPricesMixin, generics.ListAPIView):
     """List all products with optional filtering"""
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         try:
-            # Start with basic queryset - no prefetch_related for now
-            queryset = Product.objects.filter(is_active=True).select_related('category')
-            
-            # Filter by category
-            category = self.request.query_params.get('category')
-            if category:
-                queryset = queryset.filter(category__key=category)
-            
-            # Search functionality
-            search = self.request.query_params.get('search')
-            if search:
-                queryset = queryset.filter(
-                    Q(title__icontains=search) | 
-                    Q(description__icontains=search)
-                )
-            
-            # Filter by stock availability
-            in_stock = self.request.query_params.get('in_stock')
-            if in_stock and in_stock.lower() == 'true':
-                queryset = queryset.filter(stock_quantity__gt=0)
-            
-            return queryset
+            # category, size, color, price, rating, availability and search
+            queryset = ProductFilter(self.request.query_params).apply(Product.objects.for_listing())
+            # ?fields= / ?exclude= also trim the columns loaded
+            return ProductSerializer.project(queryset, self.request, also=KeysetPagination.key_fields())
         except Exception as e:
             # Return empty queryset if there's an error
             return Product.objects.none()
 
 
-class FeaturedProductsView(generics.ListAPIView):
+@method_decorator(catalog_cached, name='dispatch')
+class FeaturedProductsView(LocalizedPricesMixin, generics.ListAPIView):
     """List featured products"""
     serializer_class = ProductSerializer
     
     def get_queryset(self):
-        # Use the is_featured field
-        return Product.objects.filter(
-            is_active=True,
-            is_featured=True
-        ).select_related('category')
+        queryset = Product.objects.for_listing().filter(is_featured=True)
+        return ProductSerializer.project(queryset, self.request)
 
 
-class ProductDetailView(generics.RetrieveAPIView):
+@method_decorator(catalog_cached, name='dispatch')
+class ProductDetailView(LocalizedPricesMixin, generics.RetrieveAPIView):
     """Get product details by slug"""
-    queryset = Product.objects.filter(is_active=True).select_related('category')
     serializer_class = ProductFullSerializer
     lookup_field = 'slug'
+    include_variants = True
+    
+    def get_queryset(self):
+        queryset = ProductFullSerializer.setup_eager_loading(Product.objects.filter(is_active=True))
+        return ProductFullSerializer.project(queryset, self.request)
 
 
 class ProductTagListView(generics.ListAPIView):
@@ -86,113 +107,48 @@ class ProductTagListView(generics.ListAPIView):
     serializer_class = ProductTagSerializer
 
 
+@method_decorator(idempotent('order-create'), name='create')
 class OrderCreateView(generics.CreateAPIView):
-    """Create a new order"""
+    """Create a new order (retries with the same Idempotency-Key replay the first response)"""
     queryset = Order.objects.all()
     serializer_class = CreateOrderSerializer
 
 
 class OrderDetailView(generics.RetrieveAPIView):
     """Get order details"""
-    queryset = Order.objects.all()
     serializer_class = OrderSerializer
     lookup_field = 'id'
+    
+    def get_queryset(self):
+        return OrderSerializer.project(Order.objects.all(), self.request)
 
 
 class ValidateStockView(APIView):
-    """Validate stock availability for cart items"""
+    """
+    Validate stock availability for cart items.
+    
+    Send `items` for one cart, or `carts` - a list of
+    {"id", "items", "payment_reference"} - to check many carts in one
+    request. Products and variants are loaded once for the whole payload.
+    Quantities are net of other customers' active reservations; a cart's
+    `payment_reference` counts its own holds as available.
+    """
+    
+    # Lines per request (summed over all carts)
+    max_lines = 10000
     
     def post(self, request):
         try:
+            if 'carts' in request.data:
+                return self.validate_carts(request.data['carts'])
+            
             items = request.data.get('items', [])
             if not items:
                 return Response({'error': 'No items provided'}, status=status.HTTP_400_BAD_REQUEST)
+            if not isinstance(items, list) or len(items) > self.max_lines:
+                return Response({'error': f'items must be a list of at most {self.max_lines} lines'}, status=status.HTTP_400_BAD_REQUEST)
             
-            stock_errors = []
-            stock_warnings = []
-            
-            for item in items:
-                try:
-                    product = Product.objects.get(id=item['product_id'])
-                    requested_quantity = item.get('quantity', 1)
-                    variant_id = item.get('variant_id')
-                    
-                    # Check if product is active
-                    if not product.is_active:
-                        stock_errors.append({
-                            'product_id': product.id,
-                            'product_title': product.title,
-                            'error': 'Product is no longer available'
-                        })
-                        continue
-                    
-                    # Check variant stock if variant is specified
-                    if variant_id:
-                        try:
-                            variant = ProductVariant.objects.get(id=variant_id, product=product)
-                            if not variant.is_available:
-                                stock_errors.append({
-                                    'product_id': product.id,
-                                    'product_title': product.title,
-                                    'variant_id': variant_id,
-                                    'error': 'Selected variant is not available'
-                                })
-                            elif variant.stock_quantity == 0:
-                                stock_errors.append({
-                                    'product_id': product.id,
-                                    'product_title': product.title,
-                                    'variant_id': variant_id,
-                                    'error': 'Selected variant is out of stock'
-                                })
-                            elif variant.stock_quantity < requested_quantity:
-                                stock_errors.append({
-                                    'product_id': product.id,
-                                    'product_title': product.title,
-                                    'variant_id': variant_id,
-                                    'error': f'Only {variant.stock_quantity} in stock, but {requested_quantity} requested',
-                                    'available_quantity': variant.stock_quantity
-                                })
-                            elif variant.stock_quantity <= 5:  # Low stock warning
-                                stock_warnings.append({
-                                    'product_id': product.id,
-                                    'product_title': product.title,
-                                    'variant_id': variant_id,
-                                    'warning': f'Low stock: only {variant.stock_quantity} remaining'
-                                })
-                        except ProductVariant.DoesNotExist:
-                            stock_errors.append({
-                                'product_id': product.id,
-                                'product_title': product.title,
-                                'variant_id': variant_id,
-                                'error': 'Selected variant not found'
-                            })
-                    else:
-                        # Check main product stock
-                        if not product.is_in_stock:
-                            stock_errors.append({
-                                'product_id': product.id,
-                                'product_title': product.title,
-                                'error': 'Product is out of stock'
-                            })
-                        elif product.stock_quantity < requested_quantity:
-                            stock_errors.append({
-                                'product_id': product.id,
-                                'product_title': product.title,
-                                'error': f'Only {product.stock_quantity} in stock, but {requested_quantity} requested',
-                                'available_quantity': product.stock_quantity
-                            })
-                        elif product.stock_quantity <= 5:  # Low stock warning
-                            stock_warnings.append({
-                                'product_id': product.id,
-                                'product_title': product.title,
-                                'warning': f'Low stock: only {product.stock_quantity} remaining'
-                            })
-                            
-                except Product.DoesNotExist:
-                    stock_errors.append({
-                        'product_id': item.get('product_id'),
-                        'error': 'Product not found'
-                    })
+            [(stock_errors, stock_warnings)] = check_carts([(items, request.data.get('payment_reference'))])
             
             return Response({
                 'valid': len(stock_errors) == 0,
@@ -204,6 +160,32 @@ class ValidateStockView(APIView):
         except Exception as e:
             logger.error(f"Stock validation error: {e}")
             return Response({'error': 'Failed to validate stock'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    def validate_carts(self, carts):
+        if not isinstance(carts, list) or not all(
+            isinstance(cart, dict) and isinstance(cart.get('items', []), list) for cart in carts
+        ):
+            return Response({'error': 'carts must be a list of {"id", "items"} objects'}, status=status.HTTP_400_BAD_REQUEST)
+        if sum(len(cart.get('items', [])) for cart in carts) > self.max_lines:
+            return Response({'error': f'At most {self.max_lines} lines per request'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        checked = check_carts([(cart.get('items', []), cart.get('payment_reference')) for cart in carts])
+        results = [
+            {
+                'id': cart.get('id', index),
+                'valid': len(errors) == 0,
+                'errors': errors,
+                'warnings': warnings,
+            }
+            for index, (cart, (errors, warnings)) in enumerate(zip(carts, checked))
+        ]
+        valid_count = sum(result['valid'] for result in results)
+        return Response({
+            'results': results,
+            'valid_count': valid_count,
+            'invalid_count': len(results) - valid_count,
+            'message': 'Stock validation completed'
+        })
 
 
 class ValidatePromoCodeView(APIView):
@@ -276,24 +258,83 @@ def shop_stats(request):
     })
 
 
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    """Cache hits and misses per namespace, for the worker that answers (staff only)"""
+    from django.conf import settings
+    import os
+    
+    return Response({
+        'backend': settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1],
+        'pid': os.getpid(),
+        'namespaces': shop_cache.stats(),
+    })
+
+
 @api_view(['GET'])
 @csrf_exempt
 def product_search(request):
-    """Search products"""
+    """Full-text product search, best matches first (`q`, `page`, `page_size`)"""
     query = request.GET.get('q', '')
     if not query:
         return Response({'results': [], 'count': 0})
     
-    products = Product.objects.filter(
-        Q(title__icontains=query) | Q(description__icontains=query),
-        is_active=True
-    ).select_related('category')
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+        page_size = max(1, min(int(request.GET.get('page_size', 20)), 100))
+    except ValueError:
+        return Response({'error': 'page and page_size must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    products, total = search_products(
+        Product.objects.for_listing(), query, offset=(page - 1) * page_size, limit=page_size
+    )
     
-    serializer = ProductSerializer(products, many=True)
+    currency = resolve_currency(request)
+    context = {}
+    if currency != BASE_CURRENCY:
+        context['local_prices'] = lookup_prices(currency, [product.pk for product in products])
+    serializer = ProductSerializer(products, many=True, context=context)
     return Response({
         'results': serializer.data,
-        'count': products.count(),
-        'query': query
+        'count': total,
+        'query': query,
+        'page': page,
+        'page_size': page_size,
+        'has_next': page * page_size < total,
+    })
+
+
+@catalog_cached
+@api_view(['GET'])
+@csrf_exempt
+def product_facets(request):
+    """
+    Facet counts (category, size, color, price, rating, availability) for
+    the given product filters; accepts the same parameters as the list.
+    """
+    try:
+        product_filter = ProductFilter(request.GET)
+        result = facet_counts(product_filter)
+        return Response({**result, 'selected': product_filter.selected()})
+    except Exception as e:
+        logger.error(f"Facet counts failed: {e}")
+        return Response({'error': str(e)}, status=500)
+
+
+@api_view(['GET'])
+@csrf_exempt
+def search_suggest(request):
+    """Typo-tolerant autocomplete over product, category and tag names (`q`, `limit`)"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 8)), 20))
+    except ValueError:
+        limit = 8
+    
+    return Response({
+        'query': query,
+        'results': suggest(query, limit) if query else [],
     })
 
 
@@ -346,65 +387,46 @@ def debug_products(request):
         }, status=500)
 
 
+@catalog_cached
 @api_view(['GET'])
 @csrf_exempt
 def simple_products(request):
-    """Simple products endpoint without complex serialization"""
+    """
+    Simple products endpoint without complex serialization.
+    
+    Keyset paginated: follow the `next`/`previous` links (opaque `cursor`
+    parameter); `sort`, `page_size` and `include_total=true` are optional.
+    `?fields=card` (or an explicit `fields=`/`exclude=` list) trims the
+    response and the columns loaded.
+    """
     try:
-        # Get category filter if provided
-        category = request.GET.get('category')
+        # Same filters as the facets endpoint (category, size, color, price, ...)
+        queryset = ProductFilter(request.GET).apply(Product.objects.for_listing())
         
-        # Build queryset
-        queryset = Product.objects.filter(is_active=True).select_related('category')
+        # Read-only list: plain values() rows instead of model instances,
+        # selecting only the columns the requested fields read
+        selected = sparse_fieldset(request.GET, PRODUCT_ROW_FIELDS, ProductSerializer.fieldsets)
+        fields, columns = row_fields(selected)
+        queryset = queryset.values(*columns | KeysetPagination.key_fields())
         
-        if category:
-            queryset = queryset.filter(category__key=category)
+        paginator = KeysetPagination()
+        try:
+            rows = paginator.paginate_queryset(queryset, request)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        products = queryset[:50]  # Limit to 50 products
+        simple_data = build_rows(rows, fields, request)
         
-        simple_data = []
-        for product in products:
-            # Build image URL using the new method
-            try:
-                image_url = product.get_image_url()
-                # If it's a relative URL (uploaded file), make it absolute
-                if image_url.startswith('/'):
-                    image_url = request.build_absolute_uri(image_url)
-            except:
-                image_url = "https://via.placeholder.com/400x400/e5e7eb/6b7280?text=No+Image"
-            
-            # Calculate review data
-            from django.db.models import Avg
-            reviews = product.reviews.filter(is_approved=True)
-            avg_rating = reviews.aggregate(Avg('rating'))['rating__avg']
-            average_rating = round(avg_rating, 1) if avg_rating else 0.0
-            total_reviews = reviews.count()
-            
-            simple_data.append({
-                'id': product.id,
-                'title': product.title,
-                'slug': product.slug,
-                'price': product.price,
-                'price_display': f"${product.price:.2f}",
-                'description': product.description,
-                'image': image_url,
-                'category': product.category.key if product.category else None,
-                'category_label': product.category.label if product.category else None,
-                'stock_quantity': product.stock_quantity,
-                'is_active': product.is_active,
-                'is_in_stock': product.is_in_stock,
-                'is_featured': getattr(product, 'is_featured', False),
-                'tags': [],  # Default for now
-                'created_at': product.created_at.isoformat() if product.created_at else None,
-                'average_rating': average_rating,
-                'total_reviews': total_reviews,
-            })
+        # Localized prices (?currency= / Accept-Language) are precomputed
+        currency = resolve_currency(request)
+        if currency != BASE_CURRENCY and (selected is None or 'price' in selected):
+            local_prices = lookup_prices(currency, [row['id'] for row in rows])
+            for item, row in zip(simple_data, rows):
+                item.update(local_prices.for_product(row['id']))
         
-        return Response({
-            'results': simple_data,
-            'count': len(simple_data),
-            'message': 'Simple products data with full fields'
-        })
+        payload = paginator.get_paginated_payload(simple_data)
+        payload['message'] = 'Simple products data with full fields'
+        return Response(payload)
         
     except Exception as e:
         return Response({
@@ -658,31 +680,22 @@ class ProductReviewListCreateView(generics.ListCreateAPIView):
         })
     
     def get_review_stats(self, product_id):
-        """Calculate review statistics for a product"""
-        reviews = ProductReview.objects.filter(
-            product_id=product_id,
-            is_approved=True
-        )
+        """Review statistics for a product, read from its stored aggregates"""
+        product = Product.objects.filter(pk=product_id).only(
+            'pk', 'average_rating', 'review_count', *Product.RATING_COUNT_FIELDS.values()
+        ).first()
         
-        total_reviews = reviews.count()
-        if total_reviews == 0:
+        if not product or product.review_count == 0:
             return {
                 'average_rating': 0,
                 'total_reviews': 0,
                 'rating_distribution': {5: 0, 4: 0, 3: 0, 2: 0, 1: 0}
             }
         
-        avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-        
-        # Rating distribution
-        distribution = {}
-        for rating in [5, 4, 3, 2, 1]:
-            distribution[rating] = reviews.filter(rating=rating).count()
-        
         return {
-            'average_rating': round(avg_rating, 2),
-            'total_reviews': total_reviews,
-            'rating_distribution': distribution
+            'average_rating': round(product.average_rating, 2),
+            'total_reviews': product.review_count,
+            'rating_distribution': product.rating_distribution
         }
     
     def create(self, request, *args, **kwargs):
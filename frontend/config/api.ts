@@ -6,6 +6,12 @@ export const API_BASE_URL = isDevelopment
   ? 'http://localhost:8000'
   : _env.VITE_API_URL || 'https://entstores-production.up.railway.app';
 
+// Payment status streams; served by the backend's ASGI `events` service
+// when VITE_EVENTS_URL points to it, otherwise by the main API
+export const EVENTS_BASE_URL = isDevelopment
+  ? API_BASE_URL
+  : _env.VITE_EVENTS_URL || API_BASE_URL;
+
 export const API_ENDPOINTS = {
   // Payment endpoints
   EXCHANGE_RATE: `${API_BASE_URL}/api/payments/exchange-rate/`,
@@ -13,6 +19,7 @@ export const API_ENDPOINTS = {
   STRIPE_VERIFY: `${API_BASE_URL}/api/payments/stripe/verify-session/`,
   MOMO_INITIATE: `${API_BASE_URL}/api/payments/momo/initiate/`,
   MOMO_STATUS: `${API_BASE_URL}/api/payments/momo/status/`,
+  MOMO_STATUS_EVENTS: (reference: string) => `${EVENTS_BASE_URL}/api/payments/momo/status/${reference}/events/`,
   CREATE_ORDER: `${API_BASE_URL}/api/payments/create-order/`,
   CREATE_FREE_ORDER: `${API_BASE_URL}/api/payments/create-free-order/`,
   
@@ -13,7 +13,7 @@ import { Badge } from '../components/ui/badge';
 import { CreditCard, Smartphone, Shield, Clock, CheckCircle, AlertCircle, Globe, MapPin, Tag } from 'lucide-react';
 import PageTransition from '../components/ui/PageTransition';
 import { motion } from 'framer-motion';
-import { API_ENDPOINTS, API_BASE_URL } from '../config/api';
+import { API_ENDPOINTS } from '../config/api';
 import { countries, getShippingCost, getShippingZone } from '../data/countries';
 import { requiresPayment, getCheckoutFlow, getCheckoutMessage } from '../utils/countryPaymentRules';
 
@@ -177,11 +177,14 @@ export default function Checkout() {
           amount: i.price, 
           quantity: i.quantity, 
           image: i.image,
-          shipping_cost: i.shipping_cost || 9.99 // Include shipping cost per item
+          shipping_cost: i.shipping_cost || 9.99, // Include shipping cost per item
+          // Lets the backend hold the stock while the customer pays
+          product_id: i.id,
+          variant_id: i.variantId || null
         }));
         
         // Add shipping and tax as separate line items if they exist
-        const checkoutItems = [...items];
+        const checkoutItems: Array<Record<string, unknown>> = [...items];
         if (finalShipping > 0) {
           checkoutItems.push({
             title: 'Shipping',
@@ -245,7 +248,17 @@ export default function Checkout() {
         const resp = await fetch(API_ENDPOINTS.MOMO_INITIATE, {
           method: 'POST',
           headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ phone: momoPhone, amount: total, currency: 'USD' }),
+          body: JSON.stringify({
+            phone: momoPhone,
+            amount: total,
+            currency: 'USD',
+            // Held while the customer approves the payment
+            items: state.items.map((i) => ({
+              product_id: i.id,
+              variant_id: i.variantId || null,
+              quantity: i.quantity
+            }))
+          }),
         });
         const data = await resp.json();
         if (data.reference) {
@@ -253,12 +266,13 @@ export default function Checkout() {
           setMomoStatus(data.status || 'pending');
           setMomoConversion(data.currency_conversion);
           
-          // poll status every 2s
-          const interval = setInterval(async () => {
-            const s = await (await fetch(`${API_BASE_URL}/api/payments/momo/status/${data.reference}/`)).json();
+          // The server pushes every status change (SSE) instead of us polling
+          const events = new EventSource(API_ENDPOINTS.MOMO_STATUS_EVENTS(data.reference));
+          events.addEventListener('status', (event) => {
+            const s = JSON.parse((event as MessageEvent).data);
             setMomoStatus(s.status);
             if (s.status === 'success') {
-              clearInterval(interval);
+              events.close();
               // complete order
               const orderId = Math.random().toString(36).slice(2, 10).toUpperCase();
               const summary = { 
@@ -279,10 +293,17 @@ export default function Checkout() {
               navigate('/order-confirmation', { state: summary });
             }
             if (s.status === 'failed') {
-              clearInterval(interval);
+              events.close();
               alert('Payment failed');
             }
-          }, 2000);
+          });
+          events.addEventListener('error', (event) => {
+            // Server-sent error (unknown reference); dropped connections reconnect on their own
+            if ((event as MessageEvent).data) {
+              events.close();
+              alert('Payment not found');
+            }
+          });
         } else {
           alert('Failed to initiate MoMo payment.');
         }